@@ -0,0 +1,297 @@
+"""
+Cache of Finished EPUBs, Keyed by Article URL
+
+When a newsletter goes out, many users forward the same URL within minutes.
+The first conversion stores its EPUB here; later requests for the same
+(normalized) URL within ARTICLE_CACHE_TTL skip extraction and EPUB building
+and go straight to sending.
+
+Concurrent requests for the same URL are coalesced with SingleFlight, so only
+one thread converts while the others wait for its result.
+
+Each entry records a validator for the page it was built from (a digest of
+the HTML). Once an entry expires it is offered to the next build as stale:
+if the page comes back unchanged (typically a 304 from the HTTP cache, see
+app/http_cache.py) the build returns it and the entry is refreshed, without
+extracting, downloading images or building the EPUB again.
+
+Layout under ARTICLE_CACHE_DIR:
+    index.db                 SQLite index: URL key → title, size, LRU time
+    <key>/<Title_stamp>.epub The EPUB, keeping its original filename for sending
+"""
+
+import hashlib
+import shutil
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from .epub import EpubFile
+from .config import ARTICLE_CACHE_DIR, ARTICLE_CACHE_MAX_BYTES, ARTICLE_CACHE_TTL
+
+# Query parameters that only track where a click came from. Names match exactly,
+# apart from the utm_* family; anything else may select content and stays in the key.
+TRACKING_PARAMS = frozenset(('fbclid', 'gclid', 'mc_cid', 'mc_eid'))
+TRACKING_PREFIX = 'utm_'
+
+
+def normalize_url(url):
+    """
+    Canonical form of an article URL for cache keys.
+
+    Lowercases scheme and host, drops the fragment, tracking parameters and a
+    trailing slash, and sorts the remaining query parameters.
+    """
+    url = url.strip()
+    if url.startswith('www.'):
+        url = 'https://' + url
+    parts = urlsplit(url)
+    query = sorted(
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if k not in TRACKING_PARAMS and not k.startswith(TRACKING_PREFIX)
+    )
+    path = parts.path.rstrip('/') or '/'
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), path, urlencode(query), ''))
+
+
+class SingleFlight:
+    """Run at most one call per key at a time; concurrent callers share its result."""
+
+    class _Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = self._Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+class ArticleCache:
+    def __init__(self, directory=ARTICLE_CACHE_DIR, max_bytes=ARTICLE_CACHE_MAX_BYTES, ttl=ARTICLE_CACHE_TTL):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.flight = SingleFlight()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.directory / 'index.db'), check_same_thread=False, timeout=30)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS articles (
+                key TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                filename TEXT NOT NULL,
+                title TEXT,
+                image_count INTEGER NOT NULL DEFAULT 0,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        ''')
+        existing = {row[1] for row in self._conn.execute('PRAGMA table_info(articles)')}
+        if 'validator' not in existing:
+            self._conn.execute('ALTER TABLE articles ADD COLUMN validator TEXT')
+        self._conn.commit()
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key_for(url, variant=None):
+        """Entry key for a URL; variant separates builds of it for different device profiles."""
+        key = normalize_url(url) if not variant else f"{normalize_url(url)}#{variant}"
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    def get(self, url, variant=None):
+        """Return the cached article dict (epub, title, image_count) or None."""
+        key = self.key_for(url, variant)
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT filename, title, image_count, created_at, validator FROM articles WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            filename, title, image_count, created_at, validator = row
+            path = self.directory / key / filename
+            expired = time.time() - created_at > self.ttl
+            if not path.exists() or (expired and not validator):
+                self._remove(key)
+                self._conn.commit()
+                self.misses += 1
+                return None
+            if expired:
+                # Kept for stale(); evicted like any other entry if never revalidated
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._conn.execute('UPDATE articles SET last_access = ? WHERE key = ?', (time.time(), key))
+            self._conn.commit()
+        return {'epub': EpubFile.from_path(path), 'title': title, 'image_count': image_count}
+
+    def stale(self, url, variant=None):
+        """
+        An expired entry's article dict with its 'validator', or None. Doesn't
+        count as a hit; pass the dict back to refresh() if the page is unchanged.
+        """
+        key = self.key_for(url, variant)
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT filename, title, image_count, validator FROM articles WHERE key = ? AND validator IS NOT NULL',
+                (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        filename, title, image_count, validator = row
+        path = self.directory / key / filename
+        if not path.exists():
+            return None
+        return {'epub': EpubFile.from_path(path), 'title': title, 'image_count': image_count, 'validator': validator}
+
+    def refresh(self, url, variant=None):
+        """Restart an entry's TTL after its page was found unchanged."""
+        now = time.time()
+        with self._lock:
+            self.hits += 1
+            self.revalidations += 1
+            self._conn.execute(
+                'UPDATE articles SET created_at = ?, last_access = ? WHERE key = ?',
+                (now, now, self.key_for(url, variant))
+            )
+            self._conn.commit()
+
+    def put(self, url, epub, title, image_count=0, variant=None, validator=None):
+        """
+        Store a freshly built EPUB (an in-memory or stored EpubFile) and return
+        its cached article dict. The returned EpubFile keeps the in-memory
+        bytes, so the caller can send without reading the copy back.
+        validator identifies the page it was built from (see stale()).
+        """
+        key = self.key_for(url, variant)
+        entry_dir = self.directory / key
+        with self._lock:
+            self._remove(key)
+            entry_dir.mkdir(exist_ok=True)
+            dest = entry_dir / epub.filename
+            if epub.data is not None:
+                dest.write_bytes(epub.data)
+            else:
+                shutil.copyfile(epub.path, dest)
+            now = time.time()
+            self._conn.execute(
+                'INSERT INTO articles (key, url, filename, title, image_count, size, created_at, last_access, '
+                'validator) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (key, normalize_url(url), epub.filename, title, image_count, dest.stat().st_size, now, now,
+                 validator)
+            )
+            self._evict(keep=key)
+            self._conn.commit()
+        return {'epub': EpubFile(epub.filename, data=epub.data, path=dest), 'title': title, 'image_count': image_count}
+
+    def get_or_build(self, url, build, variant=None):
+        """
+        Return the cached article for url, or build it exactly once.
+
+        build(stale) gets the expired entry for url (see stale()) or None, and
+        must return a dict with 'epub' (an EpubFile), 'title', 'image_count'
+        and optionally 'validator', or stale itself if the page is unchanged,
+        which refreshes the entry instead of storing a new one. Concurrent
+        callers for the same URL wait for the first one's build.
+        """
+        cached = self.get(url, variant)
+        if cached:
+            print(f"💾 Article cache hit: {url}")
+            return cached
+
+        def build_and_store():
+            # Re-check: a previous flight may have finished while we queued
+            cached = self.get(url, variant)
+            if cached:
+                return cached
+            stale = self.stale(url, variant)
+            article = build(stale)
+            if stale is not None and article is stale:
+                self.refresh(url, variant)
+                return stale
+            return self.put(url, article['epub'], article['title'], article.get('image_count', 0), variant,
+                            validator=article.get('validator'))
+
+        return self.flight.do(self.key_for(url, variant), build_and_store)
+
+    def stats(self):
+        with self._lock:
+            count, total = self._conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM articles'
+            ).fetchone()
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'revalidations': self.revalidations,
+            'evictions': self.evictions,
+            'articles': count,
+            'bytes': total,
+        }
+
+    def _remove(self, key):
+        """Delete an entry and its files. Caller holds the lock."""
+        self._conn.execute('DELETE FROM articles WHERE key = ?', (key,))
+        shutil.rmtree(self.directory / key, ignore_errors=True)
+
+    def _evict(self, keep):
+        """Drop least recently used articles until under max_bytes. Caller holds the lock."""
+        total = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM articles').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._conn.execute(
+            'SELECT key, size FROM articles WHERE key != ? ORDER BY last_access', (keep,)
+        ).fetchall():
+            self._remove(key)
+            self.evictions += 1
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_article_cache():
+    """Process-wide article cache, or None when ARTICLE_CACHE_MAX_BYTES is 0."""
+    global _default_cache
+    if ARTICLE_CACHE_MAX_BYTES <= 0:
+        return None
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = ArticleCache()
+        return _default_cache
@@ -14,6 +14,11 @@ IMAP_HOST = 'imap.gmail.com'
 # Kindle Configuration
 KINDLE_EMAIL = os.getenv('KINDLE_EMAIL')
 
+# Delivery Backend: sendgrid, smtp or file (writes .eml files to DELIVERY_FILE_DIR)
+DELIVERY_BACKEND = os.getenv('DELIVERY_BACKEND', 'sendgrid')
+DELIVERY_FILE_DIR = Path(os.getenv('DELIVERY_FILE_DIR', str(BASE_DIR / 'outbox')))
+SENDGRID_POOL_SIZE = int(os.getenv('SENDGRID_POOL_SIZE', '10'))
+
 # SMTP Configuration
 SMTP_SERVER = os.getenv('SMTP_SERVER', 'smtp-mail.outlook.com')
 SMTP_PORT = int(os.getenv('SMTP_PORT', '587'))
@@ -24,3 +29,119 @@ SMTP_PASSWORD = os.getenv('SMTP_PASSWORD')
 MAX_IMAGE_WIDTH = 800
 MAX_IMAGE_HEIGHT = 1200
 IMAGE_QUALITY = 85
+
+# Kindle Device Profiles (image output per device; users pick theirs in settings, see app/devices.py)
+# Images are sized to the text column (~80% of the screen in pixels). E-ink screens show 16 grays,
+# so color is wasted bytes there; Colorsoft renders color at 150 ppi, half its 300 ppi grayscale.
+DEVICE_PROFILES = {
+    'generic': {'label': 'Other / not sure', 'max_width': MAX_IMAGE_WIDTH, 'max_height': MAX_IMAGE_HEIGHT,
+                'grayscale': False, 'quality': IMAGE_QUALITY, 'progressive': False},
+    'kindle': {'label': 'Kindle (6")', 'max_width': 860, 'max_height': 1160,
+               'grayscale': True, 'quality': 70, 'progressive': True},
+    'paperwhite': {'label': 'Kindle Paperwhite', 'max_width': 990, 'max_height': 1320,
+                   'grayscale': True, 'quality': 70, 'progressive': True},
+    'oasis': {'label': 'Kindle Oasis', 'max_width': 1010, 'max_height': 1340,
+              'grayscale': True, 'quality': 70, 'progressive': True},
+    'scribe': {'label': 'Kindle Scribe', 'max_width': 1490, 'max_height': 1980,
+               'grayscale': True, 'quality': 60, 'progressive': True},
+    'colorsoft': {'label': 'Kindle Colorsoft', 'max_width': 632, 'max_height': 840,
+                  'grayscale': False, 'quality': 80, 'progressive': True},
+}
+DEFAULT_DEVICE_PROFILE = os.getenv('DEFAULT_DEVICE_PROFILE', 'generic')
+
+# Database engine. DATABASE_URL comes from Railway (Postgres); without it a local SQLite file is used.
+# Pool settings apply per process (gunicorn worker or job worker); 0 disables the statement timeout.
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '5'))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '10'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '30'))
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', '1800'))
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', '1') == '1'
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', '30000'))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', '15000'))
+
+# User lookup cache (by email and id; USER_CACHE_MAX_ENTRIES=0 disables it)
+USER_CACHE_MAX_ENTRIES = int(os.getenv('USER_CACHE_MAX_ENTRIES', '1024'))
+USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', '60'))
+
+# Background Job Queue
+JOB_WORKER_CONCURRENCY = int(os.getenv('JOB_WORKER_CONCURRENCY', '2'))
+JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', '1.0'))
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '3'))
+JOB_STALE_SECONDS = int(os.getenv('JOB_STALE_SECONDS', '600'))
+# A running job whose worker hasn't written a heartbeat (every JOB_PROGRESS_INTERVAL) for
+# JOB_STALE_SECONDS is taken to be orphaned by a crashed worker; a running worker looks for
+# such jobs every JOB_RECOVERY_INTERVAL
+JOB_RECOVERY_INTERVAL = float(os.getenv('JOB_RECOVERY_INTERVAL', '60'))
+# How often a worker writes job progress to the database, and how the web UI
+# streams it: polled every SSE_POLL_INTERVAL, each stream ending after
+# SSE_STREAM_SECONDS (the browser reconnects). An open stream holds one of
+# gunicorn's --threads (Procfile), so at most SSE_MAX_STREAMS run per process;
+# keep it well below --threads so webhooks and pages are served. Viewers over
+# the limit poll /api/jobs/<id> instead.
+JOB_PROGRESS_INTERVAL = float(os.getenv('JOB_PROGRESS_INTERVAL', '0.5'))
+SSE_POLL_INTERVAL = float(os.getenv('SSE_POLL_INTERVAL', '0.5'))
+SSE_STREAM_SECONDS = float(os.getenv('SSE_STREAM_SECONDS', '10'))
+SSE_MAX_STREAMS = int(os.getenv('SSE_MAX_STREAMS', '4'))
+
+# Image Download Concurrency
+IMAGE_DOWNLOAD_WORKERS = int(os.getenv('IMAGE_DOWNLOAD_WORKERS', '8'))
+IMAGE_PHASE_DEADLINE = float(os.getenv('IMAGE_PHASE_DEADLINE', '60'))
+
+# Download Size Limits (bound memory per conversion on hostile pages)
+HTML_MAX_BYTES = int(os.getenv('HTML_MAX_BYTES', str(5 * 1024 * 1024)))
+IMAGE_MAX_BYTES = int(os.getenv('IMAGE_MAX_BYTES', str(10 * 1024 * 1024)))
+IMAGE_MAX_PIXELS = int(os.getenv('IMAGE_MAX_PIXELS', str(24 * 1000 * 1000)))
+
+# Duplicate Image Detection (see app/image_index.py; IMAGE_DEDUPE_DISTANCE=-1 keeps exact copies only)
+IMAGE_DEDUPE_DISTANCE = int(os.getenv('IMAGE_DEDUPE_DISTANCE', '4'))
+IMAGE_DEDUPE_MAX_CHANGED = float(os.getenv('IMAGE_DEDUPE_MAX_CHANGED', '0.005'))
+
+# Image Transcoding (0 = transcode inline on the calling thread)
+IMAGE_TRANSCODE_PROCESSES = int(os.getenv('IMAGE_TRANSCODE_PROCESSES', str(os.cpu_count() or 1)))
+
+# Image Cache (set IMAGE_CACHE_MAX_BYTES=0 to disable)
+IMAGE_CACHE_DIR = Path(os.getenv('IMAGE_CACHE_DIR', str(BASE_DIR / 'cache' / 'images')))
+IMAGE_CACHE_MAX_BYTES = int(os.getenv('IMAGE_CACHE_MAX_BYTES', str(256 * 1024 * 1024)))
+IMAGE_CACHE_TTL = int(os.getenv('IMAGE_CACHE_TTL', str(24 * 3600)))
+
+# HTTP Response Cache for article pages (set HTTP_CACHE_MAX_BYTES=0 to disable). Responses
+# without explicit freshness (max-age, Expires) are fresh for at most HTTP_CACHE_DEFAULT_TTL
+HTTP_CACHE_DIR = Path(os.getenv('HTTP_CACHE_DIR', str(BASE_DIR / 'cache' / 'http')))
+HTTP_CACHE_MAX_BYTES = int(os.getenv('HTTP_CACHE_MAX_BYTES', str(128 * 1024 * 1024)))
+HTTP_CACHE_DEFAULT_TTL = int(os.getenv('HTTP_CACHE_DEFAULT_TTL', '300'))
+
+# Article (EPUB) Cache (set ARTICLE_CACHE_MAX_BYTES=0 to disable)
+ARTICLE_CACHE_DIR = Path(os.getenv('ARTICLE_CACHE_DIR', str(BASE_DIR / 'cache' / 'articles')))
+ARTICLE_CACHE_MAX_BYTES = int(os.getenv('ARTICLE_CACHE_MAX_BYTES', str(512 * 1024 * 1024)))
+ARTICLE_CACHE_TTL = int(os.getenv('ARTICLE_CACHE_TTL', str(6 * 3600)))
+
+# EPUB Size Budget (SendGrid caps a message at 30 MB and base64 adds a third; 0 = no budget)
+EPUB_MAX_BYTES = int(os.getenv('EPUB_MAX_BYTES', str(20 * 1024 * 1024)))
+
+# Stored EPUB downloads in OUTPUT_DIR (set EPUB_STORE_MAX_BYTES=0 to keep nothing on disk)
+EPUB_STORE_MAX_BYTES = int(os.getenv('EPUB_STORE_MAX_BYTES', str(200 * 1024 * 1024)))
+EPUB_STORE_TTL = int(os.getenv('EPUB_STORE_TTL', str(24 * 3600)))
+
+# Conversion history page (rows per page)
+HISTORY_PAGE_SIZE = int(os.getenv('HISTORY_PAGE_SIZE', '20'))
+
+# Outbound HTTP (article pages and images), see app/fetch.py
+FETCH_PER_HOST_LIMIT = int(os.getenv('FETCH_PER_HOST_LIMIT', '4'))
+FETCH_MAX_CONNECTIONS = int(os.getenv('FETCH_MAX_CONNECTIONS', '64'))
+FETCH_MAX_BYTES = int(os.getenv('FETCH_MAX_BYTES', str(20 * 1024 * 1024)))
+FETCH_TIMEOUT = float(os.getenv('FETCH_TIMEOUT', '15'))
+# Longest a fetch queues for one of its host's FETCH_PER_HOST_LIMIT slots (not part of FETCH_TIMEOUT)
+FETCH_SLOT_TIMEOUT = float(os.getenv('FETCH_SLOT_TIMEOUT', '60'))
+FETCH_HTTP2 = os.getenv('FETCH_HTTP2', '1') == '1'
+
+# Batch Conversion (many URLs compiled into one EPUB)
+BATCH_MAX_URLS = int(os.getenv('BATCH_MAX_URLS', '20'))
+BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', '4'))
+
+# Digest Mode (per-user; see app/digest.py)
+DIGEST_DEFAULT_INTERVAL_HOURS = int(os.getenv('DIGEST_DEFAULT_INTERVAL_HOURS', '24'))
+DIGEST_DEFAULT_MAX_ARTICLES = int(os.getenv('DIGEST_DEFAULT_MAX_ARTICLES', '10'))
+DIGEST_CHECK_INTERVAL = float(os.getenv('DIGEST_CHECK_INTERVAL', '60'))
+
+# Per-site content selectors and image skip patterns (JSON; see app/site_rules.py)
+SITE_RULES_FILE = os.getenv('SITE_RULES_FILE')
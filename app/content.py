@@ -1,114 +1,95 @@
-import requests
-from bs4 import BeautifulSoup
-from readability import Document
-from urllib.parse import urljoin
-from .images import ImageProcessor
+from .fetch import get_fetch_engine
+from .extraction import ArticleDocument, to_html
+from .images import ImageProcessor, image_source_urls, enclosing_picture
+from .metrics import stage, count, progress
+from .devices import transcode_options
+from .config import HTML_MAX_BYTES
 
 class ContentExtractor:
-    def __init__(self):
-        self.session = requests.Session()
-        self.session.headers.update({
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-        })
-        self.image_processor = ImageProcessor(self.session)
-
-    def process_url(self, url):
-        """Fetch and process a URL"""
-        print(f"🌐 Fetching: {url}")
-        
+    def __init__(self, fetcher=None):
+        self.fetcher = fetcher or get_fetch_engine()
+        self.image_processor = ImageProcessor(self.fetcher)
+
+    def process_url(self, url, profile=None):
+        """Fetch and process a URL, with images transcoded for a device profile (app/devices.py)"""
         try:
-            response = self.session.get(url, timeout=15)
-            response.raise_for_status()
-            
-            # 1. Parse original HTML to find potential high-res images
-            original_soup = BeautifulSoup(response.text, 'html.parser')
-            
-            # 2. Extract content using Readability
-            doc = Document(response.text)
-            title = doc.title()
-            clean_html = doc.summary()
-            
-            # 3. Create Clean Soup
-            soup = BeautifulSoup(clean_html, 'html.parser')
-            
-            # 4. Extract and Download Images
-            # We look at the original soup to find the "best" image URLs
-            image_urls = self.image_processor.extract_images_from_original_html(original_soup, url)
-            
-            processed_images = []
-            print(f"🔍 Found {len(image_urls)} potential images")
-            
-            for i, img_url in enumerate(image_urls):
-                img_data = self.image_processor.download_image(img_url, referrer=url)
-                if img_data:
-                    filename = f"image_{i}.jpg"
-                    processed_images.append({
-                        'filename': filename,
-                        'data': img_data,
-                        'original_url': img_url
-                    })
-            
-            # 5. Insert Images into Clean Content
-            self._insert_images_into_content(soup, processed_images)
-            
-            return {
-                'title': title,
-                'content': str(soup),
-                'images': processed_images,
-                'url': url
-            }
-            
+            return self.process_page(self.fetch_page(url), url, profile=profile)
         except Exception as e:
             print(f"❌ Error processing URL {url}: {e}")
             raise e
 
-    def process_html(self, html_content, base_url=""):
+    def fetch_page(self, url):
+        """Fetch an article page through the HTTP cache. Returns the FetchResult."""
+        print(f"🌐 Fetching: {url}")
+        with stage('fetch'):
+            response = self.fetcher.get(url, max_bytes=HTML_MAX_BYTES, cache=True)
+            response.raise_for_status()
+        if response.cache_status:
+            print(f"💾 Page from HTTP cache ({response.cache_status}): {url}")
+            count(f'page_cache_{response.cache_status}')
+        else:
+            count('bytes_fetched', len(response.content))
+        progress('fetched', url=url)
+        return response
+
+    def process_page(self, response, url, profile=None):
+        """Process a page fetched by fetch_page."""
+        return self._extract(response.text, url, profile=profile)
+
+    def process_html(self, html_content, base_url="", profile=None):
         """Process raw HTML content (e.g. from email)"""
         try:
-            # 1. Parse original HTML
-            original_soup = BeautifulSoup(html_content, 'html.parser')
-            
-            # 2. Extract content using Readability
-            doc = Document(html_content)
-            title = doc.title()
-            clean_html = doc.summary()
-            
-            # 3. Create Clean Soup
-            soup = BeautifulSoup(clean_html, 'html.parser')
-            
-            # 4. Extract and Download Images
-            image_urls = self.image_processor.extract_images_from_original_html(original_soup, base_url)
-            
-            processed_images = []
-            print(f"🔍 Found {len(image_urls)} potential images in HTML")
-            
-            for i, img_url in enumerate(image_urls):
-                img_data = self.image_processor.download_image(img_url, referrer=base_url)
-                if img_data:
-                    filename = f"image_{i}.jpg"
-                    processed_images.append({
-                        'filename': filename,
-                        'data': img_data,
-                        'original_url': img_url
-                    })
-            
-            # 5. Insert Images into Clean Content
-            self._insert_images_into_content(soup, processed_images)
-            
-            return {
-                'title': title,
-                'content': str(soup),
-                'images': processed_images,
-                'url': base_url
-            }
+            return self._extract(html_content, base_url, source_label=" in HTML", profile=profile)
         except Exception as e:
             print(f"❌ Error processing HTML: {e}")
             raise e
 
-    def _insert_images_into_content(self, soup, images):
+    def _extract(self, html, base_url, source_label="", profile=None):
+        """
+        Extract title, cleaned content and images from a page.
+
+        The page is parsed exactly once (see app/extraction.py): image discovery
+        and readability share that tree, and the content is serialized once.
+        """
+        # 1. Parse once; readability works on copies of this tree
+        with stage('parse'):
+            doc = ArticleDocument(html)
+            title = doc.title()
+
+        # 2. Find potential high-res images in the original page
+        with stage('image_discovery'):
+            image_urls = self.image_processor.extract_images_from_original_html(
+                doc.source, base_url, min_width=transcode_options(profile)['max_width']
+            )
+
+        # 3. Extract content using Readability
+        with stage('readability'):
+            article = doc.article_tree()
+
+        # 4. Download Images
+        print(f"🔍 Found {len(image_urls)} potential images{source_label}")
+        count('images_found', len(image_urls))
+        with stage('images'):
+            processed_images = self.image_processor.download_images(image_urls, referrer=base_url, profile=profile)
+        count('images_kept', len(processed_images))   # download_images counts the skipped and duplicates
+
+        # 5. Insert Images into Clean Content
+        self._insert_images_into_content(article, processed_images, base_url)
+
+        return {
+            'title': title,
+            'content': to_html(article),
+            'images': processed_images,
+            'url': base_url
+        }
+
+    def _insert_images_into_content(self, tree, images, base_url=""):
         """
         Update existing img tags in the Readability-cleaned content with our downloaded images.
         This preserves the original image positions from the article.
+
+        A tag matches a download if any URL it offers (src, srcset or
+        <picture> sources) is the one that was picked for it.
         """
         if not images:
             return
@@ -118,31 +99,39 @@ class ContentExtractor:
         for img in images:
             if 'original_url' in img:
                 url_to_image[img['original_url']] = img
+            # Duplicates of this picture (see ImageProcessor.download_images) share its file
+            for alias in img.get('aliases', ()):
+                url_to_image[alias] = img
 
         # Find all existing img tags in the cleaned content
-        img_tags = soup.find_all('img')
+        img_tags = list(tree.iter('img'))
         images_updated = 0
 
         for img_tag in img_tags:
-            # Get the original src
-            original_src = img_tag.get('src') or img_tag.get('data-src')
-            if not original_src:
+            # Get every URL the tag could have loaded
+            source_urls = image_source_urls(img_tag, base_url)
+            if not source_urls:
                 continue
 
             # Check if we have a downloaded version of this image
-            matching_image = url_to_image.get(original_src)
-            
+            matching_image = next((url_to_image[url] for url in source_urls if url in url_to_image), None)
+
             if matching_image:
                 # Update the src to point to our local copy
-                img_tag['src'] = f"images/{matching_image['filename']}"
-                img_tag['alt'] = img_tag.get('alt', 'Article image')
+                img_tag.set('src', f"images/{matching_image['filename']}")
+                img_tag.set('alt', img_tag.get('alt', 'Article image'))
                 # Remove lazy-loading attributes
-                for attr in ['data-src', 'data-srcset', 'srcset', 'loading']:
-                    if attr in img_tag.attrs:
-                        del img_tag.attrs[attr]
+                for attr in ['data-src', 'data-srcset', 'srcset', 'sizes', 'loading']:
+                    if attr in img_tag.attrib:
+                        del img_tag.attrib[attr]
+                # Unwrap remote <picture> sources so readers fall back to the img
+                picture = enclosing_picture(img_tag)
+                if picture is not None:
+                    for source in list(picture.iter('source')):
+                        source.drop_tag()
                 images_updated += 1
             else:
                 # Image not in our downloaded set - remove it to avoid broken images
-                img_tag.decompose()
+                img_tag.drop_tree()
 
         print(f"📝 Updated {images_updated} image references in content (preserved positions)")
@@ -0,0 +1,88 @@
+"""
+Database Engine Configuration
+
+web_app.py used to hand Flask-SQLAlchemy nothing but a URL, so every
+process ran with driver defaults: no pre-ping (requests failing on
+connections Railway's proxy had dropped), no recycling, no statement
+timeout, and SQLite in rollback-journal mode, where a writer locks out
+readers and concurrent gunicorn workers hit "database is locked".
+
+configure_database(app) sets the engine up per backend:
+
+- Postgres: a pool of DB_POOL_SIZE connections plus DB_MAX_OVERFLOW under
+  load, checked with a ping before use, recycled after DB_POOL_RECYCLE
+  seconds, and a server-side statement_timeout of DB_STATEMENT_TIMEOUT_MS
+- SQLite: WAL journaling (readers don't block the writer), synchronous=NORMAL
+  (safe with WAL) and a busy_timeout of SQLITE_BUSY_TIMEOUT_MS, set on every
+  new connection
+
+Creating tables is no longer part of booting a process: run init_db() once
+per deploy with `flask --app web_app init-db` (the Procfile's release step).
+"""
+
+import os
+from sqlalchemy import event
+from .models import db, add_missing_columns
+from .config import (
+    DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_POOL_PRE_PING, DB_STATEMENT_TIMEOUT_MS,
+    SQLITE_BUSY_TIMEOUT_MS
+)
+
+
+def database_url():
+    """DATABASE_URL from Railway, or a local SQLite file for development."""
+    url = os.environ.get('DATABASE_URL', 'sqlite:///kindle_users.db')
+    # Railway uses postgres:// but SQLAlchemy needs postgresql://
+    if url.startswith('postgres://'):
+        url = url.replace('postgres://', 'postgresql://', 1)
+    return url
+
+
+def engine_options(url):
+    """SQLALCHEMY_ENGINE_OPTIONS for a database URL."""
+    if url.startswith('sqlite'):
+        # pysqlite's own lock wait, matching the busy_timeout pragma
+        return {'connect_args': {'timeout': SQLITE_BUSY_TIMEOUT_MS / 1000}}
+
+    options = {
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_timeout': DB_POOL_TIMEOUT,
+        'pool_recycle': DB_POOL_RECYCLE,
+        'pool_pre_ping': DB_POOL_PRE_PING,
+    }
+    if url.startswith('postgresql') and DB_STATEMENT_TIMEOUT_MS > 0:
+        options['connect_args'] = {'options': f'-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}'}
+    return options
+
+
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute(f'PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS}')
+        cursor.execute('PRAGMA journal_mode = WAL')
+        cursor.execute('PRAGMA synchronous = NORMAL')
+    finally:
+        cursor.close()
+
+
+def configure_database(app, url=None):
+    """Point app at the database with engine options for its backend and initialise db."""
+    url = url or database_url()
+    app.config['SQLALCHEMY_DATABASE_URI'] = url
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(url)
+    db.init_app(app)
+
+    with app.app_context():
+        engine = db.engine
+        # In-memory databases can't use WAL (and are private to one connection anyway)
+        if engine.dialect.name == 'sqlite' and engine.url.database not in (None, '', ':memory:'):
+            event.listen(engine, 'connect', _sqlite_pragmas)
+
+
+def init_db():
+    """Create missing tables and columns. Call inside an app context, once per deploy."""
+    db.create_all()
+    add_missing_columns()
+    print("🗄️  Database schema is up to date")
@@ -0,0 +1,332 @@
+"""
+Email Delivery Backends
+
+One place for getting an EPUB into someone's inbox. Backends keep their
+connection open between sends (a pooled HTTPS session for SendGrid, a
+persistent SMTP session for SMTP), so a worker pays for TLS once rather than
+per article.
+
+Backends:
+    sendgrid  SendGrid v3 API; attachment base64-streamed into the request body
+    smtp      Any SMTP relay (SMTP_SERVER / SMTP_PORT / SMTP_USER / SMTP_PASSWORD)
+    file      Writes .eml files to DELIVERY_FILE_DIR, for local dev and benchmarks
+
+Pick one with DELIVERY_BACKEND; get_delivery_backend() returns the shared instance.
+
+A message is a dict:
+    {'to': ..., 'from': ..., 'subject': ..., 'html': ..., 'attachment': EpubFile, 'filename': ...}
+
+The attachment may be in memory or on disk; backends read it through
+EpubFile.open() either way.
+"""
+
+import os
+import json
+import base64
+import smtplib
+import threading
+import time
+from collections import OrderedDict
+from email.message import EmailMessage
+from pathlib import Path
+import requests
+from requests.adapters import HTTPAdapter
+from .epub import EpubFile
+from .config import (
+    DELIVERY_BACKEND, DELIVERY_FILE_DIR, SENDGRID_POOL_SIZE,
+    SMTP_SERVER, SMTP_PORT, SMTP_USER, SMTP_PASSWORD
+)
+
+SENDGRID_API_URL = 'https://api.sendgrid.com/v3/mail/send'
+
+# Multiple of 3 so each chunk base64-encodes without padding
+ENCODE_CHUNK_SIZE = 3 * 64 * 1024
+
+# SendGrid allows up to 1000 personalizations per request
+SENDGRID_MAX_RECIPIENTS = 1000
+
+
+def build_message(epub, to_email, from_email, subject='Convert', html=None):
+    """Build a delivery message for an EPUB attachment (an EpubFile or a path)."""
+    if not isinstance(epub, EpubFile):
+        epub = EpubFile.from_path(epub)
+    filename = epub.filename
+    return {
+        'to': to_email,
+        'from': from_email,
+        'subject': subject,
+        'html': html or f"Here is your converted article: <strong>{filename}</strong><br><br>Sent from your Kindle Web App.",
+        'attachment': epub,
+        'filename': filename,
+    }
+
+
+def _to_mime(message):
+    """Render a message as a MIME email with the EPUB attached."""
+    mime = EmailMessage()
+    mime['From'] = message['from']
+    mime['To'] = message['to']
+    mime['Subject'] = message['subject']
+    mime.set_content('Your converted article is attached.')
+    mime.add_alternative(message['html'], subtype='html')
+    mime.add_attachment(message['attachment'].read(), maintype='application', subtype='epub+zip', filename=message['filename'])
+    return mime
+
+
+def _attachment_key(epub):
+    """Identity of an attachment for batching: its path, or the buffer object itself."""
+    return epub.path if epub.data is None else id(epub)
+
+
+class StreamingMailBody:
+    """
+    SendGrid v3 JSON request body with the attachment base64-encoded on the fly.
+
+    The JSON around the attachment is small and built up front; the EPUB is
+    read and encoded one chunk at a time as the body is sent, so we never hold
+    its base64 string or the serialized JSON in memory (nor the file itself,
+    when the attachment is on disk).
+    Iterable and sized, so requests streams it with a Content-Length.
+    """
+
+    PLACEHOLDER = '__ATTACHMENT_CONTENT__'
+
+    def __init__(self, payload, attachment):
+        payload_json = json.dumps(payload)
+        prefix, suffix = payload_json.split(self.PLACEHOLDER, 1)
+        self.prefix = prefix.encode('utf-8')
+        self.suffix = suffix.encode('utf-8')
+        self.attachment = attachment
+        self.attachment_size = attachment.size
+
+    def __len__(self):
+        encoded_size = 4 * ((self.attachment_size + 2) // 3)
+        return len(self.prefix) + encoded_size + len(self.suffix)
+
+    def __iter__(self):
+        yield self.prefix
+        with self.attachment.open() as f:
+            while True:
+                chunk = f.read(ENCODE_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield base64.b64encode(chunk)
+        yield self.suffix
+
+
+class DeliveryBackend:
+    """Base class: send one message, or many over the same connection."""
+
+    name = 'base'
+
+    def send(self, message):
+        """Deliver one message. Returns True on success."""
+        raise NotImplementedError
+
+    def send_many(self, messages):
+        """Deliver several messages. Returns a list of booleans in the same order."""
+        return [self.send(m) for m in messages]
+
+    def close(self):
+        pass
+
+
+class SendGridBackend(DeliveryBackend):
+    """
+    SendGrid v3 API over a pooled keep-alive session.
+
+    send_many groups messages that share an attachment and sender into a
+    single API call with one personalization per recipient, so an article
+    going to many Kindles is uploaded once.
+    """
+
+    name = 'sendgrid'
+
+    def __init__(self, api_key, api_url=None, pool_size=SENDGRID_POOL_SIZE):
+        self.api_key = api_key
+        self.api_url = api_url or SENDGRID_API_URL
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({
+            'Authorization': f'Bearer {api_key}',
+            'Content-Type': 'application/json'
+        })
+
+    def send(self, message):
+        return self._post([message])
+
+    def send_many(self, messages):
+        groups = OrderedDict()
+        for i, m in enumerate(messages):
+            key = (_attachment_key(m['attachment']), m['from'], m['subject'], m['html'])
+            groups.setdefault(key, []).append(i)
+
+        results = [False] * len(messages)
+        for indexes in groups.values():
+            for start in range(0, len(indexes), SENDGRID_MAX_RECIPIENTS):
+                batch = indexes[start:start + SENDGRID_MAX_RECIPIENTS]
+                ok = self._post([messages[i] for i in batch])
+                for i in batch:
+                    results[i] = ok
+        return results
+
+    def _post(self, messages):
+        """One API call for messages sharing an attachment (one personalization each)."""
+        first = messages[0]
+        payload = {
+            'personalizations': [{'to': [{'email': m['to']}]} for m in messages],
+            'from': {'email': first['from']},
+            'subject': first['subject'],
+            'content': [{'type': 'text/html', 'value': first['html']}],
+            'attachments': [{
+                'content': StreamingMailBody.PLACEHOLDER,
+                'filename': first['filename'],
+                'type': 'application/epub+zip',
+                'disposition': 'attachment'
+            }]
+        }
+        response = self.session.post(
+            self.api_url,
+            data=StreamingMailBody(payload, first['attachment']),
+            timeout=120
+        )
+        if not str(response.status_code).startswith('2'):
+            print(f"❌ SendGrid rejected the email ({response.status_code}): {response.text[:200]}")
+            return False
+        print(f"✅ Email sent to {len(messages)} recipient(s)! Status code: {response.status_code}")
+        return True
+
+    def close(self):
+        self.session.close()
+
+
+class SMTPBackend(DeliveryBackend):
+    """
+    SMTP relay over one persistent connection.
+
+    The connection is opened lazily, checked with NOOP after it has been idle,
+    and reopened once if the server dropped it.
+    """
+
+    name = 'smtp'
+
+    # Servers commonly drop idle clients after a minute or so
+    IDLE_CHECK_SECONDS = 30
+
+    def __init__(self, host=SMTP_SERVER, port=SMTP_PORT, user=SMTP_USER, password=SMTP_PASSWORD,
+                 starttls=True, timeout=60):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.starttls = starttls
+        self.timeout = timeout
+        self._conn = None
+        self._last_used = 0
+        self._lock = threading.Lock()
+
+    def send(self, message):
+        return self.send_many([message])[0]
+
+    def send_many(self, messages):
+        results = []
+        with self._lock:
+            for message in messages:
+                try:
+                    mime = _to_mime(message)
+                    try:
+                        self._connection().send_message(mime)
+                    except smtplib.SMTPServerDisconnected:
+                        self._conn = None
+                        self._connection().send_message(mime)
+                    self._last_used = time.monotonic()
+                    print(f"✅ Email sent to {message['to']} via SMTP")
+                    results.append(True)
+                except Exception as e:
+                    print(f"❌ SMTP error sending to {message['to']}: {e}")
+                    self._disconnect()
+                    results.append(False)
+        return results
+
+    def _connection(self):
+        """Return a live connection, reusing the open one when possible. Caller holds the lock."""
+        if self._conn is not None and time.monotonic() - self._last_used > self.IDLE_CHECK_SECONDS:
+            try:
+                self._conn.noop()
+            except smtplib.SMTPException:
+                self._conn = None
+
+        if self._conn is None:
+            conn = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            conn.ehlo()
+            if self.starttls and conn.has_extn('starttls'):
+                conn.starttls()
+                conn.ehlo()
+            if self.user and self.password:
+                conn.login(self.user, self.password)
+            self._conn = conn
+        return self._conn
+
+    def _disconnect(self):
+        if self._conn is not None:
+            try:
+                self._conn.quit()
+            except Exception:
+                pass
+            self._conn = None
+
+    def close(self):
+        with self._lock:
+            self._disconnect()
+
+
+class FileSinkBackend(DeliveryBackend):
+    """Writes each message as an .eml file instead of sending it."""
+
+    name = 'file'
+
+    def __init__(self, directory=DELIVERY_FILE_DIR):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._counter = 0
+        self._lock = threading.Lock()
+
+    def send(self, message):
+        with self._lock:
+            self._counter += 1
+            n = self._counter
+        path = self.directory / f"{time.strftime('%Y%m%d_%H%M%S')}_{os.getpid()}_{n}.eml"
+        path.write_bytes(_to_mime(message).as_bytes())
+        print(f"📁 Wrote email for {message['to']} to {path.name}")
+        return True
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def create_delivery_backend(name=DELIVERY_BACKEND):
+    """Build a backend by name from the environment's settings."""
+    if name == 'sendgrid':
+        api_key = os.environ.get('SENDGRID_API_KEY')
+        if not api_key:
+            return None
+        return SendGridBackend(api_key, api_url=os.environ.get('SENDGRID_API_URL'))
+    if name == 'smtp':
+        if not SMTP_SERVER:
+            return None
+        return SMTPBackend()
+    if name == 'file':
+        return FileSinkBackend()
+    raise ValueError(f"Unknown DELIVERY_BACKEND: {name}")
+
+
+def get_delivery_backend():
+    """The process-wide backend (so its connections are reused), or None if unconfigured."""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = create_delivery_backend()
+        return _backend
@@ -0,0 +1,59 @@
+"""
+Kindle Device Profiles
+
+Each user picks the Kindle they read on, and every image in their EPUBs is
+transcoded for it (see transcode_image): sized to the device's text column,
+converted to grayscale for e-ink screens, and encoded at a quality and
+with progressive scans tuned per device. The profiles themselves are plain
+dicts in DEVICE_PROFILES (app/config.py); their keys other than 'label' are
+transcode_image's keyword arguments.
+
+Users without a choice get DEFAULT_DEVICE_PROFILE ('generic', the original
+800x1200 color JPEG at quality 85).
+
+Transcoded images and built EPUBs depend on the profile, so both caches key
+their entries on cache_variant(profile) as well as the URL.
+"""
+
+from .config import DEVICE_PROFILES, DEFAULT_DEVICE_PROFILE, MAX_IMAGE_WIDTH, MAX_IMAGE_HEIGHT, IMAGE_QUALITY
+
+# What cached entries made before device profiles were built with
+LEGACY_OPTIONS = {'max_width': MAX_IMAGE_WIDTH, 'max_height': MAX_IMAGE_HEIGHT,
+                  'grayscale': False, 'quality': IMAGE_QUALITY, 'progressive': False}
+
+
+def device_profile(name=None):
+    """The profile dict for name, with 'name' filled in; unknown or empty names get the default."""
+    if name not in DEVICE_PROFILES:
+        name = DEFAULT_DEVICE_PROFILE if DEFAULT_DEVICE_PROFILE in DEVICE_PROFILES else 'generic'
+    return {'name': name, **DEVICE_PROFILES[name]}
+
+
+def profile_for_user(user):
+    """The device profile for a user (or the default for anonymous conversions)."""
+    return device_profile(user.device_profile if user else None)
+
+
+def transcode_options(profile):
+    """transcode_image keyword arguments for a profile (None means the default profile)."""
+    profile = profile or device_profile()
+    return {key: profile[key] for key in LEGACY_OPTIONS}
+
+
+def cache_variant(profile):
+    """
+    Cache-key suffix for output built with a profile, or None for output
+    identical to what was cached before profiles existed (so those entries
+    stay valid). Derived from the options rather than the name, so profiles
+    with the same settings share entries and editing one invalidates them.
+    """
+    options = transcode_options(profile)
+    if options == LEGACY_OPTIONS:
+        return None
+    return (f"{options['max_width']}x{options['max_height']}-q{options['quality']}"
+            f"{'-gray' if options['grayscale'] else ''}{'-prog' if options['progressive'] else ''}")
+
+
+def device_choices():
+    """(name, label) pairs for the settings form, in config order."""
+    return [(name, profile['label']) for name, profile in DEVICE_PROFILES.items()]
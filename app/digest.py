@@ -0,0 +1,126 @@
+"""
+Scheduled Digests
+
+Users who turn on digest mode don't get one email per forwarded article.
+The webhook parks their articles as 'held' jobs, and a DigestScheduler in
+the worker process periodically compiles each user's held articles into a
+single batch job (one EPUB, one email; see ConversionPipeline.run_batch).
+
+A user's digest is due when either
+- their oldest held article has waited digest_interval_hours, or
+- digest_max_articles articles are waiting (capped at BATCH_MAX_URLS).
+
+If a user turns digest mode off, whatever is held goes out on the next tick.
+
+The scheduler reads time from an injectable clock, so tests can drive it:
+
+    clock = FakeClock(datetime(2025, 1, 1, 8, 0))
+    scheduler = DigestScheduler(app, clock=clock)
+    clock.advance(hours=24)
+    scheduler.tick()
+"""
+
+import threading
+from datetime import datetime, timedelta
+from .models import db, User, ConversionJob
+from .jobs import enqueue_batch, make_dedupe_key
+from .config import (
+    DIGEST_DEFAULT_INTERVAL_HOURS, DIGEST_DEFAULT_MAX_ARTICLES, DIGEST_CHECK_INTERVAL, BATCH_MAX_URLS
+)
+
+
+def digest_settings(user):
+    """(interval, max_articles) for a user, falling back to the defaults."""
+    hours = user.digest_interval_hours or DIGEST_DEFAULT_INTERVAL_HOURS
+    max_articles = min(user.digest_max_articles or DIGEST_DEFAULT_MAX_ARTICLES, BATCH_MAX_URLS)
+    return timedelta(hours=hours), max_articles
+
+
+class FakeClock:
+    """A settable clock for driving DigestScheduler in tests."""
+
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, **delta):
+        self.now += timedelta(**delta)
+
+
+class DigestScheduler:
+    def __init__(self, app, clock=datetime.utcnow, check_interval=DIGEST_CHECK_INTERVAL):
+        self.app = app
+        self.clock = clock
+        self.check_interval = check_interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Check for due digests every check_interval seconds on a background thread."""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name='digest-scheduler', daemon=True)
+        self._thread.start()
+        print(f"🗓️  Digest scheduler checking every {self.check_interval:g}s")
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _loop(self):
+        while not self._stop.wait(self.check_interval):
+            try:
+                self.tick()
+            except Exception as e:
+                print(f"❌ Digest scheduler error: {e}")
+
+    def tick(self):
+        """Compile every due digest into a batch job. Returns the jobs queued."""
+        now = self.clock()
+        queued = []
+        with self.app.app_context():
+            held = (ConversionJob.query
+                    .filter_by(status=ConversionJob.STATUS_HELD)
+                    .order_by(ConversionJob.id)
+                    .all())
+
+            by_user = {}
+            for job in held:
+                by_user.setdefault(job.user_id, []).append(job)
+
+            for user_id, jobs in by_user.items():
+                user = db.session.get(User, user_id) if user_id else None
+                if user and user.digest_enabled:
+                    interval, max_articles = digest_settings(user)
+                    if len(jobs) < max_articles and now - jobs[0].created_at < interval:
+                        continue
+                    jobs = jobs[:max_articles]
+                job = self._release(user, jobs, now)
+                if job:
+                    queued.append(job)
+        return queued
+
+    def _release(self, user, held, now):
+        """Turn held jobs into one queued job (a batch, unless there's only one)."""
+        if len(held) == 1:
+            held[0].status = ConversionJob.STATUS_QUEUED
+            db.session.commit()
+            print(f"🗓️  Released held job {held[0].id}")
+            return held[0]
+
+        # Keyed on the held jobs, so two schedulers racing produce one batch
+        dedupe_key = make_dedupe_key('digest', *(job.id for job in held))
+        to_email = (user.kindle_email if user else None) or held[0].to_email
+        batch, _ = enqueue_batch(
+            [job.url for job in held], to_email, f"Kindle Digest – {now:%b %d, %Y}",
+            user=user, dedupe_key=dedupe_key
+        )
+        for job in held:
+            job.status = ConversionJob.STATUS_BATCHED
+            job.title = job.title or f"In digest job {batch.id}"
+        db.session.commit()
+        print(f"🗓️  Compiled {len(held)} held article(s) into digest job {batch.id}")
+        return batch
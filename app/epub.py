@@ -1,147 +1,453 @@
+import io
 import os
+import time
 from datetime import datetime
 from ebooklib import epub
-from .config import OUTPUT_DIR
+from lxml import html as lxml_html
+from lxml.etree import tounicode
+from PIL import Image
+from .epub_store import get_epub_store
+from .images import shrink_images
+from .metrics import stage, count, current_trace
+from .config import EPUB_MAX_BYTES
+
+
+class EpubFile:
+    """
+    A built EPUB, held in memory (data) and/or stored on disk (path).
+
+    The pipeline passes these around instead of file paths, so a conversion
+    can go from builder to sender without touching the disk.
+    """
+
+    def __init__(self, filename, data=None, path=None):
+        self.filename = filename
+        self.data = data
+        self.path = str(path) if path else None
+
+    @classmethod
+    def from_path(cls, path):
+        return cls(os.path.basename(path), path=path)
+
+    @property
+    def size(self):
+        if self.data is not None:
+            return len(self.data)
+        return os.path.getsize(self.path)
+
+    def open(self):
+        """Binary file object over the EPUB's bytes."""
+        if self.data is not None:
+            return io.BytesIO(self.data)
+        return open(self.path, 'rb')
+
+    def read(self):
+        if self.data is not None:
+            return self.data
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+
+STYLE = '''
+    body {
+        font-family: 'Bookerly', 'Georgia', 'Palatino', serif;
+        line-height: 1.6;
+        text-align: justify;
+        margin: 0;
+        padding: 0;
+    }
+    
+    h1 {
+        font-family: 'Helvetica', 'Arial', sans-serif;
+        font-size: 1.8em;
+        line-height: 1.2;
+        margin: 1em 0 0.5em 0;
+        text-align: left;
+    }
+    
+    h2, h3, h4 {
+        font-family: 'Helvetica', 'Arial', sans-serif;
+        margin-top: 1.5em;
+        margin-bottom: 0.5em;
+    }
+    
+    p {
+        margin-bottom: 1em;
+        text-indent: 0;
+    }
+    
+    a {
+        color: #0000EE;
+        text-decoration: none;
+    }
+    
+    img {
+        max-width: 100%;
+        height: auto;
+        display: block;
+        margin: 1em auto;
+    }
+    
+    figure {
+        margin: 1em 0;
+        text-align: center;
+    }
+    
+    .source-url {
+        font-family: 'Helvetica', 'Arial', sans-serif;
+        font-size: 0.8em;
+        color: #666;
+        margin-bottom: 2em;
+        padding: 1em;
+        background: #f9f9f9;
+        border-top: 1px solid #eee;
+        border-bottom: 1px solid #eee;
+    }
+    
+    blockquote {
+        margin: 1em 2em;
+        padding-left: 1em;
+        border-left: 3px solid #ccc;
+        font-style: italic;
+    }
+'''
+
+
+# How an over-budget EPUB is shrunk, mildest first: (strategy, image scale, JPEG quality).
+# Every step starts again from the images as built, so quality isn't lost twice.
+BUDGET_STEPS = [
+    ('recompress', 1.0, 60),
+    ('downscale', 0.75, 50),
+    ('downscale', 0.5, 40),
+]
+
+# Packing margin when splitting into volumes, since volume sizes are estimated
+VOLUME_FILL = 0.9
+
+MB = 1024 * 1024
+
+
+def articles_size(articles):
+    """Rough EPUB size of articles: image bytes plus deflated markup (~1/3) and per-chapter overhead."""
+    return sum(
+        sum(len(img['data']) for img in article['images']) + len(article['content']) // 3 + 2048
+        for article in articles
+    )
+
+
+def image_area(data):
+    """Pixel area of an image from its header (0 if unreadable)."""
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            return img.width * img.height
+    except Exception:
+        return 0
+
+
+def without_images(content, filenames):
+    """Content HTML with the <img> tags for the given image filenames removed."""
+    if not filenames:
+        return content
+    doc = lxml_html.fragment_fromstring(content, create_parent='div')
+    for img in list(doc.iter('img')):
+        if os.path.basename(img.get('src', '')) in filenames:
+            img.drop_tree()
+    return tounicode(doc, method='html')[len('<div>'):-len('</div>')]
+
 
 class EpubBuilder:
-    def __init__(self):
-        pass
+    """
+    Builds EPUBs in memory, keeping each under a byte budget (max_bytes,
+    EPUB_MAX_BYTES by default; 0 disables it) so the send doesn't fail at
+    SendGrid or Amazon after all the work is done.
+
+    An EPUB over budget is rebuilt from what's already in memory, nothing is
+    fetched again: its images are recompressed, then downscaled (BUDGET_STEPS);
+    a compilation built with build_volumes() is then split into volumes at
+    chapter boundaries; as a last resort the least prominent images (smallest
+    first) are dropped along with their <img> tags. The strategy used, the
+    sizes and the time it took are logged and recorded on the trace.
+    """
+
+    def __init__(self, store=None, max_bytes=EPUB_MAX_BYTES):
+        self._store = store
+        self.max_bytes = max_bytes
+
+    @property
+    def store(self):
+        return self._store or get_epub_store()
 
     def create_epub(self, title, content, images, source_url):
-        """Create EPUB file from content"""
+        """Create EPUB file from content and store it for download. Returns its path."""
+        epub_file = self.build_epub(title, content, images, source_url)
+        self.store.save(epub_file)
+        return epub_file.path
+
+    def build_epub(self, title, content, images, source_url, max_bytes=None):
+        """Build an EPUB in memory, within the byte budget. Returns an EpubFile; nothing is written to disk."""
+        article = {'title': title, 'content': content, 'images': images, 'url': source_url}
+        return self._within_budget(title, [article], self._build_single, max_bytes)
+
+    def build_compilation(self, title, articles, max_bytes=None):
+        """
+        Build one EPUB with a chapter per article and a table of contents,
+        within the byte budget (without splitting; see build_volumes).
+
+        articles are extractor results (title, content, images, url). Each
+        chapter lives in its own directory with its images beside it, so the
+        content's relative images/... references need no rewriting and image
+        names can't collide between articles.
+        """
+        return self._within_budget(title, articles, self._build_compilation, max_bytes)
+
+    def build_volumes(self, title, articles, max_bytes=None):
+        """
+        Like build_compilation, but a compilation still over budget once its
+        images are downscaled is split into volumes ("Title (1 of 3)") at
+        chapter boundaries instead of losing images. Returns a list of EpubFiles.
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        started = time.perf_counter()
+        # Splitting beats heavy downscaling, so only recompression is tried first
+        epub_file, articles, strategy = self._fit(
+            title, articles, self._build_compilation, max_bytes, steps=BUDGET_STEPS[:1], split=True
+        )
+        if strategy != 'split':
+            if strategy:
+                self._report(title, strategy, articles_size(articles), epub_file.size, max_bytes, started)
+            return [epub_file]
+
+        # Volumes that still don't fit (one huge article) fall back to the remaining steps
+        groups = self._pack(articles, max_bytes * VOLUME_FILL)
+        volumes = [
+            self._within_budget(f"{title} ({n} of {len(groups)})", group, self._build_compilation, max_bytes,
+                                steps=BUDGET_STEPS[1:])
+            for n, group in enumerate(groups, 1)
+        ]
+        print(f"📚 Split '{title}' into {len(volumes)} volumes: "
+              f"{', '.join(f'{v.size / MB:.1f} MB' for v in volumes)}")
+        self._report(title, 'split', articles_size(articles), sum(v.size for v in volumes), max_bytes, started)
+        return volumes
+
+    def _build_single(self, title, articles):
+        article = articles[0]
         try:
-            book = epub.EpubBook()
-            book.set_identifier(f'kindle_app_{datetime.now().timestamp()}')
-            book.set_title(title)
-            book.set_language('en')
-            
-            # Add author if we can find it, otherwise generic
-            book.add_author('Send to Kindle')
+            book = self._new_book(title)
+            self._add_style(book)
 
             # Add images
-            for img in images:
-                img_item = epub.EpubItem(
-                    uid=f'img_{img["filename"]}',
-                    file_name=f'images/{img["filename"]}',
-                    media_type='image/jpeg',
-                    content=img['data']
-                )
-                book.add_item(img_item)
-
-            # CSS
-            style = '''
-                body {
-                    font-family: 'Bookerly', 'Georgia', 'Palatino', serif;
-                    line-height: 1.6;
-                    text-align: justify;
-                    margin: 0;
-                    padding: 0;
-                }
-                
-                h1 {
-                    font-family: 'Helvetica', 'Arial', sans-serif;
-                    font-size: 1.8em;
-                    line-height: 1.2;
-                    margin: 1em 0 0.5em 0;
-                    text-align: left;
-                }
-                
-                h2, h3, h4 {
-                    font-family: 'Helvetica', 'Arial', sans-serif;
-                    margin-top: 1.5em;
-                    margin-bottom: 0.5em;
-                }
-                
-                p {
-                    margin-bottom: 1em;
-                    text-indent: 0;
-                }
-                
-                a {
-                    color: #0000EE;
-                    text-decoration: none;
-                }
-                
-                img {
-                    max-width: 100%;
-                    height: auto;
-                    display: block;
-                    margin: 1em auto;
-                }
-                
-                figure {
-                    margin: 1em 0;
-                    text-align: center;
-                }
-                
-                .source-url {
-                    font-family: 'Helvetica', 'Arial', sans-serif;
-                    font-size: 0.8em;
-                    color: #666;
-                    margin-bottom: 2em;
-                    padding: 1em;
-                    background: #f9f9f9;
-                    border-top: 1px solid #eee;
-                    border-bottom: 1px solid #eee;
-                }
-                
-                blockquote {
-                    margin: 1em 2em;
-                    padding-left: 1em;
-                    border-left: 3px solid #ccc;
-                    font-style: italic;
-                }
-            '''
-            
-            css_item = epub.EpubItem(
-                uid="style_nav",
-                file_name="style/nav.css",
-                media_type="text/css",
-                content=style
-            )
-            book.add_item(css_item)
+            self._add_images(book, article['images'])
 
             # Create chapter
-            chapter = epub.EpubHtml(
-                title=title,
-                file_name='content.xhtml',
-                lang='en'
-            )
-            chapter.add_item(css_item)
-
-            chapter.content = f'''
-            <html>
-            <head>
-                <link rel="stylesheet" type="text/css" href="style/nav.css" />
-            </head>
-            <body>
-                <h1>{title}</h1>
-                <div class="source-url">
-                    <strong>Source:</strong> <a href="{source_url}">{source_url}</a>
-                </div>
-                <hr/>
-                {content}
-            </body>
-            </html>
-            '''
-
+            chapter = self._chapter(title, article['content'], article['url'], 'content.xhtml')
             book.add_item(chapter)
             book.toc = [chapter]
             book.add_item(epub.EpubNcx())
             book.add_item(epub.EpubNav())
             book.spine = ['nav', chapter]
 
-            # Save EPUB
-            safe_title = "".join(c for c in title if c.isalnum() or c in (' ', '-', '_')).strip()
-            safe_title = safe_title[:50]
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            filename = f"{safe_title}_{timestamp}.epub"
-            filepath = os.path.join(OUTPUT_DIR, filename)
-
-            epub.write_epub(filepath, book)
-            print(f"📖 Created EPUB: {filename}")
-            return filepath
+            return self._write(book, title)
             
         except Exception as e:
             print(f"❌ Error creating EPUB: {e}")
             raise e
+
+    def _build_compilation(self, title, articles):
+        try:
+            book = self._new_book(title)
+            self._add_style(book)
+
+            chapters = []
+            for n, article in enumerate(articles, 1):
+                folder = f'chapter_{n:02d}'
+                self._add_images(book, article['images'], prefix=f'{folder}/')
+                chapter = self._chapter(
+                    article['title'], article['content'], article['url'],
+                    f'{folder}/content.xhtml', css_href='../style/nav.css', uid=f'chapter_{n:02d}'
+                )
+                book.add_item(chapter)
+                chapters.append(chapter)
+
+            book.toc = chapters
+            book.add_item(epub.EpubNcx())
+            book.add_item(epub.EpubNav())
+            book.spine = ['nav'] + chapters
+
+            return self._write(book, title)
+
+        except Exception as e:
+            print(f"❌ Error creating compiled EPUB: {e}")
+            raise e
+
+    def _within_budget(self, title, articles, build, max_bytes, steps=BUDGET_STEPS):
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        started = time.perf_counter()
+        epub_file, _, strategy = self._fit(title, articles, build, max_bytes, steps=steps)
+        if strategy:
+            self._report(title, strategy, articles_size(articles), epub_file.size, max_bytes, started)
+        return epub_file
+
+    def _fit(self, title, articles, build, max_bytes, steps=BUDGET_STEPS, split=False):
+        """
+        Build, then walk the budget ladder until the EPUB fits. Returns
+        (epub_file, articles as built, strategy), where strategy is None if
+        the first build fit, 'split' if the caller should split articles
+        (only with split=True and several articles) and otherwise the step
+        that made it fit, 'drop_images', or 'over_budget' if nothing did.
+        """
+        epub_file = build(title, articles)
+        if not max_bytes or epub_file.size <= max_bytes:
+            return epub_file, articles, None
+
+        print(f"📏 '{title}' is {epub_file.size / MB:.1f} MB, over the {max_bytes / MB:.1f} MB budget")
+        shrunk = articles
+        with stage('epub_budget'):
+            for strategy, scale, quality in steps:
+                shrunk = self._shrink(articles, scale, quality)
+                epub_file = build(title, shrunk)
+                if epub_file.size <= max_bytes:
+                    return epub_file, shrunk, strategy
+
+            if split and len(articles) > 1:
+                return epub_file, shrunk, 'split'
+            return self._drop_images(title, shrunk, build, epub_file, max_bytes)
+
+    @staticmethod
+    def _shrink(articles, scale, quality):
+        """Copies of articles with every image re-encoded by shrink_images."""
+        datas = [img['data'] for article in articles for img in article['images']]
+        shrunk = iter(shrink_images(datas, scale=scale, quality=quality))
+        return [dict(article, images=[dict(img, data=next(shrunk)) for img in article['images']])
+                for article in articles]
+
+    def _drop_images(self, title, articles, build, epub_file, max_bytes):
+        """
+        Drop images, least prominent (fewest pixels, then latest) first, until
+        the EPUB fits, removing their <img> tags. Zipped JPEGs take about
+        their own size, so the bytes to drop are estimated from the overshoot
+        and the result checked by rebuilding.
+        """
+        ranked = sorted(
+            ((image_area(img['data']), -n, i, img['filename'], len(img['data']))
+             for i, article in enumerate(articles) for n, img in enumerate(article['images'])),
+        )
+        dropped = set()
+        while epub_file.size > max_bytes and len(dropped) < len(ranked):
+            overshoot = epub_file.size - max_bytes
+            for _, _, i, filename, size in ranked:
+                if overshoot <= 0:
+                    break
+                if (i, filename) not in dropped:
+                    dropped.add((i, filename))
+                    overshoot -= size
+            articles = [
+                dict(article,
+                     images=[img for img in article['images'] if (i, img['filename']) not in dropped],
+                     content=without_images(article['content'], {f for j, f in dropped if j == i}))
+                for i, article in enumerate(articles)
+            ]
+            epub_file = build(title, articles)
+
+        if epub_file.size > max_bytes:
+            print(f"⚠️  '{title}' is still {epub_file.size / MB:.1f} MB with every image dropped")
+            return epub_file, articles, 'over_budget'
+        print(f"🗑️  Dropped {len(dropped)} of {len(ranked)} image(s) from '{title}'")
+        return epub_file, articles, 'drop_images'
+
+    @staticmethod
+    def _pack(articles, budget):
+        """Group consecutive articles into volumes of at most about budget bytes each."""
+        groups, current, size = [], [], 0
+        for article in articles:
+            estimate = articles_size([article])
+            if current and size + estimate > budget:
+                groups.append(current)
+                current, size = [], 0
+            current.append(article)
+            size += estimate
+        if current:
+            groups.append(current)
+        return groups
+
+    @staticmethod
+    def _report(title, strategy, before, after, max_bytes, started):
+        elapsed = time.perf_counter() - started
+        print(f"📏 Budget {max_bytes / MB:.1f} MB for '{title}': {strategy}, "
+              f"~{before / MB:.1f} MB of content → {after / MB:.1f} MB in {elapsed * 1000:.0f} ms")
+        count(f'epub_budget_{strategy}')
+        trace = current_trace()
+        if trace is not None:
+            trace.fields['epub_budget'] = strategy
+            trace.fields['epub_budget_ms'] = round(elapsed * 1000)
+
+    def _new_book(self, title):
+        book = epub.EpubBook()
+        book.set_identifier(f'kindle_app_{datetime.now().timestamp()}')
+        book.set_title(title)
+        book.set_language('en')
+        
+        # Add author if we can find it, otherwise generic
+        book.add_author('Send to Kindle')
+        return book
+
+    def _add_style(self, book):
+        css_item = epub.EpubItem(
+            uid="style_nav",
+            file_name="style/nav.css",
+            media_type="text/css",
+            content=STYLE
+        )
+        book.add_item(css_item)
+        return css_item
+
+    def _add_images(self, book, images, prefix=''):
+        for img in images:
+            img_item = epub.EpubItem(
+                uid=f'img_{prefix.strip("/")}{img["filename"]}',
+                file_name=f'{prefix}images/{img["filename"]}',
+                media_type='image/jpeg',
+                content=img['data']
+            )
+            book.add_item(img_item)
+
+    def _chapter(self, title, content, source_url, file_name, css_href='style/nav.css', uid=None):
+        chapter = epub.EpubHtml(
+            uid=uid,
+            title=title,
+            file_name=file_name,
+            lang='en'
+        )
+        # ebooklib rebuilds <head> from these links, so the href must be relative to file_name
+        chapter.add_link(href=css_href, rel='stylesheet', type='text/css')
+
+        chapter.content = f'''
+        <html>
+        <head>
+            <link rel="stylesheet" type="text/css" href="{css_href}" />
+        </head>
+        <body>
+            <h1>{title}</h1>
+            <div class="source-url">
+                <strong>Source:</strong> <a href="{source_url}">{source_url}</a>
+            </div>
+            <hr/>
+            {content}
+        </body>
+        </html>
+        '''
+        return chapter
+
+    def _write(self, book, title):
+        """Assemble the zip in memory. Returns an EpubFile."""
+        safe_title = "".join(c for c in title if c.isalnum() or c in (' ', '-', '_')).strip()
+        safe_title = safe_title[:50]
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        filename = f"{safe_title}_{timestamp}.epub"
+
+        buffer = io.BytesIO()
+        with stage('epub_write'):
+            epub.write_epub(buffer, book)
+        data = buffer.getvalue()
+        count('epub_bytes', len(data))
+        print(f"📖 Created EPUB: {filename}")
+        return EpubFile(filename, data=data)
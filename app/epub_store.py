@@ -0,0 +1,113 @@
+"""
+Stored EPUB Downloads
+
+Conversions are built in memory and emailed straight from that buffer; the
+only EPUBs written to disk are the ones a user may want to download from the
+web UI. This store keeps those in OUTPUT_DIR and stops the directory growing
+forever on the container's disk:
+
+- files older than EPUB_STORE_TTL are deleted
+- if the directory is still over EPUB_STORE_MAX_BYTES, the oldest files go
+  first until it fits
+
+Files are stored under a unique key, "<random hex>_<EPUB filename>": two
+EPUBs built from the same title in the same second (digests, shared
+newsletters) get the same filename and must not overwrite each other.
+Conversions record the key; downloads are named after the EPUB filename.
+
+Pruning runs after every save (the directory holds at most a few hundred
+files, so a scan is cheap). Set EPUB_STORE_MAX_BYTES=0 to keep nothing on
+disk at all; downloads then aren't offered.
+"""
+
+import os
+import threading
+import time
+import uuid
+from pathlib import Path
+from .config import OUTPUT_DIR, EPUB_STORE_MAX_BYTES, EPUB_STORE_TTL
+
+
+class EpubStore:
+    def __init__(self, directory=OUTPUT_DIR, max_bytes=EPUB_STORE_MAX_BYTES, ttl=EPUB_STORE_TTL):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def save(self, epub_file):
+        """
+        Write an EpubFile (in memory or stored elsewhere, e.g. the article
+        cache) to the store under a new key and set its path. Returns the key.
+        """
+        key = f"{uuid.uuid4().hex[:16]}_{epub_file.filename}"
+        path = self.directory / key
+        tmp = path.with_suffix(f'.{os.getpid()}.{threading.get_ident()}.tmp')
+        tmp.write_bytes(epub_file.read())
+        os.replace(tmp, path)
+        epub_file.path = str(path)
+        self.prune(keep=key)
+        return key
+
+    def path_for(self, key):
+        """Path of a stored EPUB, or None if it was never stored or has been evicted."""
+        path = self.directory / os.path.basename(key)
+        if not path.is_file():
+            return None
+        if time.time() - path.stat().st_mtime > self.ttl:
+            return None
+        return path
+
+    def prune(self, keep=None):
+        """Apply the TTL and size limit. Returns the number of files removed."""
+        with self._lock:
+            now = time.time()
+            entries = []
+            for path in self.directory.glob('*.epub'):
+                try:
+                    st = path.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+            entries.sort()
+
+            removed = 0
+            total = sum(size for _, size, _ in entries)
+            for mtime, size, path in entries:
+                if path.name == keep:
+                    continue
+                if now - mtime <= self.ttl and total <= self.max_bytes:
+                    break
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+                total -= size
+                removed += 1
+
+            self.evictions += removed
+        return removed
+
+
+def download_name(key):
+    """The EPUB's own filename, for a stored key."""
+    return key.split('_', 1)[1] if '_' in key else key
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+def get_epub_store():
+    """The process-wide download store."""
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = EpubStore()
+        return _default_store
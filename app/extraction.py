@@ -0,0 +1,64 @@
+"""
+Single-Parse Article Extraction
+
+readability's Document re-parses its input string on every pass (title, then
+each summary attempt), and we used to parse the same page twice more with
+BeautifulSoup. ArticleDocument parses the page once into an lxml tree:
+
+    doc = ArticleDocument(html)
+    doc.source          pristine tree, used for title and image discovery
+    doc.article_tree()  readability-cleaned article, still an lxml tree
+
+readability's passes work on deep copies of the source tree (copying a tree is
+much cheaper than parsing), and the cleaned article is handed back as a tree so
+callers can edit it and serialize once at the end.
+"""
+
+import re
+from lxml.etree import tounicode
+from readability import Document
+from readability.htmls import build_doc, get_title
+from readability.cleaners import html_cleaner
+
+# Same attributes readability's clean_attributes() strips with a regex on the
+# serialized output, matched per attribute on the tree instead
+PRESENTATIONAL_ATTR_RE = re.compile(r'width|height|style|[-a-z]*color|background[-a-z]*|on.*', re.I)
+
+
+class ArticleDocument(Document):
+    """readability Document that parses once and works on lxml trees."""
+
+    def __init__(self, html, **kwargs):
+        super().__init__(html, **kwargs)
+        self.source, self.encoding = build_doc(html)
+        self._article = None
+
+    def _parse(self, input):
+        # Called by readability before every pass; copy our tree instead of re-parsing
+        doc = html_cleaner.clean_html(self.source)
+        doc.resolve_base_href(handle_failures=self.handle_failures)
+        return doc
+
+    def title(self):
+        return get_title(self.source)
+
+    def get_clean_html(self):
+        # readability calls this with self.html set to the finished article node
+        self._article = self.html
+        return super().get_clean_html()
+
+    def article_tree(self):
+        """Run readability and return the cleaned article as an lxml tree."""
+        if self._article is None:
+            self.summary()
+            for el in self._article.iter():
+                if not isinstance(el.tag, str):
+                    continue
+                for attr in [a for a in el.attrib if PRESENTATIONAL_ATTR_RE.fullmatch(a)]:
+                    del el.attrib[attr]
+        return self._article
+
+
+def to_html(tree):
+    """Serialize an lxml tree to an HTML string."""
+    return tounicode(tree, method='html')
@@ -0,0 +1,257 @@
+"""
+Async HTTP Fetch Engine
+
+Every outbound GET for article pages and images goes through one FetchEngine
+per process instead of a shared blocking requests.Session:
+
+- one httpx.AsyncClient, so connections are pooled and kept alive per host
+  and HTTP/2 is negotiated where the server supports it (needs the h2
+  package; falls back to HTTP/1.1 without it)
+- at most FETCH_PER_HOST_LIMIT requests in flight against any one host,
+  across all conversions in the process, to stay polite to origins; a fetch
+  queues at most FETCH_SLOT_TIMEOUT for a slot (FetchSlotTimeout, which is
+  worth retrying) and its time budget only starts once it has one
+- a byte budget (FETCH_MAX_BYTES, or a tighter per-call max_bytes) and a
+  time budget (FETCH_TIMEOUT) per fetch; the body is streamed and the fetch
+  aborted as soon as either is exceeded, or up front when Content-Length
+  already says it will be
+- an optional inspect() hook that sees the first bytes of a successful
+  response and can reject it before the rest is downloaded (used to check
+  image dimensions from the header)
+- an HTTP cache (app/http_cache.py) for fetches that ask for it with
+  cache=True (article pages): fresh responses come from disk, stale ones
+  are revalidated and a 304 returns the stored body
+
+The engine runs its event loop on a background thread, so the synchronous
+parts of the app (Flask views, job worker threads) call it through run() or
+get(), while code that fans out many requests (image downloads) submits one
+coroutine and awaits fetch() concurrently inside it.
+
+Headers are passed per request; nothing mutates shared session state.
+"""
+
+import asyncio
+import logging
+import os
+import threading
+from urllib.parse import urlsplit
+import httpx
+from .http_cache import get_http_cache
+from .config import (
+    FETCH_PER_HOST_LIMIT, FETCH_MAX_CONNECTIONS, FETCH_MAX_BYTES, FETCH_TIMEOUT, FETCH_SLOT_TIMEOUT, FETCH_HTTP2
+)
+
+try:
+    import h2  # noqa: F401  (httpx's optional HTTP/2 support)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+DEFAULT_USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+
+CHUNK_SIZE = 64 * 1024
+
+# httpx logs every request at INFO; the pipeline already reports its own fetches
+logging.getLogger('httpx').setLevel(logging.WARNING)
+
+
+class FetchError(Exception):
+    """A fetch failed: transport error, bad status or exceeded budget."""
+
+
+class FetchBudgetExceeded(FetchError):
+    """The response was larger or slower than the fetch's budget allowed."""
+
+
+class FetchSlotTimeout(FetchError):
+    """No slot for the host freed up in time; nothing was sent, so it can be retried."""
+
+
+class FetchResult:
+    """
+    A fully read, size-bounded response. cache_status is 'hit' or
+    'revalidated' when it came from the HTTP cache, else None.
+    """
+
+    def __init__(self, url, status_code, headers, content, http_version, cache_status=None):
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.http_version = http_version
+        self.cache_status = cache_status
+
+    @property
+    def ok(self):
+        return 200 <= self.status_code < 400
+
+    @property
+    def encoding(self):
+        content_type = self.headers.get('content-type', '')
+        for param in content_type.split(';')[1:]:
+            key, _, value = param.strip().partition('=')
+            if key.lower() == 'charset' and value:
+                return value.strip('"\'')
+        return None
+
+    @property
+    def text(self):
+        encoding = self.encoding or 'utf-8'
+        try:
+            return self.content.decode(encoding, errors='replace')
+        except LookupError:
+            return self.content.decode('utf-8', errors='replace')
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise FetchError(f"{self.status_code} error for {self.url}")
+
+
+class FetchEngine:
+    def __init__(self, per_host=FETCH_PER_HOST_LIMIT, max_connections=FETCH_MAX_CONNECTIONS,
+                 max_bytes=FETCH_MAX_BYTES, timeout=FETCH_TIMEOUT, http2=FETCH_HTTP2,
+                 user_agent=DEFAULT_USER_AGENT, cache=None, slot_timeout=FETCH_SLOT_TIMEOUT):
+        self.per_host = per_host
+        self.max_connections = max_connections
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.slot_timeout = slot_timeout
+        self.http2 = http2 and HTTP2_AVAILABLE
+        self.user_agent = user_agent
+        self.cache = cache
+        self._host_limits = {}
+        self._client = None
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name='fetch-engine', daemon=True)
+        self._thread.start()
+
+    @property
+    def loop(self):
+        return self._loop
+
+    def run(self, coro, timeout=None):
+        """Run a coroutine on the engine's loop and block until it finishes."""
+        if threading.current_thread() is self._thread:
+            raise RuntimeError("FetchEngine.run() called from the engine's own loop; await instead")
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result(timeout)
+
+    def get(self, url, **kwargs):
+        """Blocking fetch; see fetch() for the arguments."""
+        return self.run(self.fetch(url, **kwargs))
+
+    async def fetch(self, url, headers=None, max_bytes=None, timeout=None, inspect=None, cache=False):
+        """
+        GET url, following redirects, and read the whole body.
+
+        max_bytes and timeout override the engine's budgets for this fetch;
+        timeout covers connecting and reading the body, and starts once a
+        host slot is free. Raises FetchSlotTimeout when no slot frees up
+        within the engine's slot_timeout, FetchBudgetExceeded when either
+        budget is blown and FetchError for transport failures. HTTP error statuses are returned
+        (call raise_for_status()).
+
+        inspect, if given, is called with the bytes received so far of a 2xx
+        response until it returns True; it raises FetchBudgetExceeded to
+        abort the download.
+
+        With cache=True (and an engine cache) the response may come from the
+        HTTP cache; see app/http_cache.py.
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        timeout = self.timeout if timeout is None else timeout
+        request_headers = {'User-Agent': self.user_agent}
+        request_headers.update(headers or {})
+
+        cache = self.cache if cache else None
+        cached = await asyncio.to_thread(cache.lookup, url) if cache else None
+        if cached and cached['fresh']:
+            return cached['result']
+        if cached:
+            if cached['etag']:
+                request_headers['If-None-Match'] = cached['etag']
+            if cached['last_modified']:
+                request_headers['If-Modified-Since'] = cached['last_modified']
+
+        limit = self._host_limit(url)
+        try:
+            async with asyncio.timeout(self.slot_timeout):
+                await limit.acquire()
+        except TimeoutError:
+            raise FetchSlotTimeout(f"{url}: no free slot for its host within {self.slot_timeout}s") from None
+        try:
+            async with asyncio.timeout(timeout):
+                response = await self._fetch(url, request_headers, max_bytes, inspect)
+        except TimeoutError:
+            raise FetchBudgetExceeded(f"{url} took longer than {timeout}s") from None
+        except httpx.HTTPError as e:
+            raise FetchError(f"{url}: {e}") from e
+        finally:
+            limit.release()
+
+        if cache and response.status_code == 304 and cached:
+            return await asyncio.to_thread(cache.revalidated, url, response.headers) or response
+        if cache and response.status_code == 200:
+            await asyncio.to_thread(cache.store, url, response)
+        return response
+
+    async def _fetch(self, url, headers, max_bytes, inspect):
+        async with self._get_client().stream('GET', url, headers=headers) as response:
+            declared = response.headers.get('content-length')
+            if declared and declared.isdigit() and int(declared) > max_bytes:
+                raise FetchBudgetExceeded(f"{url} is {declared} bytes (limit {max_bytes})")
+
+            chunks = []
+            size = 0
+            inspecting = inspect is not None and response.is_success
+            async for chunk in response.aiter_bytes(CHUNK_SIZE):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise FetchBudgetExceeded(f"{url} exceeded {max_bytes} bytes")
+                chunks.append(chunk)
+                if inspecting and inspect(b''.join(chunks)):
+                    inspecting = False
+
+            return FetchResult(str(response.url), response.status_code, response.headers,
+                               b''.join(chunks), response.http_version)
+
+    def _host_limit(self, url):
+        """Semaphore for the URL's host. Only touched from the loop thread, so no lock."""
+        host = urlsplit(url).netloc.lower()
+        limit = self._host_limits.get(host)
+        if limit is None:
+            limit = self._host_limits[host] = asyncio.Semaphore(self.per_host)
+        return limit
+
+    def _get_client(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                http2=self.http2,
+                follow_redirects=True,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                ),
+                timeout=httpx.Timeout(self.timeout),
+            )
+        return self._client
+
+    def close(self):
+        if self._client is not None:
+            self.run(self._client.aclose())
+            self._client = None
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+
+_engine = None
+_engine_pid = None
+_engine_lock = threading.Lock()
+
+
+def get_fetch_engine():
+    """The process-wide fetch engine (rebuilt after a fork, since its loop thread doesn't survive one)."""
+    global _engine, _engine_pid
+    with _engine_lock:
+        if _engine is None or _engine_pid != os.getpid():
+            _engine = FetchEngine(cache=get_http_cache())
+            _engine_pid = os.getpid()
+        return _engine
@@ -0,0 +1,278 @@
+"""
+HTTP Response Cache for Article Pages
+
+The same article URL is fetched again and again: by users forwarding one
+newsletter, by retries, by digests. FetchEngine keeps the raw responses of
+cacheable fetches (article HTML; images have their own cache of transcoded
+bytes, app/image_cache.py) and treats them the way an HTTP cache would:
+
+- a response is fresh for the lifetime its Cache-Control (s-maxage,
+  max-age), Expires or Last-Modified headers give it (freshness_lifetime),
+  capped at HTTP_CACHE_DEFAULT_TTL when only the heuristic applies; fresh
+  responses are served without touching the network
+- no-store, private and Vary: * responses are not stored; no-cache ones are
+  stored but revalidated on every use
+- stale responses are revalidated with If-None-Match / If-Modified-Since;
+  a 304 refreshes the entry and the stored body is returned, so the page is
+  not transferred again
+
+Results served from the cache carry cache_status 'hit' or 'revalidated'.
+Vary on request headers is otherwise ignored: every fetch for a URL sends
+the same headers.
+
+Layout under HTTP_CACHE_DIR:
+    index.db        SQLite index: URL → status, headers, validators, expiry, LRU time
+    bodies/ab/abcd… Response bodies, named by the SHA-256 of their URL
+
+When the bodies exceed max_bytes the least recently used entries are evicted.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+import httpx
+from .config import HTTP_CACHE_DIR, HTTP_CACHE_MAX_BYTES, HTTP_CACHE_DEFAULT_TTL
+
+# Response headers kept with a cached body
+STORED_HEADERS = ('content-type', 'etag', 'last-modified', 'cache-control', 'expires', 'date')
+
+
+def parse_cache_control(value):
+    """Cache-Control directives as a dict: lowercased name → value (True for bare directives)."""
+    directives = {}
+    for part in (value or '').split(','):
+        name, _, arg = part.strip().partition('=')
+        if name:
+            directives[name.lower()] = arg.strip().strip('"') if arg else True
+    return directives
+
+
+def _http_date(value):
+    try:
+        return parsedate_to_datetime(value).timestamp() if value else None
+    except (TypeError, ValueError):
+        return None
+
+
+def freshness_lifetime(headers, default=HTTP_CACHE_DEFAULT_TTL, now=None):
+    """
+    Seconds a response stays fresh from now, or None if it must not be
+    stored at all. Follows RFC 9111 for a shared cache: s-maxage, max-age,
+    then Expires (all less the Age header), then a heuristic of 10% of the
+    time since Last-Modified, and finally default; heuristics never exceed
+    default.
+    """
+    now = time.time() if now is None else now
+    directives = parse_cache_control(headers.get('cache-control'))
+    if 'no-store' in directives or 'private' in directives or headers.get('vary', '').strip() == '*':
+        return None
+    if 'no-cache' in directives:
+        return 0
+
+    try:
+        age = max(0, int(headers.get('age') or 0))
+    except ValueError:
+        age = 0
+    for name in ('s-maxage', 'max-age'):
+        if name in directives:
+            try:
+                return max(0, int(directives[name]) - age)
+            except (TypeError, ValueError):
+                return 0
+
+    date = _http_date(headers.get('date')) or now
+    if headers.get('expires') is not None:
+        expires = _http_date(headers.get('expires'))
+        return max(0, expires - date - age) if expires is not None else 0
+
+    last_modified = _http_date(headers.get('last-modified'))
+    if last_modified is not None:
+        return min(default, max(0, (date - last_modified) / 10))
+    return default
+
+
+class HttpCache:
+    def __init__(self, directory=HTTP_CACHE_DIR, max_bytes=HTTP_CACHE_MAX_BYTES, default_ttl=HTTP_CACHE_DEFAULT_TTL):
+        self.directory = Path(directory)
+        self.body_dir = self.directory / 'bodies'
+        self.body_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.directory / 'index.db'), check_same_thread=False, timeout=30)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript('''
+            CREATE TABLE IF NOT EXISTS responses (
+                url TEXT PRIMARY KEY,
+                final_url TEXT NOT NULL,
+                status INTEGER NOT NULL,
+                headers TEXT NOT NULL,
+                http_version TEXT,
+                etag TEXT,
+                last_modified TEXT,
+                size INTEGER NOT NULL,
+                expires_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS responses_lru ON responses (last_access);
+        ''')
+        self._conn.commit()
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.evictions = 0
+
+    def lookup(self, url):
+        """
+        Find a stored response for url.
+
+        Returns None on a miss, otherwise a dict with 'result' (a FetchResult
+        with cache_status 'hit'), 'etag', 'last_modified' and 'fresh' (False
+        means it must be revalidated first). Fresh lookups count as hits.
+        """
+        with self._lock:
+            entry = self._read(url)
+            if entry is None or not entry['fresh']:
+                self.misses += 1
+                return entry
+            self.hits += 1
+            self._conn.execute('UPDATE responses SET last_access = ? WHERE url = ?', (time.time(), url))
+            self._conn.commit()
+        return entry
+
+    def store(self, url, result):
+        """Store a 200 response if its headers allow it. Returns True if it was stored."""
+        lifetime = freshness_lifetime(result.headers, self.default_ttl)
+        if result.status_code != 200 or lifetime is None or len(result.content) > self.max_bytes:
+            return False
+
+        path = self._body_path(url)
+        path.parent.mkdir(exist_ok=True)
+        tmp = path.with_suffix(f'.{os.getpid()}.{threading.get_ident()}.tmp')
+        tmp.write_bytes(result.content)
+        os.replace(tmp, path)
+
+        headers = {name: result.headers[name] for name in STORED_HEADERS if name in result.headers}
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO responses (url, final_url, status, headers, http_version, etag, '
+                'last_modified, size, expires_at, last_access) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (url, result.url, result.status_code, json.dumps(headers), result.http_version,
+                 headers.get('etag'), headers.get('last-modified'), len(result.content), now + lifetime, now)
+            )
+            self._evict(keep=url)
+            self._conn.commit()
+        return True
+
+    def revalidated(self, url, headers):
+        """
+        Record a 304 for a stored response: update its validators and expiry
+        from the 304's headers. Returns the stored FetchResult (cache_status
+        'revalidated'), or None if the entry vanished meanwhile.
+        """
+        with self._lock:
+            entry = self._read(url)
+            if entry is None:
+                return None
+            cached = entry['result']
+            merged = dict(cached.headers)
+            merged.update({name: headers[name] for name in STORED_HEADERS if name in headers})
+            lifetime = freshness_lifetime(merged, self.default_ttl) or 0
+            now = time.time()
+            self.hits += 1
+            self.revalidations += 1
+            self._conn.execute(
+                'UPDATE responses SET headers = ?, etag = ?, last_modified = ?, expires_at = ?, last_access = ? '
+                'WHERE url = ?',
+                (json.dumps(merged), merged.get('etag'), merged.get('last-modified'), now + lifetime, now, url)
+            )
+            self._conn.commit()
+        return self._result(cached.url, cached.status_code, merged, cached.content, cached.http_version,
+                            'revalidated')
+
+    def stats(self):
+        """Counters and current size, for logging and metrics."""
+        with self._lock:
+            entries, total = self._conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses'
+            ).fetchone()
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'revalidations': self.revalidations,
+            'evictions': self.evictions,
+            'responses': entries,
+            'bytes': total,
+        }
+
+    def _read(self, url):
+        """A lookup() entry for url without touching counters or LRU time. Caller holds the lock."""
+        row = self._conn.execute(
+            'SELECT final_url, status, headers, http_version, etag, last_modified, expires_at '
+            'FROM responses WHERE url = ?', (url,)
+        ).fetchone()
+        if row is None:
+            return None
+
+        final_url, status, headers, http_version, etag, last_modified, expires_at = row
+        try:
+            body = self._body_path(url).read_bytes()
+        except FileNotFoundError:
+            # Body vanished (manual cleanup); treat as a miss
+            self._conn.execute('DELETE FROM responses WHERE url = ?', (url,))
+            self._conn.commit()
+            return None
+        return {
+            'result': self._result(final_url, status, json.loads(headers), body, http_version, 'hit'),
+            'etag': etag,
+            'last_modified': last_modified,
+            'fresh': time.time() < expires_at,
+        }
+
+    @staticmethod
+    def _result(url, status, headers, body, http_version, cache_status):
+        from .fetch import FetchResult  # fetch.py imports this module
+        return FetchResult(url, status, httpx.Headers(headers), body, http_version, cache_status=cache_status)
+
+    def _body_path(self, url):
+        digest = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        return self.body_dir / digest[:2] / digest
+
+    def _evict(self, keep):
+        """Drop least recently used responses until under max_bytes. Caller holds the lock."""
+        total = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for url, size in self._conn.execute(
+            'SELECT url, size FROM responses WHERE url != ? ORDER BY last_access', (keep,)
+        ).fetchall():
+            self._conn.execute('DELETE FROM responses WHERE url = ?', (url,))
+            try:
+                self._body_path(url).unlink()
+            except FileNotFoundError:
+                pass
+            self.evictions += 1
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_http_cache():
+    """Process-wide HTTP cache, or None when HTTP_CACHE_MAX_BYTES is 0."""
+    global _default_cache
+    if HTTP_CACHE_MAX_BYTES <= 0:
+        return None
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = HttpCache()
+        return _default_cache
@@ -0,0 +1,226 @@
+"""
+Persistent Cache of Kindle-Optimized Images
+
+Newsletters reuse the same hero images, author photos and banners in every
+issue, so we keep the already-transcoded JPEG bytes on disk and reuse them
+across conversions and users.
+
+Layout under IMAGE_CACHE_DIR:
+    index.db        SQLite index: source URL → blob digest, validators, LRU time
+    blobs/ab/abcd…  JPEG bytes, named by the SHA-256 of their content
+
+Blobs are content-addressed, so two URLs serving byte-identical images
+share one file. Near-duplicates (re-encoded, resized) are never merged here:
+the cache is shared by every article and user, and a perceptual match
+between unrelated pictures would put one user's image in another's EPUB.
+That merging happens only within one article (dedupe_images in
+app/image_index.py). Each entry records the image's fingerprint so lookups
+can return it and conversions don't recompute it.
+
+Entries stay fresh for the lifetime the origin's Cache-Control / Expires
+headers give them (freshness_lifetime in app/http_cache.py, with
+IMAGE_CACHE_TTL as the default) and are served without touching the
+network; older ones are revalidated with If-None-Match / If-Modified-Since.
+Responses marked no-store or private are not cached. When the blobs exceed max_bytes the least recently used entries are evicted.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from .config import IMAGE_CACHE_DIR, IMAGE_CACHE_MAX_BYTES, IMAGE_CACHE_TTL
+from .image_index import Fingerprint
+
+# Added after the first release; created on open if missing
+ADDED_COLUMNS = {'phash': 'TEXT', 'width': 'INTEGER', 'height': 'INTEGER', 'variant': 'TEXT', 'expires_at': 'REAL'}
+
+
+class ImageCache:
+    def __init__(self, directory=IMAGE_CACHE_DIR, max_bytes=IMAGE_CACHE_MAX_BYTES, ttl=IMAGE_CACHE_TTL):
+        self.directory = Path(directory)
+        self.blob_dir = self.directory / 'blobs'
+        self.blob_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.directory / 'index.db'), check_same_thread=False, timeout=30)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript('''
+            CREATE TABLE IF NOT EXISTS entries (
+                url TEXT PRIMARY KEY,
+                digest TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                validated_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS entries_lru ON entries (last_access);
+            CREATE INDEX IF NOT EXISTS entries_digest ON entries (digest);
+        ''')
+        existing = {row[1] for row in self._conn.execute('PRAGMA table_info(entries)')}
+        for column, column_type in ADDED_COLUMNS.items():
+            if column not in existing:
+                self._conn.execute(f'ALTER TABLE entries ADD COLUMN {column} {column_type}')
+        self._conn.commit()
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.evictions = 0
+
+    def lookup(self, url):
+        """
+        Find a cached image for url.
+
+        Returns None on a miss, otherwise a dict with 'data', 'etag',
+        'last_modified', 'fingerprint' (None for entries stored without one)
+        and 'fresh' (False means it should be revalidated). Fresh lookups
+        count as hits.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT digest, etag, last_modified, validated_at, expires_at, phash, width, height '
+                'FROM entries WHERE url = ?', (url,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            digest, etag, last_modified, validated_at, expires_at, phash, width, height = row
+            try:
+                data = self._blob_path(digest).read_bytes()
+            except FileNotFoundError:
+                # Blob vanished (manual cleanup); treat as a miss
+                self._conn.execute('DELETE FROM entries WHERE url = ?', (url,))
+                self._conn.commit()
+                self.misses += 1
+                return None
+
+            # Entries from before expires_at existed get the default lifetime
+            fresh = time.time() < (expires_at if expires_at is not None else validated_at + self.ttl)
+            if fresh:
+                self.hits += 1
+                self._conn.execute('UPDATE entries SET last_access = ? WHERE url = ?', (time.time(), url))
+                self._conn.commit()
+            return {
+                'data': data,
+                'etag': etag,
+                'last_modified': last_modified,
+                'fingerprint': Fingerprint(digest, int(phash, 16), width, height) if phash else None,
+                'fresh': fresh,
+            }
+
+    def revalidated(self, url, lifetime=None):
+        """Record that the origin answered 304 for a stale entry, fresh for lifetime seconds (default ttl)."""
+        now = time.time()
+        lifetime = self.ttl if lifetime is None else lifetime
+        with self._lock:
+            self.hits += 1
+            self.revalidations += 1
+            self._conn.execute(
+                'UPDATE entries SET validated_at = ?, expires_at = ?, last_access = ? WHERE url = ?',
+                (now, now + lifetime, now, url)
+            )
+            self._conn.commit()
+
+    def put(self, url, data, etag=None, last_modified=None, fingerprint=None, group=None, lifetime=None):
+        """
+        Store optimized image bytes for url, fresh for lifetime seconds
+        (default ttl), and evict down to max_bytes. group is the device
+        profile variant the bytes were transcoded for. Bytes identical to a
+        stored blob share it; anything else gets its own blob.
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._blob_path(digest)
+        size = len(data)
+        if path.exists():
+            size = path.stat().st_size
+        else:
+            path.parent.mkdir(exist_ok=True)
+            tmp = path.with_suffix(f'.{os.getpid()}.{threading.get_ident()}.tmp')
+            tmp.write_bytes(data)
+            os.replace(tmp, path)
+
+        now = time.time()
+        with self._lock:
+            old = self._conn.execute('SELECT digest FROM entries WHERE url = ?', (url,)).fetchone()
+            self._conn.execute(
+                'INSERT OR REPLACE INTO entries (url, digest, size, etag, last_modified, validated_at, last_access, '
+                'phash, width, height, variant, expires_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (url, digest, size, etag, last_modified, now, now,
+                 f'{fingerprint.phash:016x}' if fingerprint else None,
+                 fingerprint.width if fingerprint else None, fingerprint.height if fingerprint else None, group,
+                 now + (self.ttl if lifetime is None else lifetime))
+            )
+            if old and old[0] != digest:
+                self._drop_blob_if_unused(old[0])
+            self._conn.commit()
+            self._evict()
+
+    def stats(self):
+        """Counters and current size, for logging and metrics."""
+        with self._lock:
+            entries, total = self._conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM (SELECT DISTINCT digest, size FROM entries)'
+            ).fetchone()
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'revalidations': self.revalidations,
+            'evictions': self.evictions,
+            'blobs': entries,
+            'bytes': total,
+        }
+
+    def _blob_path(self, digest):
+        return self.blob_dir / digest[:2] / digest
+
+    def _stored_bytes(self):
+        return self._conn.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM (SELECT DISTINCT digest, size FROM entries)'
+        ).fetchone()[0]
+
+    def _evict(self):
+        """Drop least recently used entries until under max_bytes. Caller holds the lock."""
+        total = self._stored_bytes()
+        if total <= self.max_bytes:
+            return
+
+        for url, digest in self._conn.execute(
+            'SELECT url, digest FROM entries ORDER BY last_access'
+        ).fetchall():
+            self._conn.execute('DELETE FROM entries WHERE url = ?', (url,))
+            self.evictions += 1
+            if self._drop_blob_if_unused(digest):
+                total = self._stored_bytes()
+                if total <= self.max_bytes:
+                    break
+        self._conn.commit()
+
+    def _drop_blob_if_unused(self, digest):
+        """Delete a blob file once no entry references it. Caller holds the lock."""
+        in_use = self._conn.execute('SELECT 1 FROM entries WHERE digest = ? LIMIT 1', (digest,)).fetchone()
+        if in_use:
+            return False
+        try:
+            self._blob_path(digest).unlink()
+        except FileNotFoundError:
+            pass
+        return True
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_image_cache():
+    """Process-wide cache, or None when IMAGE_CACHE_MAX_BYTES is 0."""
+    global _default_cache
+    if IMAGE_CACHE_MAX_BYTES <= 0:
+        return None
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = ImageCache()
+        return _default_cache
@@ -0,0 +1,210 @@
+"""
+Image Fingerprints and Duplicate Detection
+
+Articles embed the same picture more than once: a lazy-load preview next to
+the real image, a divider repeated between sections, one chart served at two
+CDN sizes. Every transcoded image gets a fingerprint:
+
+- digest: SHA-256 of the JPEG bytes, for byte-identical copies
+- phash: a 64-bit difference hash (brightness gradients of a 9x8 grayscale
+  thumbnail), which survives resizing and recompression
+- width and height; perceptual matches must have the same aspect ratio
+
+A dHash match alone isn't proof: screenshots of different tweets or text
+share a layout and hash almost identically. Perceptual candidates are
+therefore confirmed by comparing the two images at COMPARE_WIDTH pixels
+(same_picture): the same picture at two sizes differs almost nowhere,
+while different text changes a few percent of the pixels.
+
+ImageIndex finds an earlier image that a new one duplicates. Perceptual
+lookups don't scan every entry: the hash is split into 8 bytes, and two
+hashes within 7 bits of each other must agree on at least one byte, so only
+entries sharing a byte are compared.
+
+Within an article, ImageProcessor.download_images keeps one copy of each
+picture (the one with most pixels) and points every <img> at it. Across
+articles only byte-identical images are shared (the image cache's blobs
+are content-addressed): a perceptual match is a judgement about two
+pictures, and a wrong one must never cross from one user's article into
+another's.
+"""
+
+import hashlib
+from collections import namedtuple
+from io import BytesIO
+from PIL import Image, ImageChops
+from .config import IMAGE_DEDUPE_DISTANCE, IMAGE_DEDUPE_MAX_CHANGED
+
+Fingerprint = namedtuple('Fingerprint', 'digest phash width height')
+
+# Width both images are scaled to by same_picture, and how far (of 255) a
+# pixel must differ to count as changed
+COMPARE_WIDTH = 128
+CHANGED_LEVEL = 32
+
+
+def dhash(img):
+    """64-bit difference hash of a PIL image: 1 where a pixel is brighter than its right neighbour."""
+    small = img.convert('L').resize((9, 8), Image.Resampling.BOX)
+    pixels = small.tobytes()
+    value = 0
+    for row in range(8):
+        offset = row * 9
+        for col in range(8):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def fingerprint(data):
+    """Fingerprint image bytes (normally a transcoded JPEG, which decodes cheaply at 1/8 scale)."""
+    img = Image.open(BytesIO(data))
+    width, height = img.size
+    if img.format == 'JPEG':
+        img.draft('L', (64, 64))
+    return Fingerprint(hashlib.sha256(data).hexdigest(), dhash(img), width, height)
+
+
+def hamming(a, b):
+    return (a ^ b).bit_count()
+
+
+def same_aspect(a, b, tolerance=0.02):
+    cross_a, cross_b = a.width * b.height, b.width * a.height
+    return abs(cross_a - cross_b) <= tolerance * max(cross_a, cross_b)
+
+
+def _gray(data, width):
+    img = Image.open(BytesIO(data))
+    if img.format == 'JPEG':
+        img.draft('L', (width, width))
+    return img.convert('L')
+
+
+def same_picture(data_a, data_b, max_changed=IMAGE_DEDUPE_MAX_CHANGED):
+    """
+    Confirm a perceptual match: scale both images to COMPARE_WIDTH (or the
+    narrower one's width) and allow at most max_changed of the pixels to
+    differ by more than CHANGED_LEVEL.
+    """
+    a, b = _gray(data_a, COMPARE_WIDTH), _gray(data_b, COMPARE_WIDTH)
+    width = min(COMPARE_WIDTH, a.width, b.width)
+    size = (width, max(1, round(width * a.height / a.width)))
+    diff = ImageChops.difference(a.resize(size, Image.Resampling.BOX), b.resize(size, Image.Resampling.BOX))
+    changed = sum(diff.histogram()[CHANGED_LEVEL + 1:])
+    return changed <= max_changed * size[0] * size[1]
+
+
+class ImageIndex:
+    """
+    Fingerprints by key, answering "is this picture already here?".
+
+    Entries can be put in groups; lookups only match within a group. Not
+    thread-safe; callers lock.
+    """
+
+    def __init__(self, max_distance=IMAGE_DEDUPE_DISTANCE):
+        # 8 one-byte bands only guarantee a shared band up to 7 differing bits
+        self.max_distance = min(max_distance, 7)
+        self._entries = {}   # key -> (group, fingerprint)
+        self._exact = {}     # (group, digest) -> set of keys
+        self._bands = {}     # (group, band, byte) -> set of keys
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def add(self, key, fp, group=None):
+        self.remove(key)
+        self._entries[key] = (group, fp)
+        self._exact.setdefault((group, fp.digest), set()).add(key)
+        for band in self._band_keys(fp.phash, group):
+            self._bands.setdefault(band, set()).add(key)
+
+    def remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        group, fp = entry
+        self._discard(self._exact, (group, fp.digest), key)
+        for band in self._band_keys(fp.phash, group):
+            self._discard(self._bands, band, key)
+
+    def find(self, fp, group=None, confirm=None):
+        """
+        Key of an indexed duplicate of fp, or None. Exact matches win;
+        perceptual candidates are tried nearest first and must pass
+        confirm(key) (normally same_picture on the two images' bytes).
+        """
+        exact = self._exact.get((group, fp.digest))
+        if exact:
+            return next(iter(exact))
+        if self.max_distance < 0:
+            return None
+
+        candidates = set()
+        for band in self._band_keys(fp.phash, group):
+            candidates.update(self._bands.get(band, ()))
+
+        nearby = []
+        for key in candidates:
+            other = self._entries[key][1]
+            distance = hamming(fp.phash, other.phash)
+            if distance <= self.max_distance and same_aspect(fp, other):
+                nearby.append((distance, key))
+        for _, key in sorted(nearby, key=lambda item: item[0]):
+            if confirm is None or confirm(key):
+                return key
+        return None
+
+    def fingerprint_of(self, key):
+        entry = self._entries.get(key)
+        return entry[1] if entry else None
+
+    @staticmethod
+    def _band_keys(phash, group):
+        return [(group, band, (phash >> (band * 8)) & 0xFF) for band in range(8)]
+
+    @staticmethod
+    def _discard(table, bucket, key):
+        keys = table.get(bucket)
+        if keys:
+            keys.discard(key)
+            if not keys:
+                del table[bucket]
+
+
+def dedupe_images(images, index=None):
+    """
+    Collapse duplicate downloaded images.
+
+    images are download_images() entries carrying a 'fingerprint'. Returns
+    the images to embed, in their original order: for each group of
+    duplicates, the copy with the most pixels, with the other copies'
+    original URLs listed under 'aliases' so their <img> tags can point at it.
+    """
+    index = ImageIndex() if index is None else index
+    kept = {}      # key -> image
+    order = []
+    for position, image in enumerate(images):
+        fp = image['fingerprint']
+        match = index.find(fp, confirm=lambda key: same_picture(kept[key]['data'], image['data']))
+        if match is None:
+            index.add(position, fp)
+            kept[position] = image
+            order.append(position)
+            continue
+
+        original = kept[match]
+        aliases = original.setdefault('aliases', [])
+        if fp.width * fp.height > original['fingerprint'].width * original['fingerprint'].height:
+            # The later copy is sharper: it takes the earlier one's place
+            image['aliases'] = aliases + [original['original_url']] + image.get('aliases', [])
+            original.pop('aliases', None)
+            kept[match] = image
+            index.add(match, fp)
+        else:
+            aliases.append(image['original_url'])
+            aliases.extend(image.get('aliases', []))
+    return [kept[position] for position in order]
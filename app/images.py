@@ -1,163 +1,588 @@
-import requests
+import asyncio
+import functools
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from PIL import Image
 from io import BytesIO
 from urllib.parse import urljoin
-from bs4 import BeautifulSoup
-from .config import MAX_IMAGE_WIDTH, MAX_IMAGE_HEIGHT, IMAGE_QUALITY
+from .config import (
+    MAX_IMAGE_WIDTH, MAX_IMAGE_HEIGHT, IMAGE_QUALITY,
+    IMAGE_DOWNLOAD_WORKERS, IMAGE_PHASE_DEADLINE,
+    IMAGE_TRANSCODE_PROCESSES, IMAGE_MAX_BYTES, IMAGE_MAX_PIXELS
+)
+from .fetch import get_fetch_engine, FetchError, FetchBudgetExceeded
+from .image_cache import get_image_cache
+from .http_cache import freshness_lifetime
+from .site_rules import rules_for
+from .devices import transcode_options, cache_variant
+from .image_index import fingerprint, dedupe_images
+from .metrics import stage, count, current_trace, use_trace, progress
+
+
+IMAGE_USER_AGENT = 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+
 
 class ImageProcessor:
-    def __init__(self, session=None):
-        self.session = session or requests.Session()
-        self.session.headers.update({
-            'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
-        })
-
-    def extract_images_from_original_html(self, soup, base_url):
-        """Extract image URLs from original HTML content areas - ported from simple_web_app.py"""
+    def __init__(self, fetcher=None, cache=None):
+        self.fetcher = fetcher or get_fetch_engine()
+        self.cache = cache if cache is not None else get_image_cache()
+
+    def extract_images_from_original_html(self, tree, base_url, min_width=MAX_IMAGE_WIDTH):
+        """
+        Extract image URLs from the content area of the original page's lxml tree,
+        picking renditions at least min_width wide (see pick_image_source)
+        """
         images = []
+        rules = rules_for(base_url)
 
-        # Common selectors for newsletter content areas
-        content_selectors = [
-            'div[itemprop="articleBody"]',
-            '.post-content',
-            '.entry-content',
-            '.article-content',
-            '.body',
-            'article',
-            '.post',
-            '[data-testid="post-content"]',
-            '.substack-post-content',
-            '.post-body',
-            '.article-body',
-            '.content',
-            '.entry',
-            '.main-content'
-        ]
-
-        # Find the main content area
-        content_area = None
-        for selector in content_selectors:
-            content_area = soup.select_one(selector)
-            if content_area:
-                print(f"📍 Found content area: {selector}")
-                break
+        # Find the main content area (one walk over the tree; see app/site_rules.py)
+        selector, content_area = rules.content.find(tree)
+        if content_area is not None:
+            print(f"📍 Found content area: {selector}")
 
         # If no specific content area found, use the whole body
-        if not content_area:
-            content_area = soup.find('body') or soup
+        if content_area is None:
+            content_area = tree.find('body')
+            if content_area is None:
+                content_area = tree
             print("📍 Using full body for image extraction")
 
         # Extract images from content area
-        img_tags = content_area.find_all('img')
+        img_tags = list(content_area.iter('img'))
         print(f"🖼️  Found {len(img_tags)} images in content area")
 
         for img in img_tags:
-            img_url = None
-
-            # Try different image sources
-            if img.get('src'):
-                img_url = img['src']
-            elif img.get('data-src'):
-                img_url = img['data-src']
-            elif img.get('srcset'):
-                srcset_parts = img['srcset'].split(',')
-                if srcset_parts:
-                    img_url = srcset_parts[0].split()[0]
-            elif img.get('data-srcset'):
-                srcset_parts = img['data-srcset'].split(',')
-                if srcset_parts:
-                    img_url = srcset_parts[0].split()[0]
-
+            img_url = pick_image_source(img, base_url, min_width)
             if img_url:
-                img_url = img_url.strip()
-                if not img_url.startswith('http'):
-                    img_url = urljoin(base_url, img_url)
-
                 # Skip icons, logos, etc.
-                if not self.is_image_worth_downloading(img_url):
+                if not rules.wants_image(img_url):
                     continue
 
                 images.append(img_url)
 
         return images
 
-    def is_image_worth_downloading(self, url):
+    def is_image_worth_downloading(self, url, page_url=None):
         """Check if an image URL is worth downloading (not an icon/logo)"""
-        url_lower = url.lower()
-        skip_patterns = [
-            'icon', 'logo', 'avatar', 'favicon', 'social', 'share',
-            'button', 'sprite', 'badge', 'pixel', 'tracking'
-        ]
-
-        for pattern in skip_patterns:
-            if pattern in url_lower:
-                return False
-        return True
-
-    def download_image(self, url, referrer=None):
-        """Download and optimize image for Kindle"""
-        try:
-            # Skip very small images or icons
-            if 'icon' in url.lower() or 'favicon' in url.lower() or 'logo' in url.lower():
-                # print(f"⏭️  Skipping icon/logo: {url}")
-                return None
+        return rules_for(page_url or url).wants_image(url)
 
-            print(f"⬇️  Downloading: {url}")
-            
-            headers = {}
-            if referrer:
-                headers['Referer'] = referrer
-            
-            # Retry logic
-            max_retries = 3
-            response = None
-            
-            for attempt in range(max_retries):
-                try:
-                    response = self.session.get(url, timeout=15, allow_redirects=True, headers=headers)
-                    if response.status_code == 200:
-                        break
-                except requests.RequestException as e:
-                    if attempt == max_retries - 1:
-                        raise e
-                    continue
-            
-            response.raise_for_status()
+    def download_images(self, urls, referrer=None, max_workers=IMAGE_DOWNLOAD_WORKERS,
+                        deadline=IMAGE_PHASE_DEADLINE, profile=None):
+        """
+        Download and optimize a list of images concurrently.
+
+        Fetches run as asyncio tasks on the fetch engine (see app/fetch.py),
+        which pools connections and caps requests per host across the whole
+        process. Each fetched image is handed to the transcode process pool
+        (see transcode_image), so decoding and encoding use all cores instead
+        of contending for the GIL.
+
+        At most max_workers images of this batch are in flight at once. Images
+        still pending when the deadline expires are cancelled. Results keep the
+        order of urls, and each image is named image_{i}.jpg after its index in
+        urls regardless of completion order.
+
+        A URL listed twice is fetched once, and pictures that turn out to be
+        the same (see app/image_index.py) are kept once: the copy with the
+        most pixels stays, and the others' URLs go in its 'aliases'. Every URL
+        is counted as kept, skipped (images_skipped: rejected or failed) or a
+        duplicate (images_deduped).
+
+        Images are transcoded for the given device profile (app/devices.py;
+        None means the default).
+        """
+        if not urls:
+            return []
+        return self.fetcher.run(self._download_all(urls, referrer, max_workers, deadline, profile, current_trace()))
+
+    async def _download_all(self, urls, referrer, max_workers, deadline, profile, trace):
+        slots = asyncio.Semaphore(max(1, max_workers))
+        unique_urls = list(dict.fromkeys(urls))
+        finished = 0
+
+        async def one(url):
+            nonlocal finished
+            try:
+                async with slots:
+                    return await self._download_image(url, referrer, profile)
+            finally:
+                finished += 1
+                progress('images', done=finished, total=len(unique_urls), url=referrer)
+
+        with use_trace(trace):
+            progress('images', done=0, total=len(unique_urls), url=referrer)
+            tasks = {url: asyncio.ensure_future(one(url)) for url in unique_urls}
+        done, pending = await asyncio.wait(tasks.values(), timeout=deadline)
+        if pending:
+            print(f"⏱️  Image deadline ({deadline}s) hit, dropping {len(pending)} pending image(s)")
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+        processed_images = []
+        for i, url in enumerate(urls):
+            task = tasks.pop(url, None)
+            if task is None or task not in done or task.exception() or not task.result():
+                continue
+            img_data, fp = task.result()
+            processed_images.append({
+                'filename': f"image_{i}.jpg",
+                'data': img_data,
+                'original_url': url,
+                'fingerprint': fp,
+            })
+
+        with use_trace(trace):
+            with stage('image_dedupe'):
+                unique = await asyncio.to_thread(self._dedupe, processed_images)
+            # Of the URLs found: each kept, skipped (rejected or failed, counted
+            # once per URL) or a duplicate (a repeated URL or the same picture)
+            skipped = len(unique_urls) - len(processed_images)
+            deduped = len(urls) - len(unique_urls) + len(processed_images) - len(unique)
+            count('images_skipped', skipped)
+            count('images_deduped', deduped)
+        if deduped:
+            print(f"♻️  {deduped} duplicate image(s) embedded once")
+        return unique
+
+    @staticmethod
+    def _dedupe(images):
+        for image in images:
+            if image['fingerprint'] is None:
+                image['fingerprint'] = fingerprint(image['data'])
+        unique = dedupe_images(images)
+        for image in images:
+            del image['fingerprint']
+        return unique
+
+    def download_image(self, url, referrer=None, profile=None):
+        """Download and optimize one image (blocking)"""
+        result = self.fetcher.run(self._download_image(url, referrer, profile))
+        return result[0] if result else None
 
-            # Check content type
-            content_type = response.headers.get('content-type', '').lower()
-            if not content_type.startswith('image/'):
-                # print(f"⏭️  Not an image (content-type: {content_type})")
+    async def _download_image(self, url, referrer=None, profile=None):
+        """
+        Download and optimize image for Kindle, reusing the image cache when
+        possible. Returns (jpeg_bytes, fingerprint), where the fingerprint is
+        None if a cache entry predates fingerprints.
+        """
+        # Cached bytes are per profile; the fragment never reaches the network
+        variant = cache_variant(profile)
+        cache_key = f"{url}#{variant}" if variant else url
+        try:
+            cached = await asyncio.to_thread(self.cache.lookup, cache_key) if self.cache else None
+            if cached and cached['fresh']:
+                print(f"💾 Cached image: {url}")
+                count('image_cache_hits')
+                return cached['data'], cached['fingerprint']
+            if self.cache:
+                count('image_cache_misses')
+
+            with stage('image_download'):
+                response = await self._fetch_image(url, referrer=referrer, cached=cached)
+            if response is None:
                 return None
 
-            img = Image.open(BytesIO(response.content))
-
-            # Convert to RGB if necessary
-            if img.mode in ('RGBA', 'LA', 'P'):
-                background = Image.new('RGB', img.size, (255, 255, 255))
-                if img.mode == 'P':
-                    img = img.convert('RGBA')
-                background.paste(img, mask=img.split()[-1] if img.mode == 'RGBA' else None)
-                img = background
-            elif img.mode != 'RGB':
-                img = img.convert('RGB')
-
-            # Resize if too large
-            if img.width > MAX_IMAGE_WIDTH or img.height > MAX_IMAGE_HEIGHT:
-                img.thumbnail((MAX_IMAGE_WIDTH, MAX_IMAGE_HEIGHT), Image.Resampling.LANCZOS)
-            
-            # Skip if extremely small (likely pixel tracker) after processing
-            if img.width < 10 or img.height < 10:
-                print(f"⏭️  Image too small ({img.width}x{img.height})")
+            if response.status_code == 304 and cached:
+                print(f"💾 Revalidated cached image: {url}")
+                count('image_cache_revalidations')
+                lifetime = freshness_lifetime(response.headers, self.cache.ttl) or 0
+                await asyncio.to_thread(self.cache.revalidated, cache_key, lifetime)
+                return cached['data'], cached['fingerprint']
+
+            count('bytes_fetched', len(response.content))
+            with stage('transcode'):
+                result = await transcode_async(response.content, **transcode_options(profile))
+            if result is None:
                 return None
 
-            output = BytesIO()
-            img.save(output, format='JPEG', quality=IMAGE_QUALITY, optimize=True)
-            processed_data = output.getvalue()
+            processed_data, width, height = result
+            print(f"✅ Processed image: {width}x{height} → {len(processed_data)} bytes")
 
-            print(f"✅ Processed image: {img.width}x{img.height} → {len(processed_data)} bytes")
-            return processed_data
+            fp = await asyncio.to_thread(fingerprint, processed_data)
+            # None: the origin said no-store / private
+            lifetime = freshness_lifetime(response.headers, self.cache.ttl) if self.cache else None
+            if lifetime is not None:
+                await asyncio.to_thread(
+                    self.cache.put, cache_key, processed_data,
+                    etag=response.headers.get('ETag'),
+                    last_modified=response.headers.get('Last-Modified'),
+                    fingerprint=fp, group=variant, lifetime=lifetime
+                )
+            return processed_data, fp
 
         except Exception as e:
             print(f"❌ Error processing image {url}: {e}")
             return None
+
+    async def _fetch_image(self, url, referrer=None, cached=None):
+        """
+        Fetch an image (network stage only).
+
+        URLs are expected to have passed the skip patterns already (see
+        extract_images_from_original_html). If a stale cache entry is passed,
+        the request is conditional and may come back as a 304. Returns the
+        FetchResult, or None for non-images.
+        """
+        print(f"⬇️  Downloading: {url}")
+        
+        headers = {'User-Agent': IMAGE_USER_AGENT}
+        if referrer:
+            headers['Referer'] = referrer
+        if cached:
+            if cached.get('etag'):
+                headers['If-None-Match'] = cached['etag']
+            if cached.get('last_modified'):
+                headers['If-Modified-Since'] = cached['last_modified']
+        
+        # Retry logic (transport errors, host-slot timeouts and unexpected statuses, not blown budgets)
+        max_retries = 3
+        response = None
+        
+        for attempt in range(max_retries):
+            try:
+                response = await self.fetcher.fetch(
+                    url, headers=headers, max_bytes=IMAGE_MAX_BYTES, inspect=check_image_header
+                )
+                if response.status_code in (200, 304):
+                    break
+            except FetchBudgetExceeded as e:
+                print(f"⏭️  Rejected image: {e}")
+                count('images_rejected')
+                return None
+            except FetchError as e:
+                if attempt == max_retries - 1:
+                    raise e
+                continue
+        
+        response.raise_for_status()
+
+        if response.status_code == 304:
+            return response
+
+        # Check content type
+        content_type = response.headers.get('content-type', '').lower()
+        if not content_type.startswith('image/'):
+            # print(f"⏭️  Not an image (content-type: {content_type})")
+            return None
+
+        return response
+
+
+# <picture> source types Pillow can't decode; the <img> fallback is used instead
+UNSUPPORTED_SOURCE_TYPES = {'image/avif', 'image/jxl', 'image/heic', 'image/heif', 'image/svg+xml'}
+
+
+def parse_srcset(value):
+    """
+    Parse a srcset attribute into [(url, width, density)], with width (from
+    a "640w" descriptor) or density (from "2x") None when not given.
+
+    Follows the HTML parsing rules rather than splitting on commas, since
+    CDN URLs often contain them (e.g. .../w_424,c_limit,f_webp/... 424w).
+    """
+    candidates = []
+    pos, end = 0, len(value)
+    while pos < end:
+        while pos < end and (value[pos].isspace() or value[pos] == ','):
+            pos += 1
+        start = pos
+        while pos < end and not value[pos].isspace():
+            pos += 1
+        url = value[start:pos]
+
+        descriptors = ''
+        if url.endswith(','):
+            url = url.rstrip(',')
+        else:
+            start, depth = pos, 0
+            while pos < end and (value[pos] != ',' or depth):
+                if value[pos] == '(':
+                    depth += 1
+                elif value[pos] == ')':
+                    depth = max(0, depth - 1)
+                pos += 1
+            descriptors = value[start:pos]
+
+        width = density = None
+        for descriptor in descriptors.lower().split():
+            try:
+                if descriptor.endswith('w'):
+                    width = int(descriptor[:-1])
+                elif descriptor.endswith('x'):
+                    density = float(descriptor[:-1])
+            except ValueError:
+                pass
+        if url:
+            candidates.append((url, width, density))
+    return candidates
+
+
+def enclosing_picture(img):
+    """
+    The <picture> an <img> belongs to, or None. libxml2's HTML parser
+    doesn't know <source> is a void element and nests the <img> inside the
+    sources, so this looks past the immediate parent.
+    """
+    return next(img.iterancestors('picture'), None)
+
+
+def image_candidates(img):
+    """
+    Every rendition offered for an <img>: its srcset/data-srcset, plus the
+    srcsets of the <source> elements of an enclosing <picture> whose type
+    we can decode. Returns [(url, width, density)].
+    """
+    elements = []
+    picture = enclosing_picture(img)
+    if picture is not None:
+        for source in picture.iter('source'):
+            source_type = (source.get('type') or '').split(';')[0].strip().lower()
+            if source_type not in UNSUPPORTED_SOURCE_TYPES:
+                elements.append(source)
+    elements.append(img)
+
+    candidates = []
+    for el in elements:
+        for attr in ('srcset', 'data-srcset'):
+            if el.get(attr):
+                candidates.extend(parse_srcset(el.get(attr)))
+    return candidates
+
+
+def _fallback_source(img):
+    """The plain src (or lazy-load data-src), ignoring inline placeholders."""
+    for attr in ('src', 'data-src'):
+        url = (img.get(attr) or '').strip()
+        if url and not url.startswith('data:'):
+            return url
+    return None
+
+
+def pick_image_source(img, base_url, min_width=MAX_IMAGE_WIDTH):
+    """
+    Choose which URL to download for an <img>: the smallest rendition at
+    least min_width pixels wide, since anything larger is only shrunk to
+    MAX_IMAGE_WIDTH by transcode_image after downloading and decoding it.
+
+    - Width descriptors ("800w") are compared directly; density descriptors
+      ("2x") are converted using the img's width attribute when it has one.
+    - If no rendition is wide enough, the widest one is taken.
+    - Density-only srcsets with no width to go on pick the 1x rendition,
+      as a standard screen would.
+    - With no srcset at all, src (or data-src) is used.
+
+    Returns an absolute URL, or None.
+    """
+    declared_width = img.get('width', '')
+    declared_width = int(declared_width) if declared_width.isdigit() else None
+
+    sized, by_density = [], []
+    for url, width, density in image_candidates(img):
+        if width is None and density is not None and declared_width:
+            width = int(density * declared_width)
+        if width is not None:
+            sized.append((width, url))
+        else:
+            by_density.append((density or 1.0, url))
+
+    url = None
+    if sized:
+        adequate = [candidate for candidate in sized if candidate[0] >= min_width]
+        url = min(adequate)[1] if adequate else max(sized)[1]
+    elif by_density:
+        at_least_1x = [candidate for candidate in by_density if candidate[0] >= 1]
+        url = min(at_least_1x)[1] if at_least_1x else max(by_density)[1]
+    else:
+        url = _fallback_source(img)
+
+    if not url or url.startswith('data:'):
+        return None
+    return url if url.startswith('http') else urljoin(base_url, url)
+
+
+def image_source_urls(img, base_url):
+    """Every absolute URL an <img> (and its <picture>) could load, for matching downloads back to tags."""
+    urls = [url for url, _, _ in image_candidates(img)]
+    fallback = _fallback_source(img)
+    if fallback:
+        urls.append(fallback)
+    return [url if url.startswith('http') else urljoin(base_url, url) for url in urls]
+
+
+# How far into a download to look for the image header before giving up
+# (JPEGs can carry up to 64 KB of EXIF per APP segment before the frame header)
+IMAGE_SNIFF_BYTES = 256 * 1024
+
+
+def sniff_image_size(prefix):
+    """
+    (width, height) from the start of an image file, or None if it can't be
+    read yet. Lets Image.DecompressionBombError through.
+    """
+    try:
+        with Image.open(BytesIO(prefix)) as img:
+            return img.size
+    except Image.DecompressionBombError:
+        raise
+    except Exception:
+        return None
+
+
+def check_image_header(prefix, max_pixels=IMAGE_MAX_PIXELS):
+    """
+    Fetch inspect() hook: reject an image from its header, before the body
+    is downloaded, if it would decode to more than max_pixels (decompression
+    bombs included) or is a tracker-sized sliver.
+
+    Returns True once the header has been checked, False to see more bytes.
+    """
+    try:
+        size = sniff_image_size(prefix)
+    except Image.DecompressionBombError as e:
+        raise FetchBudgetExceeded(str(e)) from None
+    if size is None:
+        # Unreadable so far; after IMAGE_SNIFF_BYTES leave it to transcode_image
+        return len(prefix) >= IMAGE_SNIFF_BYTES
+
+    width, height = size
+    if width * height > max_pixels:
+        raise FetchBudgetExceeded(f"{width}x{height} image exceeds {max_pixels} pixels")
+    if width < 10 or height < 10:
+        raise FetchBudgetExceeded(f"image too small ({width}x{height})")
+    return True
+
+
+def transcode_image(data, max_width=MAX_IMAGE_WIDTH, max_height=MAX_IMAGE_HEIGHT, quality=IMAGE_QUALITY,
+                    max_pixels=IMAGE_MAX_PIXELS, grayscale=False, progressive=False):
+    """
+    Decode, flatten, resize and re-encode image bytes as a Kindle-friendly JPEG
+    (grayscale for e-ink profiles, progressive if asked; see app/devices.py).
+
+    Pure CPU work with no shared state, so it can run in a worker process.
+    Returns (jpeg_bytes, width, height), or None if the image is too small
+    (or too large) to keep.
+    """
+    try:
+        img = Image.open(BytesIO(data))
+    except Image.DecompressionBombError as e:
+        print(f"⏭️  {e}")
+        return None
+
+    # Refuse decompression bombs before decoding a single pixel
+    if img.width * img.height > max_pixels:
+        print(f"⏭️  Image too large to decode ({img.width}x{img.height})")
+        return None
+
+    target_mode = 'L' if grayscale else 'RGB'
+
+    # JPEGs being shrunk anyway: let libjpeg decode at 1/2, 1/4 or 1/8 scale
+    # (never below the target size), which cuts decode time and memory.
+    # For grayscale output it can also decode just the luma channel.
+    scale = min(max_width / img.width, max_height / img.height)
+    if img.format == 'JPEG' and (scale < 1 or grayscale):
+        draft_mode = 'L' if grayscale and img.mode in ('RGB', 'L') else img.mode
+        scale = min(scale, 1)
+        img.draft(draft_mode, (max(1, int(img.width * scale)), max(1, int(img.height * scale))))
+
+    # Flatten transparency onto white, then convert to the output mode
+    if img.mode in ('RGBA', 'LA', 'P'):
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        if img.mode == 'P':
+            img = img.convert('RGBA')
+        background.paste(img, mask=img.split()[-1] if img.mode in ('RGBA', 'LA') else None)
+        img = background
+    if img.mode != target_mode:
+        img = img.convert(target_mode)
+
+    # Resize if too large
+    if img.width > max_width or img.height > max_height:
+        img.thumbnail((max_width, max_height), Image.Resampling.LANCZOS)
+    
+    # Skip if extremely small (likely pixel tracker) after processing
+    if img.width < 10 or img.height < 10:
+        print(f"⏭️  Image too small ({img.width}x{img.height})")
+        return None
+
+    output = BytesIO()
+    img.save(output, format='JPEG', quality=quality, optimize=True, progressive=progressive)
+    return output.getvalue(), img.width, img.height
+
+
+def shrink_image(data, scale=1.0, quality=IMAGE_QUALITY):
+    """
+    Re-encode an image we already transcoded, scaled by scale (<= 1) at the
+    given quality, keeping it grayscale if it is. Returns the smaller of the
+    result and the input, so shrinking never grows an image. Used to fit an
+    EPUB into its byte budget without fetching anything again.
+    """
+    try:
+        with Image.open(BytesIO(data)) as img:
+            width, height, grayscale = img.width, img.height, img.mode == 'L'
+    except Exception:
+        return data
+    result = transcode_image(
+        data, max_width=max(10, int(width * scale)), max_height=max(10, int(height * scale)),
+        quality=quality, grayscale=grayscale, progressive=True
+    )
+    if result is None or len(result[0]) >= len(data):
+        return data
+    return result[0]
+
+
+def shrink_images(datas, scale=1.0, quality=IMAGE_QUALITY):
+    """shrink_image over many images, in the transcode process pool when there is one."""
+    global _transcode_pool
+    job = functools.partial(shrink_image, scale=scale, quality=quality)
+    pool = _get_transcode_pool()
+    if pool is None or len(datas) < 2:
+        return [job(data) for data in datas]
+    try:
+        return list(pool.map(job, datas))
+    except BrokenProcessPool:
+        print("⚠️  Transcode pool died; shrinking inline")
+        with _transcode_pool_lock:
+            if _transcode_pool is pool:
+                _transcode_pool = None
+        return [job(data) for data in datas]
+
+
+# Process pool for transcoding, created lazily once per process
+_transcode_pool = None
+_transcode_pool_lock = threading.Lock()
+
+
+def _get_transcode_pool():
+    global _transcode_pool
+    if IMAGE_TRANSCODE_PROCESSES <= 0:
+        return None
+    with _transcode_pool_lock:
+        if _transcode_pool is None:
+            # spawn rather than fork: the parent is multi-threaded (Flask, download pool)
+            _transcode_pool = ProcessPoolExecutor(
+                max_workers=IMAGE_TRANSCODE_PROCESSES,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        return _transcode_pool
+
+
+async def transcode_async(data, **kwargs):
+    """
+    Await transcode_image in the shared process pool without blocking the
+    fetch engine's event loop. Falls back to a thread if the pool is disabled
+    or has died.
+    """
+    global _transcode_pool
+    loop = asyncio.get_running_loop()
+    job = functools.partial(transcode_image, data, **kwargs)
+    pool = _get_transcode_pool()
+    try:
+        return await loop.run_in_executor(pool, job)
+    except BrokenProcessPool:
+        print("⚠️  Transcode pool died; transcoding inline")
+        with _transcode_pool_lock:
+            if _transcode_pool is pool:
+                _transcode_pool = None
+        return await loop.run_in_executor(None, job)
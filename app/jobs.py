@@ -0,0 +1,597 @@
+"""
+Background Job Queue for Conversions
+
+The inbound-email webhook must answer SendGrid quickly, so instead of converting
+inline it enqueues a ConversionJob row. A JobWorker polls the table, atomically
+claims queued jobs and runs extract → build EPUB → send on a small thread pool.
+
+The web UI queues its conversions here too. While a job runs, the pipeline's
+progress() steps (fetched, N/M images, built, sent) are collected by
+JobProgress and written to the job row a couple of times a second, which the
+web app streams to the browser.
+
+Every finished run is also recorded as a Conversion row (title, size, image
+count, stage timings, outcome and stored EPUBs): the user's history page and
+the download links are served from those rows.
+
+The queue lives in the app database (SQLite locally, Postgres on Railway), so
+job status survives restarts and duplicate webhook deliveries are collapsed by
+the unique dedupe_key.
+
+Run a worker with:  python worker.py
+"""
+
+import hashlib
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from sqlalchemy.exc import IntegrityError
+from .models import db, User, ConversionJob, Conversion
+from .content import ContentExtractor
+from .epub import EpubBuilder, EpubFile
+from .sender import KindleSender
+from .article_cache import get_article_cache
+from .epub_store import get_epub_store, download_name
+from .devices import profile_for_user, cache_variant
+from .metrics import start_trace, count, current_trace, use_trace, progress
+from .config import (
+    JOB_WORKER_CONCURRENCY, JOB_POLL_INTERVAL, JOB_MAX_ATTEMPTS, JOB_STALE_SECONDS, JOB_RECOVERY_INTERVAL,
+    JOB_PROGRESS_INTERVAL, BATCH_CONCURRENCY
+)
+
+
+def make_dedupe_key(*parts):
+    """Build a stable key from the identifying parts of a delivery."""
+    raw = '\x1f'.join(str(p or '') for p in parts)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def enqueue_conversion(url, to_email, user=None, dedupe_key=None, title=None, hold=False):
+    """
+    Queue a conversion job.
+
+    With hold=True the job is parked as 'held' for the user's next digest
+    instead of being queued for a worker (see app/digest.py).
+
+    Returns (job, created). If a job with the same dedupe_key already exists,
+    that job is returned with created=False and nothing new is queued.
+    """
+    dedupe_key = dedupe_key or make_dedupe_key(url, to_email, time.time())
+
+    existing = ConversionJob.query.filter_by(dedupe_key=dedupe_key).first()
+    if existing:
+        return existing, False
+
+    job = ConversionJob(
+        dedupe_key=dedupe_key,
+        user_id=user.id if user else None,
+        url=url,
+        to_email=to_email,
+        title=title,
+        status=ConversionJob.STATUS_HELD if hold else ConversionJob.STATUS_QUEUED,
+    )
+    db.session.add(job)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Another request inserted the same delivery between our check and insert
+        db.session.rollback()
+        return ConversionJob.query.filter_by(dedupe_key=dedupe_key).first(), False
+
+    print(f"📨 {'Held' if hold else 'Queued'} job {job.id}: {', '.join(job.urls)}")
+    return job, True
+
+
+def enqueue_batch(urls, to_email, title, user=None, dedupe_key=None):
+    """
+    Queue several URLs to be compiled into one EPUB and sent as one email.
+
+    Duplicate URLs are dropped (keeping order). Returns (job, created) like
+    enqueue_conversion.
+    """
+    unique = list(dict.fromkeys(u.strip() for u in urls if u and u.strip()))
+    dedupe_key = dedupe_key or make_dedupe_key(*unique, to_email, time.time())
+    return enqueue_conversion('\n'.join(unique), to_email, user=user, dedupe_key=dedupe_key, title=title)
+
+
+def claim_next_job():
+    """
+    Atomically move the oldest queued job to running.
+
+    The conditional UPDATE means two workers racing for the same row can't
+    both win, whichever database is behind the queue.
+    """
+    for _ in range(5):
+        job = (ConversionJob.query
+               .filter_by(status=ConversionJob.STATUS_QUEUED)
+               .order_by(ConversionJob.id)
+               .first())
+        if not job:
+            return None
+
+        now = datetime.utcnow()
+        claimed = (ConversionJob.query
+                   .filter_by(id=job.id, status=ConversionJob.STATUS_QUEUED)
+                   .update({
+                       'status': ConversionJob.STATUS_RUNNING,
+                       'attempts': ConversionJob.attempts + 1,
+                       'started_at': now,
+                       'heartbeat_at': now,
+                   }, synchronize_session=False))
+        db.session.commit()
+        if claimed:
+            return db.session.get(ConversionJob, job.id)
+    return None
+
+
+def requeue_stale_jobs(max_age=JOB_STALE_SECONDS):
+    """
+    Return jobs orphaned by a crashed worker to the queue (or fail them).
+
+    A running job's worker refreshes heartbeat_at on every progress flush, so
+    only jobs it hasn't touched for max_age count as stale, however long the
+    job itself has been running.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=max_age)
+    last_seen = db.func.coalesce(ConversionJob.heartbeat_at, ConversionJob.started_at)
+    stale = (ConversionJob.query
+             .filter(ConversionJob.status == ConversionJob.STATUS_RUNNING, last_seen < cutoff)
+             .all())
+    for job in stale:
+        if job.attempts >= JOB_MAX_ATTEMPTS:
+            job.status = ConversionJob.STATUS_FAILED
+            job.error = job.error or 'Worker timed out'
+            job.finished_at = datetime.utcnow()
+        else:
+            job.status = ConversionJob.STATUS_QUEUED
+    if stale:
+        db.session.commit()
+        print(f"♻️  Recovered {len(stale)} stale job(s)")
+    return len(stale)
+
+
+def record_conversion(job, state, trace=None, conversion=None):
+    """
+    Add a Conversion row for a finished run of job, from its last progress
+    state and its trace (None if it failed before the trace started), and
+    flush it so its id is known. The caller commits.
+
+    If conversion is given (a retry of its failed email), that row gets the
+    new outcome, and the new EPUBs if the retry had to build them again.
+    """
+    trace = trace or {}
+    status = trace.get('outcome', Conversion.STATUS_ERROR)
+    if conversion is not None:
+        conversion.status = status
+        conversion.error = None if status == Conversion.STATUS_SENT else job.error
+        if state.get('files'):
+            conversion.epub_filename = '\n'.join(state['files'])
+            conversion.epub_bytes = state.get('bytes')
+        db.session.flush()
+        return conversion
+
+    conversion = Conversion(
+        user_id=job.user_id,
+        job_id=job.id,
+        url=job.url,
+        title=trace.get('title') or state.get('title') or job.title,
+        status=status,
+        error=None if status == Conversion.STATUS_SENT else job.error,
+        epub_bytes=state.get('bytes'),
+        image_count=state.get('image_count'),
+        duration_ms=trace.get('duration_ms'),
+        stages_ms=json.dumps(trace['stages_ms']) if trace.get('stages_ms') else None,
+        epub_filename='\n'.join(state.get('files', [])) or None,
+    )
+    db.session.add(conversion)
+    db.session.flush()
+    return conversion
+
+
+def failed_send(job):
+    """
+    The id of the Conversion whose email failed if that is why job was
+    requeued, else None. Such a job only needs sending again.
+    """
+    state = json.loads(job.progress) if job.progress else {}
+    return state.get('conversion_id') if state.get('step') == 'send_failed' else None
+
+
+class ConversionPipeline:
+    """
+    Extract → build EPUB → send, shared by every worker thread. Built EPUBs
+    are also kept in the EPUB store (when enabled) for the web UI's download
+    link.
+    """
+
+    def __init__(self, extractor=None, builder=None, sender=None, article_cache=None, store=None):
+        self.extractor = extractor or ContentExtractor()
+        self.builder = builder or EpubBuilder()
+        self.sender = sender or KindleSender()
+        self.article_cache = article_cache if article_cache is not None else get_article_cache()
+        self._store = store
+
+    @property
+    def store(self):
+        return self._store or get_epub_store()
+
+    def _keep(self, epub_files):
+        """Store EPUBs for download. Returns their store keys (none if the store is disabled)."""
+        if not self.store.enabled:
+            return []
+        return [self.store.save(epub_file) for epub_file in epub_files]
+
+    def convert(self, url, profile=None, stale=None):
+        """
+        Extract and build an EPUB in memory. Returns dict with epub, title,
+        image_count and the page's validator. If stale (an expired article
+        cache entry) was built from an identical page, it is returned as is.
+        """
+        page = self.extractor.fetch_page(url)
+        validator = hashlib.sha256(page.content).hexdigest()
+        if stale is not None and stale['validator'] == validator:
+            print(f"💾 Page unchanged since it was built, reusing the EPUB: {url}")
+            count('article_cache_revalidations')
+            return stale
+
+        data = self.extractor.process_page(page, url, profile=profile)
+        epub_file = self.builder.build_epub(
+            data['title'],
+            data['content'],
+            data['images'],
+            data['url']
+        )
+        return {'epub': epub_file, 'title': data['title'], 'image_count': len(data['images']),
+                'validator': validator}
+
+    def run(self, url, to_email, job_id=None, profile=None, listener=None):
+        """
+        Convert a URL (or reuse a cached EPUB built for the same device
+        profile) and deliver it. Returns (title, sent). listener gets the
+        conversion's progress() steps (see JobProgress).
+        """
+        with start_trace(listener, url=url, job_id=job_id, device=profile and profile['name']) as trace:
+            if self.article_cache:
+                built = False
+
+                def build(stale):
+                    nonlocal built
+                    built = True
+                    return self.convert(url, profile=profile, stale=stale)
+
+                article = self.article_cache.get_or_build(url, build, variant=cache_variant(profile))
+                count('article_cache_misses' if built else 'article_cache_hits')
+            else:
+                article = self.convert(url, profile=profile)
+            trace.fields['title'] = article['title']
+            progress('built', title=article['title'], bytes=article['epub'].size, image_count=article['image_count'],
+                     files=self._keep([article['epub']]))
+            sent = self.sender.send_epub(article['epub'], to_email=to_email)
+            progress('sent' if sent else 'send_failed')
+            trace.fields['outcome'] = 'sent' if sent else 'send_failed'
+            return article['title'], sent
+
+    def run_batch(self, urls, to_email, title=None, job_id=None, max_workers=BATCH_CONCURRENCY, profile=None,
+                  listener=None):
+        """
+        Extract several URLs concurrently, compile them into one EPUB with a
+        chapter each, and send it once (or once per volume, if it had to be
+        split to fit the size budget). Articles that fail to extract are
+        left out; the batch fails only if none succeed. Returns (title, sent).
+        """
+        with start_trace(listener, url=urls[0], urls=len(urls), job_id=job_id,
+                         device=profile and profile['name']) as trace:
+            articles = self.extract_many(urls, max_workers=max_workers, profile=profile)
+            if not articles:
+                raise RuntimeError(f"None of the {len(urls)} URLs could be converted")
+
+            title = title or f"{articles[0]['title']} and {len(articles) - 1} more"
+            trace.fields['title'] = title
+            count('batch_articles', len(articles))
+            count('batch_failures', len(urls) - len(articles))
+
+            # Over the size budget, a compilation arrives as several volumes
+            volumes = self.builder.build_volumes(title, articles)
+            trace.fields['volumes'] = len(volumes)
+            progress('built', title=title, bytes=sum(v.size for v in volumes),
+                     image_count=sum(len(a['images']) for a in articles), files=self._keep(volumes))
+            sent = all([self.sender.send_epub(epub_file, to_email=to_email) for epub_file in volumes])
+            progress('sent' if sent else 'send_failed')
+            trace.fields['outcome'] = 'sent' if sent else 'send_failed'
+            return title, sent
+
+    def resend(self, url, keys, to_email, title=None, job_id=None, listener=None):
+        """
+        Send EPUBs kept in the store again, for a job whose email failed,
+        without fetching or building anything. Returns sent, or None if the
+        store no longer has all of them (convert the job again instead).
+        """
+        paths = [self.store.path_for(key) for key in keys]
+        if not paths or None in paths:
+            return None
+        epub_files = [EpubFile(download_name(key), path=path) for key, path in zip(keys, paths)]
+        with start_trace(listener, url=url, job_id=job_id, resend=True) as trace:
+            trace.fields['title'] = title
+            progress('built', title=title, bytes=sum(f.size for f in epub_files), files=keys)
+            sent = all([self.sender.send_epub(epub_file, to_email=to_email) for epub_file in epub_files])
+            progress('sent' if sent else 'send_failed')
+            trace.fields['outcome'] = 'sent' if sent else 'send_failed'
+            return sent
+
+    def extract_many(self, urls, max_workers=BATCH_CONCURRENCY, profile=None):
+        """Extract URLs in parallel. Returns the successful results in the order of urls."""
+        trace = current_trace()
+
+        extracted = 0
+        lock = threading.Lock()
+
+        def extract(url):
+            nonlocal extracted
+            with use_trace(trace):
+                try:
+                    return self.extractor.process_url(url, profile=profile)
+                except Exception as e:
+                    print(f"⚠️  Skipping {url} in batch: {e}")
+                    return None
+                finally:
+                    with lock:
+                        extracted += 1
+                        progress('extracted', articles_done=extracted, articles_total=len(urls))
+
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(urls)))) as pool:
+            results = list(pool.map(extract, urls))
+        return [r for r in results if r]
+
+
+class JobProgress:
+    """
+    Progress of the jobs running in this worker, batched into the database.
+
+    Pipeline steps arrive from fetch tasks and pool threads, where a database
+    write would stall the event loop, so listener() only merges the step into
+    an in-memory state ({"step": "images", "done": 3, "total": 8, ...}); a
+    single thread writes changed states to their job rows every interval.
+    Each flush also stamps heartbeat_at on every job still running here, so
+    requeue_stale_jobs can tell a long job from one whose worker died.
+    The trace a conversion ends with ('finished') is kept aside for its
+    Conversion record.
+    """
+
+    def __init__(self, app, interval=JOB_PROGRESS_INTERVAL):
+        self.app = app
+        self.interval = interval
+        self._states = {}
+        self._traces = {}
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def begin(self, job_id, **details):
+        with self._lock:
+            self._states[job_id] = {'step': 'started', **details}
+            self._dirty.add(job_id)
+
+    def listener(self, job_id):
+        """A start_trace listener that records steps for job_id."""
+        def record(step, details):
+            with self._lock:
+                if step == 'finished':
+                    self._traces[job_id] = details
+                    return
+                self._states.setdefault(job_id, {}).update(details, step=step)
+                self._dirty.add(job_id)
+        return record
+
+    def finish(self, job_id):
+        """
+        Stop tracking a job. Returns (last state, finished trace or None), for
+        the caller to store with the outcome.
+        """
+        with self._lock:
+            self._dirty.discard(job_id)
+            return self._states.pop(job_id, {}), self._traces.pop(job_id, None)
+
+    def flush(self):
+        """Write changed states and heartbeats of running jobs. Call inside an app context."""
+        with self._lock:
+            changed = {job_id: json.dumps(self._states[job_id]) for job_id in self._dirty}
+            running = list(self._states)
+            self._dirty.clear()
+        now = datetime.utcnow()
+        for job_id in running:
+            values = {'heartbeat_at': now}
+            if job_id in changed:
+                values['progress'] = changed[job_id]
+            # A job that finished meanwhile has its final state already
+            (ConversionJob.query
+             .filter_by(id=job_id, status=ConversionJob.STATUS_RUNNING)
+             .update(values, synchronize_session=False))
+        if running:
+            db.session.commit()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name='job-progress', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                with self.app.app_context():
+                    self.flush()
+            except Exception as e:
+                print(f"⚠️  Could not record job progress: {e}")
+
+
+class JobWorker:
+    """
+    Polls the job table and runs conversions on a pool of threads.
+
+    Each thread pushes its own app context so it gets its own DB session.
+    If a scheduler (app/digest.py) is given, it runs alongside the pool.
+    Jobs left running by a crashed worker are requeued at startup and then
+    every recovery_interval.
+    """
+
+    def __init__(self, app, concurrency=JOB_WORKER_CONCURRENCY, poll_interval=JOB_POLL_INTERVAL, pipeline=None,
+                 scheduler=None, recovery_interval=JOB_RECOVERY_INTERVAL):
+        self.app = app
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.pipeline = pipeline or ConversionPipeline()
+        self.scheduler = scheduler
+        self.progress = JobProgress(app)
+        self.recovery_interval = recovery_interval
+        self._next_recovery = time.monotonic() + recovery_interval
+        self._recovery_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        """Start worker threads in the background."""
+        with self.app.app_context():
+            requeue_stale_jobs()
+
+        for i in range(self.concurrency):
+            t = threading.Thread(target=self._loop, name=f'job-worker-{i}', daemon=True)
+            t.start()
+            self._threads.append(t)
+        print(f"👷 Started {self.concurrency} job worker thread(s)")
+        self.progress.start()
+        if self.scheduler:
+            self.scheduler.start()
+
+    def stop(self, timeout=None):
+        """Ask worker threads to finish their current job and exit."""
+        self._stop.set()
+        self.progress.stop(timeout)
+        if self.scheduler:
+            self.scheduler.stop(timeout)
+        for t in self._threads:
+            t.join(timeout)
+        self._threads = []
+
+    def run_forever(self):
+        """Start the pool and block until interrupted."""
+        self.start()
+        try:
+            while not self._stop.is_set():
+                time.sleep(self.poll_interval)
+        except KeyboardInterrupt:
+            print("🛑 Stopping job workers...")
+        finally:
+            self.stop()
+
+    def run_pending(self):
+        """Process queued jobs on the calling thread until the queue is empty."""
+        processed = 0
+        while self._run_one():
+            processed += 1
+        return processed
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self._recover_stale_jobs()
+                if not self._run_one():
+                    self._stop.wait(self.poll_interval)
+            except Exception as e:
+                print(f"❌ Job worker error: {e}")
+                self._stop.wait(self.poll_interval)
+
+    def _recover_stale_jobs(self):
+        """Every JOB_RECOVERY_INTERVAL, on whichever thread gets there first, requeue stale jobs."""
+        with self._recovery_lock:
+            if time.monotonic() < self._next_recovery:
+                return
+            self._next_recovery = time.monotonic() + self.recovery_interval
+        with self.app.app_context():
+            requeue_stale_jobs()
+
+    def _run_one(self):
+        """Claim and run a single job. Returns False if the queue was empty."""
+        with self.app.app_context():
+            job = claim_next_job()
+            if not job:
+                return False
+
+            job_id = job.id
+            resend_of = failed_send(job)
+            outcome = self._convert(job, resend_of)
+            try:
+                self._record(job, outcome, resend_of)
+            except Exception as e:
+                # Never leave a claimed job running: store the outcome without the extras
+                db.session.rollback()
+                print(f"⚠️  Could not record job {job_id} in full ({e}); saving its status only")
+                self.progress.finish(job_id)
+                (ConversionJob.query
+                 .filter_by(id=job_id, status=ConversionJob.STATUS_RUNNING)
+                 .update(dict(outcome, finished_at=datetime.utcnow()), synchronize_session=False))
+                db.session.commit()
+            return True
+
+    def _convert(self, job, resend_of=None):
+        """
+        Run the pipeline for a claimed job. Returns the job's new status,
+        error and title (not yet applied); never raises.
+
+        If only the email of the job's last run failed (resend_of), the EPUBs
+        it stored are sent again; the job is converted again only if they
+        have been evicted from the store.
+        """
+        print(f"⚙️  Running job {job.id} (attempt {job.attempts}): {', '.join(job.urls)}")
+        self.progress.begin(job.id, attempt=job.attempts)
+        listener = self.progress.listener(job.id)
+        try:
+            title, sent = job.title, None
+            if resend_of is not None:
+                sent = self.pipeline.resend(job.url, job.epub_filenames, job.to_email, title=title, job_id=job.id,
+                                            listener=listener)
+            if sent is None:
+                title, sent = self._run_pipeline(job, listener)
+            if not sent:
+                return self._failure(job, 'Failed to send email', title)
+            print(f"✅ Job {job.id} sent '{title}' to {job.to_email}")
+            return {'status': ConversionJob.STATUS_DONE, 'error': None, 'title': title}
+        except Exception as e:
+            db.session.rollback()
+            return self._failure(job, str(e))
+
+    def _run_pipeline(self, job, listener):
+        """Convert and send a job from scratch. Returns (title, sent)."""
+        profile = profile_for_user(db.session.get(User, job.user_id) if job.user_id else None)
+        if job.is_batch:
+            return self.pipeline.run_batch(job.urls, job.to_email, title=job.title, job_id=job.id,
+                                           profile=profile, listener=listener)
+        return self.pipeline.run(job.url, job.to_email, job_id=job.id, profile=profile, listener=listener)
+
+    def _record(self, job, outcome, resend_of=None):
+        """Apply a job's outcome, record its Conversion (or update the one resent) and commit."""
+        state, trace = self.progress.finish(job.id)
+        for name, value in outcome.items():
+            setattr(job, name, value)
+        previous = db.session.get(Conversion, resend_of) if resend_of is not None else None
+        conversion = record_conversion(job, state, trace, conversion=previous)
+        job.progress = json.dumps(dict(state, conversion_id=conversion.id))
+        job.epub_filename = '\n'.join(state.get('files', [])) or job.epub_filename
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+
+    def _failure(self, job, error, title=None):
+        """Outcome for an error: re-queued if the job has attempts left, else failed."""
+        if job.attempts < JOB_MAX_ATTEMPTS:
+            print(f"🔁 Job {job.id} failed ({error}); will retry")
+            status = ConversionJob.STATUS_QUEUED
+        else:
+            print(f"❌ Job {job.id} failed permanently: {error}")
+            status = ConversionJob.STATUS_FAILED
+        return {'status': status, 'error': error, 'title': title or job.title}
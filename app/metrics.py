@@ -0,0 +1,251 @@
+"""
+Pipeline Metrics and Per-Conversion Traces
+
+Two views of the same measurements:
+
+- A process-wide registry of counters and histograms, rendered in the
+  Prometheus text format at /metrics (web app) or on WORKER_METRICS_PORT
+  (worker.py). Each process exposes its own numbers.
+- A ConversionTrace per conversion, which collects stage timings and counts
+  for that one article and logs them as a single JSON line when it finishes.
+
+Code inside the pipeline just calls stage() / count(); they record into the
+registry and into the trace active here, if any:
+
+    with start_trace(url=url) as trace:
+        with stage('fetch'):
+            ...
+        count('bytes_fetched', len(body))
+
+The active trace is a context variable, so it follows asyncio tasks created
+while it is set; threads started for a conversion pick it up explicitly with
+use_trace(trace). Per-image stages (image_download, transcode) are summed
+across concurrent downloads, so in a trace they can exceed the wall-clock 'images'
+stage that contains them.
+
+A trace can also carry a progress listener (the job worker's, which the web
+UI streams to the browser); progress('images', done=3, total=8) forwards a
+step to it and is a no-op otherwise. When the conversion ends the listener
+gets a last 'finished' step carrying the whole trace (to_dict()).
+"""
+
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+logger = logging.getLogger('kindle.conversion')
+
+# Seconds; stages range from sub-millisecond parsing to minute-long image phases
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _label_str(labels):
+    if not labels:
+        return ''
+    inner = ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in labels)
+    return '{' + inner + '}'
+
+
+class MetricsRegistry:
+    """Thread-safe counters and histograms with Prometheus text rendering."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._help = {}
+
+    def describe(self, name, help_text):
+        self._help[name] = help_text
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    hist['buckets'][i] += 1
+            hist['sum'] += value
+            hist['count'] += 1
+
+    def counter_value(self, name, **labels):
+        with self._lock:
+            return self._counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)."""
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {k: {'buckets': list(v['buckets']), 'sum': v['sum'], 'count': v['count']}
+                          for k, v in self._histograms.items()}
+
+        lines = []
+        seen = set()
+        for (name, labels), value in sorted(counters.items()):
+            if name not in seen:
+                seen.add(name)
+                if name in self._help:
+                    lines.append(f'# HELP {name} {self._help[name]}')
+                lines.append(f'# TYPE {name} counter')
+            lines.append(f'{name}{_label_str(labels)} {value}')
+
+        for (name, labels), hist in sorted(histograms.items()):
+            if name not in seen:
+                seen.add(name)
+                if name in self._help:
+                    lines.append(f'# HELP {name} {self._help[name]}')
+                lines.append(f'# TYPE {name} histogram')
+            for bound, n in zip(self.buckets, hist['buckets']):
+                lines.append(f'{name}_bucket{_label_str(labels + (("le", bound),))} {n}')
+            lines.append(f'{name}_bucket{_label_str(labels + (("le", "+Inf"),))} {hist["count"]}')
+            lines.append(f'{name}_sum{_label_str(labels)} {hist["sum"]}')
+            lines.append(f'{name}_count{_label_str(labels)} {hist["count"]}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+registry.describe('kindle_stage_seconds', 'Time spent in each pipeline stage')
+registry.describe('kindle_conversion_seconds', 'End-to-end conversion time')
+registry.describe('kindle_conversions_total', 'Finished conversions by outcome')
+registry.describe('kindle_events_total', 'Pipeline counters (bytes fetched, images kept/skipped, cache hits, ...)')
+
+
+class ConversionTrace:
+    """Timings and counts for one conversion."""
+
+    def __init__(self, listener=None, **fields):
+        self.fields = fields
+        self.listener = listener
+        self.stages = {}
+        self.counts = {}
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add_stage(self, name, seconds):
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def add_count(self, name, value):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + value
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                **self.fields,
+                'duration_ms': round((time.perf_counter() - self.started) * 1000, 1),
+                'stages_ms': {k: round(v * 1000, 1) for k, v in self.stages.items()},
+                'counts': dict(self.counts),
+            }
+
+
+_current = ContextVar('conversion_trace', default=None)
+
+
+def current_trace():
+    """The trace active on this thread or asyncio task, or None."""
+    return _current.get()
+
+
+@contextmanager
+def use_trace(trace):
+    """Make trace the active trace here (e.g. inside a pool worker or a fetch task)."""
+    token = _current.set(trace)
+    try:
+        yield trace
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def start_trace(listener=None, **fields):
+    """
+    Trace one conversion: times it end to end, records the outcome and logs
+    the whole trace as one JSON line. listener(step, details), if given,
+    receives progress() calls made during the conversion and then
+    ('finished', trace.to_dict()).
+    """
+    trace = ConversionTrace(listener=listener, **fields)
+    outcome = 'error'
+    with use_trace(trace):
+        try:
+            yield trace
+            outcome = trace.fields.get('outcome', 'ok')
+        finally:
+            trace.fields['outcome'] = outcome
+            registry.observe('kindle_conversion_seconds', time.perf_counter() - trace.started)
+            registry.inc('kindle_conversions_total', outcome=outcome)
+            summary = trace.to_dict()
+            logger.info(json.dumps({'event': 'conversion', **summary}, default=str))
+            if listener is not None:
+                listener('finished', summary)
+
+
+@contextmanager
+def stage(name):
+    """Time a pipeline stage into the registry and the active trace (also around awaits)."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        registry.observe('kindle_stage_seconds', elapsed, stage=name)
+        trace = current_trace()
+        if trace is not None:
+            trace.add_stage(name, elapsed)
+
+
+def count(name, value=1):
+    """Bump a pipeline counter in the registry and the active trace."""
+    registry.inc('kindle_events_total', value, event=name)
+    trace = current_trace()
+    if trace is not None:
+        trace.add_count(name, value)
+
+
+def progress(step, **details):
+    """
+    Report a conversion step to the active trace's listener, if any. Called
+    from fetch tasks and pool threads, so listeners must be quick and thread-safe.
+    """
+    trace = current_trace()
+    if trace is not None and trace.listener is not None:
+        trace.listener(step, details)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve_metrics(port, host='0.0.0.0'):
+    """Expose /metrics on a background HTTP server (for processes without Flask)."""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    print(f"📈 Serving metrics on :{port}/metrics")
+    return server
@@ -5,10 +5,14 @@ This module defines the User model for storing user accounts and their Kindle em
 Users can authenticate via Google OAuth or email/password.
 """
 
+import json
 from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, inspect, text
+from sqlalchemy.orm import Session, make_transient_to_detached, object_session
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
+from .user_cache import user_cache, MISSING
 
 db = SQLAlchemy()
 
@@ -23,6 +27,10 @@ class User(UserMixin, db.Model):
         name: User's display name
         password_hash: Hashed password (null for OAuth-only users)
         kindle_email: User's Kindle email address (e.g., user_123@kindle.com)
+        digest_enabled: Hold emailed articles and deliver them as one digest EPUB
+        digest_interval_hours: Deliver a digest once its oldest article has waited this long
+        digest_max_articles: ...or as soon as this many articles are waiting
+        device_profile: Which Kindle the user reads on (a DEVICE_PROFILES key; see app/devices.py)
         created_at: When the account was created
         updated_at: When the account was last modified
     """
@@ -33,6 +41,10 @@ class User(UserMixin, db.Model):
     name = db.Column(db.String(255))
     password_hash = db.Column(db.String(255))  # Null for OAuth-only users
     kindle_email = db.Column(db.String(255))
+    digest_enabled = db.Column(db.Boolean, default=False)
+    digest_interval_hours = db.Column(db.Integer)
+    digest_max_articles = db.Column(db.Integer)
+    device_profile = db.Column(db.String(32))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -51,8 +63,34 @@ class User(UserMixin, db.Model):
     
     @classmethod
     def get_by_email(cls, email):
-        """Look up a user by their email address."""
-        return cls.query.filter_by(email=email.lower()).first()
+        """Look up a user by their email address (through the user cache)."""
+        email = email.lower()
+        return cls._cached(('email', email), lambda: cls.query.filter_by(email=email).first())
+    
+    @classmethod
+    def get_by_id(cls, user_id):
+        """Look up a user by id (through the user cache)."""
+        return cls._cached(('id', user_id), lambda: db.session.get(cls, user_id))
+    
+    @classmethod
+    def _cached(cls, key, load):
+        """Read-through lookup in app/user_cache.py; hits are attached to the session without a query."""
+        values = user_cache.get(key)
+        if values is MISSING:
+            generation = user_cache.generation
+            user = load()
+            values = user and {c.key: getattr(user, c.key) for c in cls.__mapper__.column_attrs}
+            user_cache.put(key, values, generation)
+            if user is not None:
+                # Cache the other key too: a login by email is followed by page views by id
+                user_cache.put(('id', user.id), values, generation)
+                user_cache.put(('email', user.email), values, generation)
+            return user
+        if values is None:
+            return None
+        user = cls(**values)
+        make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
     
     @classmethod
     def create_or_update(cls, email, name, password=None):
@@ -82,3 +120,218 @@ class User(UserMixin, db.Model):
         db.session.add(user)
         db.session.commit()
         return user
+
+
+class ConversionJob(db.Model):
+    """
+    A queued URL → EPUB → Kindle conversion.
+    
+    The webhook inserts a row and returns immediately; a worker (see app/jobs.py)
+    claims queued rows and runs the pipeline. dedupe_key is unique so repeated
+    webhook deliveries of the same email map onto the same job.
+    
+    Attributes:
+        id: Primary key
+        dedupe_key: Hash identifying the delivery (Message-ID + URL)
+        user_id: Owner of the job (null for anonymous submissions)
+        url: Article URL to convert (one URL per line for a batch)
+        to_email: Kindle address to deliver to
+        status: queued, running, done or failed (held / batched for digest users)
+        attempts: How many times a worker has claimed this job
+        title: Article title once extracted (for a batch, the compilation's title)
+        error: Last error message, if any
+        progress: Latest progress step as JSON, e.g. {"step": "images", "done": 3, "total": 8}
+        epub_filename: Keys of the stored EPUB(s) for download, one per line (a split batch has several)
+        heartbeat_at: Last sign of life from the worker running the job (see JobProgress in app/jobs.py)
+    """
+    __tablename__ = 'conversion_jobs'
+    
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_HELD = 'held'          # waiting for the user's next digest (see app/digest.py)
+    STATUS_BATCHED = 'batched'    # handed over to a digest batch job
+    
+    id = db.Column(db.Integer, primary_key=True)
+    dedupe_key = db.Column(db.String(64), unique=True, nullable=False, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
+    url = db.Column(db.Text, nullable=False)
+    to_email = db.Column(db.String(255), nullable=False)
+    status = db.Column(db.String(16), nullable=False, default=STATUS_QUEUED, index=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    title = db.Column(db.String(500))
+    error = db.Column(db.Text)
+    progress = db.Column(db.Text)
+    epub_filename = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    heartbeat_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    
+    def __repr__(self):
+        return f'<ConversionJob {self.id} {self.status} {self.url}>'
+    
+    @property
+    def urls(self):
+        """All URLs in the job; a single-article job has one."""
+        return [u for u in self.url.split('\n') if u]
+    
+    @property
+    def is_batch(self):
+        return len(self.urls) > 1
+    
+    @property
+    def epub_filenames(self):
+        return [f for f in (self.epub_filename or '').split('\n') if f]
+    
+    @property
+    def is_finished(self):
+        return self.status in (self.STATUS_DONE, self.STATUS_FAILED)
+    
+    def to_dict(self):
+        """Serializable status for API responses."""
+        return {
+            'id': self.id,
+            'status': self.status,
+            'url': self.urls[0] if self.url else None,
+            'urls': self.urls,
+            'title': self.title,
+            'error': self.error,
+            'attempts': self.attempts,
+            'progress': json.loads(self.progress) if self.progress else None,
+            'epub_filenames': self.epub_filenames,
+        }
+
+
+class Conversion(db.Model):
+    """
+    A record of one conversion run: what was converted, for whom, how it went
+    and where its EPUB is stored.
+
+    The worker adds one row per job attempt (see record_conversion in
+    app/jobs.py); an attempt that only retries a failed email updates the
+    row of the run that built the EPUB instead. Rows are indexed by (user_id, created_at) for the history
+    page and by created_at for analytics; downloads look the row up by id and
+    only serve files it lists, so the EPUB store's directory is never scanned
+    to answer "whose file is this?".
+
+    Attributes:
+        id: Primary key
+        user_id: Who it was converted for (null for anonymous submissions)
+        job_id: The ConversionJob this run belongs to
+        url: Article URL (one URL per line for a batch)
+        title: Article title (for a batch, the compilation's title)
+        status: sent, send_failed or error (the trace's outcome)
+        error: Error message when it didn't reach the Kindle
+        epub_bytes: Total size of the EPUB(s) built
+        image_count: Images embedded
+        duration_ms: End-to-end time of the run
+        stages_ms: Per-stage timings as JSON, e.g. {"fetch": 412.0, "images": 1830.5}
+        epub_filename: Keys of the stored EPUB(s) in the download store (app/epub_store.py), one per line
+            (a split batch has several)
+        created_at: When the run finished
+    """
+    __tablename__ = 'conversions'
+    __table_args__ = (
+        db.Index('ix_conversions_user_created', 'user_id', 'created_at'),
+    )
+
+    STATUS_SENT = 'sent'
+    STATUS_SEND_FAILED = 'send_failed'
+    STATUS_ERROR = 'error'
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
+    job_id = db.Column(db.Integer, db.ForeignKey('conversion_jobs.id'), nullable=True, index=True)
+    url = db.Column(db.Text, nullable=False)
+    title = db.Column(db.String(500))
+    status = db.Column(db.String(16), nullable=False)
+    error = db.Column(db.Text)
+    epub_bytes = db.Column(db.Integer)
+    image_count = db.Column(db.Integer)
+    duration_ms = db.Column(db.Float)
+    stages_ms = db.Column(db.Text)
+    epub_filename = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+    def __repr__(self):
+        return f'<Conversion {self.id} {self.status} {self.url}>'
+
+    @property
+    def urls(self):
+        return [u for u in self.url.split('\n') if u]
+
+    @property
+    def epub_filenames(self):
+        return [f for f in (self.epub_filename or '').split('\n') if f]
+
+    @property
+    def stages(self):
+        return json.loads(self.stages_ms) if self.stages_ms else {}
+
+    @classmethod
+    def history(cls, user_id, page, per_page):
+        """
+        One page of a user's conversions, newest first. Returns (conversions,
+        has_next); fetching one row extra answers has_next without a COUNT.
+        """
+        rows = (cls.query
+                .filter_by(user_id=user_id)
+                .order_by(cls.created_at.desc(), cls.id.desc())
+                .offset((page - 1) * per_page)
+                .limit(per_page + 1)
+                .all())
+        return rows[:per_page], len(rows) > per_page
+
+
+def _user_cache_keys(user):
+    """Cache keys a user row is stored under, including its email before an unflushed change."""
+    emails = {user.email, *inspect(user).attrs.email.history.deleted}
+    return [('id', user.id)] + [('email', email.lower()) for email in emails if email]
+
+
+@event.listens_for(User, 'after_insert')
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _invalidate_cached_user(mapper, connection, user):
+    # Now, for lookups racing the flush; again when the transaction ends
+    keys = _user_cache_keys(user)
+    user_cache.invalidate(keys)
+    session = object_session(user)
+    if session is not None:
+        session.info.setdefault('user_cache_keys', set()).update(keys)
+
+
+@event.listens_for(Session, 'after_commit')
+@event.listens_for(Session, 'after_soft_rollback')
+def _invalidate_after_transaction(session, *args):
+    keys = session.info.pop('user_cache_keys', None)
+    if keys:
+        user_cache.invalidate(keys)
+
+
+def add_missing_columns():
+    """
+    Add columns that were introduced after a table was first created.
+
+    db.create_all() only creates missing tables, so new nullable columns are
+    added here with ALTER TABLE ... ADD COLUMN. Call it after create_all()
+    inside an app context.
+    """
+    inspector = inspect(db.engine)
+    added = []
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {c['name'] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing or not column.nullable:
+                continue
+            column_type = column.type.compile(dialect=db.engine.dialect)
+            db.session.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+            added.append(f'{table.name}.{column.name}')
+    if added:
+        db.session.commit()
+        print(f"🗄️  Added columns: {', '.join(added)}")
+    return added
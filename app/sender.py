@@ -1,67 +1,55 @@
 import os
-import base64
-from sendgrid import SendGridAPIClient
-from sendgrid.helpers.mail import Mail, Email, To, Content, Attachment, FileContent, FileName, FileType, Disposition
+from .epub import EpubFile
+from .delivery import build_message, get_delivery_backend
+from .metrics import stage, count
+
 
 class KindleSender:
-    def __init__(self):
-        pass
+    def __init__(self, backend=None):
+        self._backend = backend
+
+    @property
+    def backend(self):
+        return self._backend or get_delivery_backend()
 
-    def send_epub(self, epub_path, to_email=None):
+    def send_epub(self, epub, to_email=None):
         """
-        Send EPUB file to Kindle email using SendGrid.
-        
+        Send EPUB file to Kindle email via the configured delivery backend.
+
         Args:
-            epub_path: Path to the EPUB file
+            epub: An EpubFile (in memory or stored) or a path to the EPUB file
             to_email: Optional recipient email. If not provided, uses KINDLE_EMAIL env var.
         """
-        
-        # Load credentials from environment
-        api_key = os.environ.get('SENDGRID_API_KEY')
+        return self.send_epub_many(epub, [to_email or os.environ.get('KINDLE_EMAIL')])[0]
+
+    def send_epub_many(self, epub, to_emails):
+        """
+        Send one EPUB to several Kindle addresses in a single batched dispatch.
+
+        Returns a list of booleans, one per address.
+        """
         from_email_addr = os.environ.get('FROM_EMAIL')
-        to_email_addr = to_email or os.environ.get('KINDLE_EMAIL')
+        backend = self.backend
 
-        if not api_key:
-            print("ℹ️  SendGrid API Key not found. Skipping email.")
-            return False
+        if not backend:
+            print("ℹ️  Delivery backend not configured. Skipping email.")
+            return [False] * len(to_emails)
 
-        if not from_email_addr or not to_email_addr:
+        if not from_email_addr or not all(to_emails):
              print("ℹ️  Email addresses (FROM/TO) not configured. Skipping email.")
-             return False
+             return [False] * len(to_emails)
 
         try:
-            filename = os.path.basename(epub_path)
-            print(f"📤 Sending {filename} to {to_email_addr} via SendGrid...")
-
-            sg = SendGridAPIClient(api_key)
-            
-            message = Mail(
-                from_email=Email(from_email_addr),
-                to_emails=To(to_email_addr),
-                subject='Convert',
-                html_content=Content("text/html", f"Here is your converted article: <strong>{filename}</strong><br><br>Sent from your Kindle Web App.")
-            )
-
-            # Read and encode file
-            with open(epub_path, 'rb') as f:
-                data = f.read()
-                f.close()
-            
-            encoded_file = base64.b64encode(data).decode()
-            
-            attachedFile = Attachment(
-                FileContent(encoded_file),
-                FileName(filename),
-                FileType('application/epub+zip'),
-                Disposition('attachment')
-            )
-            message.attachment = attachedFile
-
-            response = sg.send(message)
-            print(f"✅ Email sent! Status code: {response.status_code}")
-            
-            return str(response.status_code).startswith('2')
+            if not isinstance(epub, EpubFile):
+                epub = EpubFile.from_path(epub)
+            print(f"📤 Sending {epub.filename} to {', '.join(to_emails)} via {backend.name}...")
+            messages = [build_message(epub, to, from_email_addr) for to in to_emails]
+            with stage('send'):
+                results = backend.send_many(messages)
+            count('emails_sent', sum(1 for ok in results if ok))
+            count('emails_failed', sum(1 for ok in results if not ok))
+            return results
 
         except Exception as e:
             print(f"❌ Error sending to Kindle: {e}")
-            return False
+            return [False] * len(to_emails)
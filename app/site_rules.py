@@ -0,0 +1,189 @@
+"""
+Per-Site Rules for Image Discovery
+
+Finding a page's images needs two decisions: which element holds the
+article (the content container), and which image URLs are chrome (icons,
+logos, tracking pixels) rather than figures. Both are compiled once per site
+instead of being re-evaluated per page:
+
+- ContentMatcher turns the content selectors into lookup tables keyed by
+  tag, class and attribute, and finds the best container in a single walk
+  of the tree: the element matching the highest-priority selector, first in
+  document order (what trying each selector in turn would pick).
+- The skip patterns are lowercased and de-duplicated once, so a URL is
+  lowercased once and checked with plain substring tests (measured faster
+  than one alternation regex, which CPython scans position by position).
+
+Defaults cover common newsletter and blog layouts. Sites can prepend their
+own content selectors and add skip patterns, either in SITE_RULES below or
+in a JSON file named by SITE_RULES_FILE:
+
+    {"example.com": {"content_selectors": ["div.story-body"], "skip_patterns": ["promo"]}}
+
+A rule applies to the host and its subdomains.
+"""
+
+import json
+import re
+from functools import lru_cache
+from urllib.parse import urlsplit
+from .config import SITE_RULES_FILE
+
+# Common selectors for newsletter content areas, in priority order
+CONTENT_SELECTORS = [
+    'div[itemprop="articleBody"]',
+    '.post-content',
+    '.entry-content',
+    '.article-content',
+    '.body',
+    'article',
+    '.post',
+    '[data-testid="post-content"]',
+    '.substack-post-content',
+    '.post-body',
+    '.article-body',
+    '.content',
+    '.entry',
+    '.main-content',
+]
+
+# Substrings of image URLs that mark icons, logos, trackers and other chrome
+SKIP_PATTERNS = [
+    'icon', 'logo', 'avatar', 'favicon', 'social', 'share',
+    'button', 'sprite', 'badge', 'pixel', 'tracking'
+]
+
+# Built-in per-site additions
+SITE_RULES = {
+    'substack.com': {'content_selectors': ['div.available-content']},
+}
+
+# tag, any number of .classes, optional [attr="value"]
+SELECTOR_RE = re.compile(
+    r'^(?P<tag>[a-zA-Z][a-zA-Z0-9]*)?(?P<classes>(?:\.[\w-]+)*)(?:\[(?P<attr>[\w-]+)="(?P<value>[^"]*)"\])?$'
+)
+
+
+class Selector:
+    """A simple CSS selector: tag, classes and one attribute test."""
+
+    def __init__(self, css):
+        match = SELECTOR_RE.match(css.strip())
+        if not match or not any(match.group('tag', 'classes', 'attr')):
+            raise ValueError(f"Unsupported content selector: {css!r}")
+        self.css = css
+        self.tag = (match.group('tag') or '').lower() or None
+        self.classes = frozenset(c for c in match.group('classes').split('.') if c)
+        self.attr = match.group('attr')
+        self.value = match.group('value')
+
+    def matches(self, el):
+        if self.tag and el.tag != self.tag:
+            return False
+        if self.classes and not self.classes <= set((el.get('class') or '').split()):
+            return False
+        if self.attr and el.get(self.attr) != self.value:
+            return False
+        return True
+
+
+class ContentMatcher:
+    """Finds the content container for a list of prioritized selectors in one tree walk."""
+
+    def __init__(self, selectors):
+        self.selectors = [Selector(css) for css in selectors]
+        # Index each selector under its most specific key, so an element only
+        # checks selectors that could possibly match it
+        self._by_attr = {}
+        self._by_class = {}
+        self._by_tag = {}
+        for priority, sel in enumerate(self.selectors):
+            entry = (priority, sel)
+            if sel.attr:
+                self._by_attr.setdefault(sel.attr, []).append(entry)
+            elif sel.classes:
+                self._by_class.setdefault(min(sel.classes), []).append(entry)
+            else:
+                self._by_tag.setdefault(sel.tag, []).append(entry)
+
+    def find(self, tree):
+        """Return (css, element) for the best content container, or (None, None)."""
+        best_priority = len(self.selectors)
+        best = None
+        by_attr, by_class, by_tag = self._by_attr, self._by_class, self._by_tag
+
+        for el in tree.iter():
+            tag = el.tag
+            if not isinstance(tag, str):
+                continue  # comments and processing instructions
+
+            candidates = by_tag.get(tag, ())
+            classes = el.get('class')
+            if classes:
+                for cls in classes.split():
+                    hit = by_class.get(cls)
+                    if hit:
+                        candidates = [*candidates, *hit]
+            for attr, entries in by_attr.items():
+                if el.get(attr) is not None:
+                    candidates = [*candidates, *entries]
+
+            for priority, sel in candidates:
+                if priority < best_priority and sel.matches(el):
+                    best_priority, best = priority, el
+                    if priority == 0:
+                        return sel.css, el
+
+        if best is None:
+            return None, None
+        return self.selectors[best_priority].css, best
+
+class SiteRules:
+    """Compiled content selectors and image skip patterns for one site."""
+
+    def __init__(self, content_selectors=CONTENT_SELECTORS, skip_patterns=SKIP_PATTERNS):
+        self.content = ContentMatcher(content_selectors)
+        self.skip_patterns = tuple(dict.fromkeys(p.lower() for p in skip_patterns))
+
+    def wants_image(self, url):
+        """Check if an image URL is worth downloading (not an icon/logo)"""
+        url_lower = url.lower()
+        for pattern in self.skip_patterns:
+            if pattern in url_lower:
+                return False
+        return True
+
+
+DEFAULT_RULES = SiteRules()
+
+
+def _load_overrides():
+    overrides = {host: dict(rule) for host, rule in SITE_RULES.items()}
+    if SITE_RULES_FILE:
+        with open(SITE_RULES_FILE) as f:
+            for host, rule in json.load(f).items():
+                overrides[host.lower()] = rule
+    return overrides
+
+
+_overrides = _load_overrides()
+
+
+@lru_cache(maxsize=512)
+def rules_for_host(host):
+    """SiteRules for a host: the defaults plus any rule for it or a parent domain."""
+    host = host.lower().split(':')[0]
+    parts = host.split('.')
+    for i in range(len(parts) - 1):
+        rule = _overrides.get('.'.join(parts[i:]))
+        if rule:
+            return SiteRules(
+                rule.get('content_selectors', []) + CONTENT_SELECTORS,
+                SKIP_PATTERNS + rule.get('skip_patterns', []),
+            )
+    return DEFAULT_RULES
+
+
+def rules_for(url):
+    """SiteRules for the site a page URL belongs to."""
+    return rules_for_host(urlsplit(url or '').netloc)
@@ -0,0 +1,97 @@
+"""
+Read-Through Cache of User Rows
+
+Every inbound email looks its sender up by email, and every authenticated
+page view loads the user by id; on Railway each is a round trip to
+Postgres. User.get_by_email and User.get_by_id read through this cache
+instead (see app/models.py).
+
+The cache holds column values, not ORM objects: instances aren't
+thread-safe and belong to one session. A hit rebuilds a User and attaches
+it to the caller's session without a query, so changes to it (the settings
+page edits current_user) are flushed as usual. Unknown emails are cached
+too, so repeated mail from unregistered senders costs nothing.
+
+Entries live for USER_CACHE_TTL seconds, at most USER_CACHE_MAX_ENTRIES of
+them (least recently used go first). Writes to users in this process
+invalidate the affected keys on flush and again after commit; other
+processes (gunicorn workers, the job worker) see a change once their copy
+expires. USER_CACHE_MAX_ENTRIES=0 disables the cache.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from .config import USER_CACHE_MAX_ENTRIES, USER_CACHE_TTL
+
+MISSING = object()
+
+
+class UserCache:
+    def __init__(self, max_entries=USER_CACHE_MAX_ENTRIES, ttl=USER_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()   # ('id', 1) / ('email', 'a@b.c') -> (expires, values or None)
+        self._lock = threading.Lock()
+        self.generation = 0             # bumped by every invalidation
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0 and self.ttl > 0
+
+    def get(self, key):
+        """Cached column values for key, None for a cached "no such user", or MISSING."""
+        if not self.enabled:
+            return MISSING
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return MISSING
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, values, generation):
+        """
+        Cache a user's column values (or None: no user) under key, read from
+        the database when the cache was at generation. If anything was
+        invalidated since, the read may predate that write and is dropped.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, values)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, keys):
+        with self._lock:
+            self.generation += 1
+            for key in keys:
+                if self._entries.pop(key, None) is not None:
+                    self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'entries': len(self._entries),
+            }
+
+
+user_cache = UserCache()
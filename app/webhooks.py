@@ -4,57 +4,85 @@ Webhook Blueprint for Inbound Email Processing
 This module handles incoming emails from SendGrid Inbound Parse.
 When a user sends an email with a URL to save@kindle.timour.xyz,
 we look up their Kindle email in the database and send the converted article there.
+An email listing several article URLs in its text becomes one compiled EPUB
+with a chapter per article, named after the email's subject. Unsubscribe,
+preference-center, tracking and image links (every newsletter footer has
+them) are never fetched.
 """
 
 from flask import Blueprint, request, jsonify, current_app
-import os
 import re
 import json
-from sendgrid import SendGridAPIClient
-from sendgrid.helpers.mail import Mail, Email, To, Content, Attachment, FileContent, FileName, FileType, Disposition
-import base64
-from app.content import ContentExtractor
-from app.epub import EpubBuilder
+from urllib.parse import urlparse
+from app.jobs import enqueue_conversion, enqueue_batch, make_dedupe_key
 from app.models import User
+from app.config import BATCH_MAX_URLS
 
 webhooks_bp = Blueprint('webhooks', __name__)
 
-# Initialize services
-extractor = ContentExtractor()
-builder = EpubBuilder()
+URL_PATTERN = re.compile(r'https?://[^\s<>"]+|www\.[^\s<>"]+')
 
+# Links that are never articles. Fetching an unsubscribe link can unsubscribe the sender.
+JUNK_LINK_WORDS = ('unsubscribe', 'preferences', 'optout', 'opt-out', 'opt_out', 'manage-subscription',
+                   'list-manage')
+TRACKING_HOSTS = ('list-manage.com', 'sendgrid.net', 'mandrillapp.com', 'mailgun.org', 'mcsv.net', 'rs6.net',
+                  'doubleclick.net', 'hubspotlinks.com', 'mailchimp.com')
+TRACKING_SUBDOMAINS = ('click', 'clicks', 'track', 'tracking', 'trk', 'links', 'email')
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp', '.svg', '.ico', '.bmp', '.avif')
 
-def send_epub_email(to_email, epub_path, title):
-    """Send EPUB via SendGrid."""
-    sg = SendGridAPIClient(os.environ.get('SENDGRID_API_KEY'))
-    from_email = os.environ.get('FROM_EMAIL')
-    
-    message = Mail(
-        from_email=Email(from_email),
-        to_emails=To(to_email),
-        subject='Convert',
-        html_content=Content("text/html", f"Here is your converted article: <strong>{title}</strong>")
-    )
-
-    with open(epub_path, 'rb') as f:
-        data = f.read()
-    
-    encoded_file = base64.b64encode(data).decode()
-    attachedFile = Attachment(
-        FileContent(encoded_file),
-        FileName(os.path.basename(epub_path)),
-        FileType('application/epub+zip'),
-        Disposition('attachment')
-    )
-    message.attachment = attachedFile
 
-    try:
-        response = sg.send(message)
-        print(f"✅ Email sent! Status code: {response.status_code}")
-        return True
-    except Exception as e:
-        print(f"❌ Error sending email: {e}")
+def _message_id(raw_headers):
+    """Pull the Message-ID out of SendGrid's raw 'headers' field."""
+    match = re.search(r'^Message-ID:\s*(\S+)', raw_headers or '', re.IGNORECASE | re.MULTILINE)
+    return match.group(1) if match else None
+
+
+def _is_article_link(url):
+    """False for mailto:, unsubscribe / preference-center, tracking and image links."""
+    if url.lower().startswith('mailto:'):
         return False
+    parsed = urlparse(url if '://' in url else f'https://{url}')
+    host = (parsed.hostname or '').lower()
+    if not host:
+        return False
+    if any(host == h or host.endswith('.' + h) for h in TRACKING_HOSTS):
+        return False
+    if host.split('.')[0] in TRACKING_SUBDOMAINS:
+        return False
+    if any(word in url.lower() for word in JUNK_LINK_WORDS):
+        return False
+    return not parsed.path.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def _find_links(body):
+    """Article links in a body, in order, without duplicates or trailing punctuation."""
+    links = []
+    for url in URL_PATTERN.findall(body or ''):
+        url = url.rstrip('.,;:!?)]}\'')
+        if url.startswith('www.'):
+            url = f'https://{url}'
+        if _is_article_link(url) and url not in links:
+            links.append(url)
+    return links
+
+
+def article_urls(text_body, html_body):
+    """
+    The URLs to convert from an email. Only links the sender wrote in the
+    text part make a batch (up to BATCH_MAX_URLS); otherwise it's the first
+    article link, from the text part or else from the HTML, where most links
+    are the newsletter's own chrome.
+    """
+    links = _find_links(text_body)
+    if len(links) > 1:
+        return links[:BATCH_MAX_URLS]
+    return links or _find_links(html_body)[:1]
+
+
+def _batch_title(subject):
+    """Title for a compiled EPUB: the email subject without Fwd:/Fw:/Re: prefixes."""
+    title = re.sub(r'^\s*((fwd?|re)\s*:\s*)+', '', subject or '', flags=re.IGNORECASE).strip()
+    return title or 'Reading List'
 
 
 @webhooks_bp.route('/webhooks/inbound-email', methods=['POST'])
@@ -65,9 +93,13 @@ def inbound_email():
     Flow:
     1. Extract sender email from envelope
     2. Look up sender in database to get their Kindle email
-    3. Extract URL from email body
-    4. Convert URL to EPUB
-    5. Send EPUB to user's Kindle
+    3. Extract article URLs from the email body (see article_urls)
+    4. Queue a conversion job (a worker converts and sends it); several URLs
+       are queued as one batch job compiled into a single EPUB
+    
+    Returns 202 as soon as the job is queued. SendGrid retries deliveries
+    that time out, so the job is keyed on the Message-ID: a repeated
+    delivery returns the existing job instead of converting twice.
     """
     try:
         # Parse envelope to get sender email
@@ -104,34 +136,33 @@ def inbound_email():
         
         print(f"👤 Found user: {user.name} → Kindle: {user.kindle_email}")
         
-        # Extract URL from body
-        url_pattern = r'https?://[^\s<>"]+|www\.[^\s<>"]+'
-        urls = re.findall(url_pattern, text_body or html_body or "")
+        urls = article_urls(text_body, html_body)
         
         if not urls:
             print("⚠️ No URL found in email body.")
             return jsonify({'status': 'ignored', 'reason': 'No URL found in email'}), 200
             
-        target_url = urls[0]
-        print(f"🔗 Found URL: {target_url}")
-        
-        # Process the URL
-        data = extractor.process_url(target_url)
+        print(f"🔗 Found {len(urls)} URL(s): {', '.join(urls)}")
         
-        # Create EPUB
-        epub_path = builder.create_epub(
-            data['title'],
-            data['content'],
-            data['images'],
-            data['url']
+        # Queue the conversion
+        dedupe_key = make_dedupe_key(
+            _message_id(request.form.get('headers')) or f"{subject}|{text_body or html_body}",
+            sender_email,
+            *urls
         )
-        
-        # Send to user's Kindle
-        if send_epub_email(user.kindle_email, epub_path, data['title']):
-            print(f"✅ Successfully sent '{data['title']}' to {user.kindle_email}")
-            return jsonify({'status': 'success', 'message': 'Converted and sent'}), 200
+        if len(urls) == 1:
+            # Digest users get single articles bundled later (see app/digest.py)
+            job, created = enqueue_conversion(urls[0], user.kindle_email, user=user, dedupe_key=dedupe_key,
+                                              hold=bool(user.digest_enabled))
         else:
-            return jsonify({'status': 'error', 'message': 'Failed to send email'}), 500
+            job, created = enqueue_batch(urls, user.kindle_email, _batch_title(subject),
+                                         user=user, dedupe_key=dedupe_key)
+        
+        if not created:
+            print(f"🔂 Duplicate delivery for job {job.id} ({job.status})")
+            return jsonify({'status': 'duplicate', 'job': job.to_dict()}), 200
+        
+        return jsonify({'status': job.status, 'job': job.to_dict()}), 202
 
     except Exception as e:
         print(f"❌ Error in webhook: {e}")
@@ -0,0 +1,119 @@
+"""
+Article corpus for the offline benchmarks.
+
+Real saved pages can be dropped into benchmarks/corpus/*.html (e.g. "Save Page
+As… → HTML only" from a browser); they are used as-is. On top of those,
+synthetic_pages() builds deterministic pages modelled on the layouts we see
+most: a Substack post, a WordPress blog, and a news site with heavy chrome
+(nav, sidebars, comments, related links). Image URLs point at image_host
+(IMAGE_HOST by default); benchmarks/standin.py serves them locally.
+"""
+
+import random
+from pathlib import Path
+
+CORPUS_DIR = Path(__file__).resolve().parent / 'corpus'
+
+IMAGE_HOST = 'http://images.bench.local'
+
+WORDS = (
+    'kindle reader article newsletter essay market policy network design '
+    'product growth research model system history culture science climate '
+    'energy startup platform writer editor chapter review analysis weekly '
+    'the of and to in is that for it as with was on be by this are at from'
+).split()
+
+
+def _sentence(rng, n=None):
+    words = [rng.choice(WORDS) for _ in range(n or rng.randint(8, 24))]
+    return ' '.join(words).capitalize() + '.'
+
+
+def _paragraph(rng):
+    return ' '.join(_sentence(rng) for _ in range(rng.randint(3, 7)))
+
+
+def _img(rng, page, i, style, image_host):
+    w = rng.choice((1200, 1600, 2400))
+    h = rng.choice((800, 1000, 1600))
+    src = f'{image_host}/{page}/img_{i}_{w}x{h}.jpg'
+    if style == 'lazy':
+        return (f'<img data-src="{src}" data-srcset="{src} {w}w, {src}?w=600 600w" '
+                f'width="{w}" height="{h}" loading="lazy" alt="Figure {i}">')
+    if style == 'srcset':
+        return (f'<picture><img src="{src}" srcset="{src} {w}w, {src}?w=800 800w, '
+                f'{src}?w=400 400w" sizes="100vw" alt="Figure {i}"></picture>')
+    return f'<figure><img src="{src}" width="{w}" height="{h}" alt="Figure {i}"><figcaption>{_sentence(rng, 8)}</figcaption></figure>'
+
+
+def _chrome(rng, page, image_host):
+    """Navigation, sidebar widgets and footer noise that readability should drop."""
+    links = ''.join(f'<li><a href="/section/{i}">{rng.choice(WORDS)}</a></li>' for i in range(40))
+    widgets = ''.join(
+        f'<div class="widget related"><img src="{image_host}/{page}/thumb_{i}.jpg">'
+        f'<a href="/related/{i}">{_sentence(rng, 6)}</a></div>'
+        for i in range(15)
+    )
+    icons = ''.join(f'<img src="{image_host}/static/social-icon-{i}.png">' for i in range(6))
+    return (f'<header class="masthead"><img src="{image_host}/static/logo.png"><ul class="menu">{links}</ul></header>',
+            f'<aside class="sidebar">{widgets}{icons}</aside>',
+            f'<footer class="footer"><ul>{links}</ul><img src="{image_host}/static/tracking-pixel.gif"></footer>')
+
+
+def build_page(kind, index, paragraphs=60, images=12, image_host=IMAGE_HOST):
+    """Build one synthetic page. Deterministic for a given (kind, index)."""
+    rng = random.Random(f'{kind}-{index}')
+    page = f'{kind}{index}'
+    header, sidebar, footer = _chrome(rng, page, image_host)
+    style = {'substack': 'srcset', 'wordpress': 'lazy', 'news': 'plain'}[kind]
+
+    body = []
+    image_every = max(1, paragraphs // max(1, images))
+    img_i = 0
+    for p in range(paragraphs):
+        if p % 9 == 0:
+            body.append(f'<h2>{_sentence(rng, 5)}</h2>')
+        body.append(f'<p>{_paragraph(rng)}</p>')
+        if p % image_every == 0 and img_i < images:
+            body.append(_img(rng, page, img_i, style, image_host))
+            img_i += 1
+    content = '\n'.join(body)
+
+    comments = ''.join(
+        f'<div class="comment"><img class="avatar" src="{image_host}/avatars/{i}.jpg"><p>{_sentence(rng)}</p></div>'
+        for i in range(30)
+    )
+    scripts = '<script>' + ('var x = 1;' * 2000) + '</script>'
+
+    if kind == 'substack':
+        article = f'<div class="available-content"><div class="body markup">{content}</div></div>'
+    elif kind == 'wordpress':
+        article = f'<article class="post"><div class="entry-content">{content}</div></article>'
+    else:
+        article = f'<div itemprop="articleBody" class="article-body">{content}</div>'
+
+    title = _sentence(rng, 7).rstrip('.')
+    return (f'<!DOCTYPE html><html><head><title>{title} | {kind.title()}</title>'
+            f'<style>body {{ margin: 0 }}</style>{scripts}</head>'
+            f'<body>{header}<main>{article}{sidebar}</main>'
+            f'<section class="comments">{comments}</section>{footer}</body></html>')
+
+
+def synthetic_pages(per_kind=3, **kwargs):
+    """(name, html) pairs for each synthetic layout."""
+    return [
+        (f'{kind}-{i}', build_page(kind, i, **kwargs))
+        for kind in ('substack', 'wordpress', 'news')
+        for i in range(per_kind)
+    ]
+
+
+def saved_pages():
+    """(name, html) pairs for real pages saved under benchmarks/corpus/."""
+    if not CORPUS_DIR.is_dir():
+        return []
+    return [(p.stem, p.read_text(encoding='utf-8', errors='replace')) for p in sorted(CORPUS_DIR.glob('*.html'))]
+
+
+def load_corpus(per_kind=3, **kwargs):
+    return saved_pages() + synthetic_pages(per_kind, **kwargs)
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Offline delivery throughput benchmark.
+
+Sends N messages with an EPUB-sized attachment through the delivery backends
+against local stand-ins, with no network access needed:
+
+    smtp-fresh   a new SMTP connection per message (the old per-send pattern)
+    smtp-pooled  SMTPBackend reusing one connection
+    sendgrid     SendGridBackend.send per message over the pooled session
+    sendgrid-batch  SendGridBackend.send_many (one call for a shared attachment)
+    file         FileSinkBackend writing .eml files
+
+    python benchmarks/delivery_throughput.py --messages 50 --size-kb 500
+"""
+
+import argparse
+import os
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.delivery import SMTPBackend, SendGridBackend, FileSinkBackend, build_message
+from benchmarks.standin import start_sink
+
+
+class FakeSMTPHandler(socketserver.StreamRequestHandler):
+    """Just enough SMTP to accept mail: greets, acks every command, swallows DATA."""
+
+    def reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        self.reply('220 fake-smtp ready')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            cmd = line.decode(errors='replace').strip().upper()
+            if cmd.startswith(('EHLO', 'HELO')):
+                self.reply('250 fake-smtp')
+            elif cmd == 'DATA':
+                self.reply('354 end with .')
+                while self.rfile.readline() not in (b'.\r\n', b''):
+                    pass
+                self.reply('250 queued')
+            elif cmd == 'QUIT':
+                self.reply('221 bye')
+                return
+            else:
+                self.reply('250 ok')
+
+
+class FakeSMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def start_fake_smtp():
+    server = FakeSMTPServer(('127.0.0.1', 0), FakeSMTPHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def timed(label, n, fn):
+    start = time.perf_counter()
+    results = fn()
+    elapsed = time.perf_counter() - start
+    ok = sum(1 for r in results if r)
+    print(f'{label:<16} {elapsed:>8.2f}s {n / elapsed:>10.1f} msg/s   ({ok}/{n} ok)')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=50)
+    parser.add_argument('--size-kb', type=int, default=500)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='delivery_bench_')
+    epub_path = os.path.join(workdir, 'Benchmark_Article.epub')
+    with open(epub_path, 'wb') as f:
+        f.write(os.urandom(args.size_kb * 1024))
+
+    n = args.messages
+    messages = [build_message(epub_path, f'reader{i}@kindle.com', 'bench@example.com') for i in range(n)]
+
+    smtp = start_fake_smtp()
+    sink = start_sink()
+    sink_url = f'http://127.0.0.1:{sink.server_port}/v3/mail/send'
+
+    print(f'{n} messages, {args.size_kb} KB attachment')
+
+    def smtp_fresh():
+        results = []
+        for m in messages:
+            backend = SMTPBackend('127.0.0.1', smtp.server_address[1], user=None, password=None)
+            results.append(backend.send(m))
+            backend.close()
+        return results
+    timed('smtp-fresh', n, smtp_fresh)
+
+    pooled = SMTPBackend('127.0.0.1', smtp.server_address[1], user=None, password=None)
+    timed('smtp-pooled', n, lambda: pooled.send_many(messages))
+    pooled.close()
+
+    sendgrid = SendGridBackend('SG.benchmark', api_url=sink_url)
+    timed('sendgrid', n, lambda: [sendgrid.send(m) for m in messages])
+    timed('sendgrid-batch', n, lambda: sendgrid.send_many(messages))
+    sendgrid.close()
+
+    sink_backend = FileSinkBackend(os.path.join(workdir, 'outbox'))
+    timed('file', n, lambda: sink_backend.send_many(messages))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Bytes saved per Kindle device profile.
+
+Transcodes a fixed set of synthetic article images with every profile in
+DEVICE_PROFILES (app/config.py) and reports, per profile:
+
+    - total output bytes, and the saving against 'generic' (the original
+      800x1200 color q85 output every user used to get)
+    - the saving against the same box as color q85, i.e. what grayscale and
+      the tuned quality save apart from the device's size
+    - transcode time for the set
+    - the size of an EPUB built from one article carrying those images
+
+The images stand in for what newsletters carry: 2400x1600 camera JPEGs
+(smooth gradients plus fine detail), a PNG bar chart with labels, and a
+screenshot-like PNG of text on white.
+
+    python benchmarks/device_profile_benchmark.py --images 12
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def photo(seed, width=2400, height=1600):
+    from PIL import Image, ImageFilter
+    random.seed(seed)
+    x0 = random.uniform(-2.2, -1.6)
+    gradient = Image.linear_gradient('L').resize((width, height))
+    detail = Image.effect_mandelbrot((width, height), (x0, -1.2, x0 + 3.0, 1.2), 80)
+    noise = Image.effect_noise((width, height), 25)
+    img = Image.merge('RGB', (gradient, detail, Image.blend(gradient, noise, 0.5)))
+    return encode(img.filter(ImageFilter.GaussianBlur(1.2)), 'JPEG')
+
+
+def chart(seed, width=1600, height=1000):
+    from PIL import Image, ImageDraw
+    random.seed(seed)
+    img = Image.new('RGB', (width, height), 'white')
+    draw = ImageDraw.Draw(img)
+    for i in range(28):
+        x = 60 + i * 54
+        bar = random.randint(80, height - 200)
+        draw.rectangle([x, height - 100 - bar, x + 40, height - 100],
+                       fill=(random.randint(0, 255), 110, random.randint(120, 255)))
+    for y in range(0, height, 60):
+        draw.text((8, y), f"{y / 10:.0f}%", fill='black')
+    return encode(img, 'PNG')
+
+
+def screenshot(seed, width=1400, height=900):
+    from PIL import Image, ImageDraw
+    random.seed(seed)
+    img = Image.new('RGB', (width, height), (250, 250, 250))
+    draw = ImageDraw.Draw(img)
+    for y in range(20, height - 20, 22):
+        words = ' '.join(random.choice(['lorem', 'ipsum', 'dolor', 'kindle', 'sit', 'amet']) for _ in range(22))
+        draw.text((30, y), words, fill=(30, 30, 30))
+    draw.rectangle([0, 0, width, 40], fill=(40, 90, 200))
+    return encode(img, 'PNG')
+
+
+def encode(img, fmt):
+    out = BytesIO()
+    img.save(out, format=fmt, quality=92) if fmt == 'JPEG' else img.save(out, format=fmt)
+    return out.getvalue()
+
+
+def make_images(count):
+    kinds = [photo, photo, chart, screenshot]
+    return [kinds[i % len(kinds)](seed=i) for i in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', type=int, default=12, help='images in the sample article')
+    args = parser.parse_args()
+
+    from app.config import DEVICE_PROFILES, IMAGE_QUALITY
+    from app.devices import device_profile, transcode_options
+    from app.images import transcode_image
+    from app.epub import EpubBuilder
+    from app.epub_store import EpubStore
+
+    sources = make_images(args.images)
+    source_bytes = sum(len(s) for s in sources)
+    print(f"{len(sources)} source images, {source_bytes / 1024:.0f} KB as published\n")
+
+    builder = EpubBuilder(store=EpubStore(max_bytes=0))
+    content = ''.join(f'<p>Paragraph {i}.</p><img src="images/image_{i}.jpg"/>' for i in range(len(sources)))
+
+    rows = []
+    for name in DEVICE_PROFILES:
+        profile = device_profile(name)
+        options = transcode_options(profile)
+        start = time.perf_counter()
+        outputs = [transcode_image(data, **options) for data in sources]
+        elapsed = time.perf_counter() - start
+        images = [{'filename': f'image_{i}.jpg', 'data': out[0]} for i, out in enumerate(outputs) if out]
+        epub = builder.build_epub(f'Profile {name}', content, images, 'https://example.com/post')
+        same_box = dict(options, grayscale=False, quality=IMAGE_QUALITY, progressive=False)
+        color_bytes = sum(len(out[0]) for out in (transcode_image(data, **same_box) for data in sources) if out)
+        rows.append((name, options, sum(len(img['data']) for img in images), elapsed, epub.size, color_bytes))
+
+    baseline = next(row for row in rows if row[0] == 'generic')
+    print(f"{'profile':<12} {'box':>10} {'mode':>5} {'q':>3} {'images KB':>10} {'saved':>7} "
+          f"{'epub KB':>8} {'saved':>7} {'vs color':>9} {'ms':>7}")
+    for name, options, image_bytes, elapsed, epub_bytes, color_bytes in rows:
+        box = f"{options['max_width']}x{options['max_height']}"
+        mode = 'gray' if options['grayscale'] else 'color'
+        print(f"{name:<12} {box:>10} {mode:>5} {options['quality']:>3} {image_bytes / 1024:>10.0f} "
+              f"{1 - image_bytes / baseline[2]:>7.0%} {epub_bytes / 1024:>8.0f} "
+              f"{1 - epub_bytes / baseline[4]:>7.0%} {1 - image_bytes / color_bytes:>9.0%} {elapsed * 1e3:>7.0f}")
+    print("\nsaved: against 'generic'; vs color: against the same box in color at quality "
+          f"{IMAGE_QUALITY}")
+
+
+if __name__ == '__main__':
+    main()
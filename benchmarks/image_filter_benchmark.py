@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark: content-container search and image URL filtering.
+
+    legacy    one XPath query per content selector, tried in priority order
+              (up to 14 scans of the document), and an 11-substring loop per
+              image URL plus the icon/favicon/logo re-check download_image did
+    compiled  app/site_rules.py: one walk of the tree with selectors indexed
+              by tag/class/attribute, and the skip patterns lowercased once
+              (no redundant second check)
+
+Runs over the benchmark corpus (large synthetic pages by default, plus
+anything saved under benchmarks/corpus/), first checking both paths pick the
+same container and keep the same image URLs.
+
+    python benchmarks/image_filter_benchmark.py --per-kind 10 --paragraphs 300
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.corpus import load_corpus
+
+LEGACY_SKIP = ['icon', 'logo', 'avatar', 'favicon', 'social', 'share',
+               'button', 'sprite', 'badge', 'pixel', 'tracking']
+
+
+def _class_xpath(name, tag='*'):
+    return f"//{tag}[contains(concat(' ', normalize-space(@class), ' '), ' {name} ')]"
+
+
+LEGACY_SELECTORS = [
+    ('div[itemprop="articleBody"]', '//div[@itemprop="articleBody"]'),
+    ('.post-content', _class_xpath('post-content')),
+    ('.entry-content', _class_xpath('entry-content')),
+    ('.article-content', _class_xpath('article-content')),
+    ('.body', _class_xpath('body')),
+    ('article', '//article'),
+    ('.post', _class_xpath('post')),
+    ('[data-testid="post-content"]', '//*[@data-testid="post-content"]'),
+    ('.substack-post-content', _class_xpath('substack-post-content')),
+    ('.post-body', _class_xpath('post-body')),
+    ('.article-body', _class_xpath('article-body')),
+    ('.content', _class_xpath('content')),
+    ('.entry', _class_xpath('entry')),
+    ('.main-content', _class_xpath('main-content')),
+]
+
+
+def legacy_container(tree):
+    for selector, xpath in LEGACY_SELECTORS:
+        matches = tree.xpath(xpath)
+        if matches:
+            return selector, matches[0]
+    return None, None
+
+
+def legacy_wants(url):
+    url_lower = url.lower()
+    for pattern in LEGACY_SKIP:
+        if pattern in url_lower:
+            return False
+    # download_image's second look
+    return not ('icon' in url_lower or 'favicon' in url_lower or 'logo' in url_lower)
+
+
+def all_image_urls(tree):
+    return [img.get('src') or img.get('data-src') or '' for img in tree.iter('img')]
+
+
+def timed(fn, items, repeat):
+    """Best per-item time over repeat passes (the shared box is noisy)."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for item in items:
+            fn(item)
+        best = min(best, time.perf_counter() - start)
+    return best / len(items)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--per-kind', type=int, default=10, help='synthetic pages per layout')
+    parser.add_argument('--paragraphs', type=int, default=300, help='paragraphs per synthetic page')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    from lxml import html as lxml_html
+    from app.site_rules import DEFAULT_RULES
+
+    pages = load_corpus(args.per_kind, paragraphs=args.paragraphs)
+    trees = [lxml_html.document_fromstring(page) for _, page in pages]
+    urls = [url for tree in trees for url in all_image_urls(tree)]
+    elements = sum(sum(1 for _ in tree.iter()) for tree in trees)
+
+    for (name, _), tree in zip(pages, trees):
+        legacy, compiled = legacy_container(tree), DEFAULT_RULES.content.find(tree)
+        if legacy[1] is not compiled[1]:
+            sys.exit(f'{name}: legacy picked {legacy[0]}, compiled picked {compiled[0]}')
+    mismatched = [u for u in urls if legacy_wants(u) != DEFAULT_RULES.wants_image(u)]
+    if mismatched:
+        sys.exit(f'skip filters disagree on {mismatched[:3]}')
+
+    print(f'{len(trees)} pages ({elements / len(trees):.0f} elements each), {len(urls)} image URLs, '
+          f'best of {args.repeat}; both paths agree')
+    print(f'{"":<22} {"legacy":>10} {"compiled":>10} {"speedup":>8}')
+    rows = [
+        ('container (ms/page)', timed(legacy_container, trees, args.repeat) * 1e3,
+         timed(DEFAULT_RULES.content.find, trees, args.repeat) * 1e3),
+        ('url filter (us/url)', timed(legacy_wants, urls, args.repeat) * 1e6,
+         timed(DEFAULT_RULES.wants_image, urls, args.repeat) * 1e6),
+    ]
+    for label, legacy, compiled in rows:
+        print(f'{label:<22} {legacy:>10.3f} {compiled:>10.3f} {legacy / compiled:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Parse-time and memory benchmark: legacy triple parse vs single-parse extraction.
+
+    legacy  BeautifulSoup(html.parser) on the page, readability's own lxml
+            parses for title() and summary(), BeautifulSoup again on the summary
+    single  ArticleDocument: one lxml parse shared by image discovery and
+            readability, article serialized once
+
+Both paths run image discovery and produce content HTML; no images are
+downloaded. Memory is measured over one pass of the corpus in a fresh
+subprocess per path: peak RSS growth, and the peak Python heap from
+tracemalloc (which sees BeautifulSoup's trees but not libxml2's).
+
+    pip install -r benchmarks/requirements.txt   # BeautifulSoup, for legacy
+    python benchmarks/parse_benchmark.py --repeat 5
+"""
+
+import argparse
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.corpus import load_corpus, IMAGE_HOST
+
+
+def legacy_extract(html, processor):
+    from bs4 import BeautifulSoup
+    from readability import Document
+
+    original_soup = BeautifulSoup(html, 'html.parser')
+    doc = Document(html)
+    title = doc.title()
+    clean_html = doc.summary()
+    soup = BeautifulSoup(clean_html, 'html.parser')
+
+    # Same content-area search and img walk the old ImageProcessor did
+    selectors = ['div[itemprop="articleBody"]', '.post-content', '.entry-content', '.article-content',
+                 '.body', 'article', '.post', '[data-testid="post-content"]', '.substack-post-content',
+                 '.post-body', '.article-body', '.content', '.entry', '.main-content']
+    area = None
+    for selector in selectors:
+        area = original_soup.select_one(selector)
+        if area:
+            break
+    area = area or original_soup.find('body') or original_soup
+    urls = [img.get('src') or img.get('data-src') for img in area.find_all('img')]
+    return title, str(soup), urls
+
+
+def single_extract(html, processor):
+    from app.extraction import ArticleDocument, to_html
+
+    doc = ArticleDocument(html)
+    title = doc.title()
+    urls = processor.extract_images_from_original_html(doc.source, IMAGE_HOST)
+    return title, to_html(doc.article_tree()), urls
+
+
+PATHS = {'legacy': legacy_extract, 'single': single_extract}
+
+
+def _proc_status_mb(field):
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1]) / 1024
+    return None
+
+
+def measure_peak_growth(fn):
+    """
+    RSS growth in MB while fn runs.
+
+    On Linux the peak (VmHWM) is reset first via /proc/self/clear_refs, so
+    import-time allocations don't hide the work; elsewhere falls back to ru_maxrss.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        before = _proc_status_mb('VmRSS')
+        fn()
+        return _proc_status_mb('VmHWM') - before
+    except OSError:
+        scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+        before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+        fn()
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale - before
+
+
+def run(path, repeat, quiet=True):
+    import contextlib
+    import io
+    from app.images import ImageProcessor
+
+    processor = ImageProcessor(cache=False)
+    fn = PATHS[path]
+    pages = load_corpus()
+    timings = []
+    for _ in range(repeat):
+        for name, html in pages:
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()) if quiet else contextlib.nullcontext():
+                fn(html, processor)
+            timings.append(time.perf_counter() - start)
+    return pages, timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        import tracemalloc
+        import bs4, readability, app.extraction  # noqa: F401  (exclude import cost)
+        load_corpus()
+        rss = measure_peak_growth(lambda: run(args.child, 1))
+        tracemalloc.start()
+        run(args.child, 1)
+        heap = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+        print(f'{rss:.1f} {heap:.1f}')
+        return
+
+    results = {}
+    for path in PATHS:
+        pages, timings = run(path, args.repeat)
+        out = subprocess.run([sys.executable, __file__, '--child', path],
+                             capture_output=True, text=True, check=True).stdout.split()
+        results[path] = (timings, float(out[-2]), float(out[-1]))
+
+    total_kb = sum(len(html) for _, html in pages) / 1024
+    print(f'{len(pages)} pages ({total_kb:.0f} KB), {args.repeat} repeats')
+    print(f'{"path":<8} {"mean ms":>9} {"p50 ms":>9} {"p95 ms":>9} {"peak RSS +MB":>13} {"py heap MB":>11}')
+    for path, (timings, rss, heap) in results.items():
+        ms = sorted(t * 1000 for t in timings)
+        p95 = ms[min(len(ms) - 1, int(len(ms) * 0.95))]
+        print(f'{path:<8} {statistics.mean(ms):>9.1f} {statistics.median(ms):>9.1f} {p95:>9.1f} {rss:>13.1f} {heap:>11.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark for the full URL → EPUB → send pipeline.
+
+Serves the benchmark corpus (benchmarks/corpus.py) and its images from a local
+HTTP stand-in, then converts every article through the production path,
+ConversionPipeline.run (ContentExtractor → download_images → EpubBuilder →
+KindleSender, sending to a local HTTP sink standing in for SendGrid). Stage
+timings are read from each conversion's metrics trace (app/metrics.py):
+
+    fetch            GET the article page
+    parse            single lxml parse (ArticleDocument)
+    readability      readability cleaning
+    image_discovery  content-area search and <img> walk
+    images           the whole image phase, wall clock
+    image_download   fetching image bytes, summed over concurrent downloads
+    transcode        Pillow decode/resize/encode, summed likewise
+    image_dedupe     collapsing duplicate images
+    epub_write       writing the EPUB (in memory)
+    send             delivery to the sink
+
+Reports p50/p95 per stage and end to end, throughput, and peak RSS. The HTTP,
+image and article caches are disabled so every run does the full work.
+
+    python benchmarks/pipeline_benchmark.py --per-kind 3 --concurrency 2
+    python benchmarks/pipeline_benchmark.py --save baseline.json
+    python benchmarks/pipeline_benchmark.py --compare baseline.json --max-regression 0.25
+
+With --compare, exits non-zero if any stage's p50 (or end-to-end p50 /
+throughput) is worse than the baseline by more than --max-regression.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Measure the real work, not cache hits
+os.environ.setdefault('IMAGE_CACHE_MAX_BYTES', '0')
+os.environ.setdefault('ARTICLE_CACHE_MAX_BYTES', '0')
+os.environ.setdefault('HTTP_CACHE_MAX_BYTES', '0')
+
+from benchmarks.corpus import load_corpus
+from benchmarks.standin import ArticleServer, start_sink
+
+STAGES = ('fetch', 'parse', 'readability', 'image_discovery', 'images', 'image_download', 'transcode', 'image_dedupe',
+          'epub_write', 'send')
+COUNTS = ('images_found', 'images_kept', 'epub_bytes')
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+class PipelineRunner:
+    def __init__(self):
+        from app.jobs import ConversionPipeline
+        from app.epub_store import EpubStore
+
+        # A disabled store: nothing is kept for download
+        self.pipeline = ConversionPipeline(store=EpubStore(tempfile.mkdtemp(prefix='bench-epubs-'), max_bytes=0))
+
+    def convert(self, url):
+        """Convert and send one URL. Returns (seconds per stage, counts) from its trace."""
+        summary = {}
+
+        def listener(step, details):
+            if step == 'finished':
+                summary.update(details)
+
+        _, sent = self.pipeline.run(url, 'reader@kindle.com', listener=listener)
+        if not sent:
+            raise RuntimeError(f'send failed for {url}')
+        stages = {name: ms / 1000 for name, ms in summary['stages_ms'].items()}
+        counts = {name: summary['counts'].get(name, 0) for name in COUNTS}
+        return stages, counts
+
+
+def run_benchmark(per_kind, concurrency, repeat, latency):
+    server = ArticleServer(latency=latency).start()
+    sink = start_sink()
+    os.environ.update({
+        'DELIVERY_BACKEND': 'sendgrid',
+        'SENDGRID_API_KEY': 'SG.benchmark',
+        'SENDGRID_API_URL': f'http://127.0.0.1:{sink.server_port}/v3/mail/send',
+        'FROM_EMAIL': 'bench@example.com',
+    })
+
+    pages = load_corpus(per_kind, image_host=f'{server.base_url}/img')
+    urls = [server.add_page(name, html) for name, html in pages]
+    runner = PipelineRunner()
+
+    records = []
+    lock = threading.Lock()
+
+    def one(url):
+        start = time.perf_counter()
+        stages, counts = runner.convert(url)
+        total = time.perf_counter() - start
+        with lock:
+            records.append({'url': url, 'total': total, 'stages': stages, **counts})
+
+    # The pipeline's progress prints would swamp the report (and redirecting
+    # stdout per thread isn't safe), so silence it for the whole run
+    with contextlib.redirect_stdout(io.StringIO()):
+        # Warm-up pass: imports, process pool start-up, connection pools, and
+        # the stand-in generating its images
+        for url in urls:
+            runner.convert(url)
+
+        work = [u for _ in range(repeat) for u in urls]
+        wall_start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(one, work))
+        wall = time.perf_counter() - wall_start
+
+    summary = {
+        'articles': len(records),
+        'concurrency': concurrency,
+        'wall_seconds': wall,
+        'throughput_per_sec': len(records) / wall,
+        'peak_rss_mb': peak_rss_mb(),
+        'e2e_ms': {
+            'p50': percentile([r['total'] for r in records], 50) * 1000,
+            'p95': percentile([r['total'] for r in records], 95) * 1000,
+        },
+        'stages_ms': {
+            stage: {
+                'p50': percentile([r['stages'].get(stage, 0) for r in records], 50) * 1000,
+                'p95': percentile([r['stages'].get(stage, 0) for r in records], 95) * 1000,
+            }
+            for stage in STAGES
+        },
+        'images_found': sum(r['images_found'] for r in records),
+        'images_kept': sum(r['images_kept'] for r in records),
+        'epub_mb': sum(r['epub_bytes'] for r in records) / (1024 * 1024),
+    }
+    server.shutdown()
+    sink.shutdown()
+    return summary
+
+
+def print_summary(summary):
+    print(f"{summary['articles']} articles, concurrency {summary['concurrency']}, "
+          f"{summary['images_kept']}/{summary['images_found']} images kept, "
+          f"{summary['epub_mb']:.1f} MB of EPUB")
+    print(f'{"stage":<16} {"p50 ms":>9} {"p95 ms":>9}')
+    for stage, ms in summary['stages_ms'].items():
+        print(f'{stage:<16} {ms["p50"]:>9.1f} {ms["p95"]:>9.1f}')
+    print(f'{"end-to-end":<16} {summary["e2e_ms"]["p50"]:>9.1f} {summary["e2e_ms"]["p95"]:>9.1f}')
+    print(f"throughput       {summary['throughput_per_sec']:.2f} articles/s")
+    print(f"peak RSS         {summary['peak_rss_mb']:.1f} MB")
+
+
+def compare(summary, baseline, max_regression):
+    """Return a list of human-readable regressions beyond the allowed ratio."""
+    problems = []
+    for stage, ms in summary['stages_ms'].items():
+        base = baseline['stages_ms'].get(stage, {}).get('p50')
+        # Ignore sub-millisecond stages; their noise dwarfs any real change
+        if base and base >= 1.0 and ms['p50'] > base * (1 + max_regression):
+            problems.append(f"{stage} p50 {ms['p50']:.1f} ms vs {base:.1f} ms")
+    base_e2e = baseline['e2e_ms']['p50']
+    if summary['e2e_ms']['p50'] > base_e2e * (1 + max_regression):
+        problems.append(f"end-to-end p50 {summary['e2e_ms']['p50']:.1f} ms vs {base_e2e:.1f} ms")
+    base_tp = baseline['throughput_per_sec']
+    if summary['throughput_per_sec'] < base_tp * (1 - max_regression):
+        problems.append(f"throughput {summary['throughput_per_sec']:.2f}/s vs {base_tp:.2f}/s")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--per-kind', type=int, default=2, help='synthetic pages per layout')
+    parser.add_argument('--concurrency', type=int, default=1, help='articles converted in parallel')
+    parser.add_argument('--repeat', type=int, default=1, help='passes over the corpus')
+    parser.add_argument('--latency', type=float, default=0.0, help='simulated origin latency per request (s)')
+    parser.add_argument('--save', help='write results as JSON')
+    parser.add_argument('--compare', help='baseline JSON from --save')
+    parser.add_argument('--max-regression', type=float, default=0.25)
+    args = parser.parse_args()
+
+    summary = run_benchmark(args.per_kind, args.concurrency, args.repeat, args.latency)
+
+    print_summary(summary)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(summary, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            problems = compare(summary, json.load(f), args.max_regression)
+        if problems:
+            print('\nRegressions:')
+            for p in problems:
+                print(f'  {p}')
+            sys.exit(1)
+        print('\nNo regressions beyond the allowed margin.')
+
+
+if __name__ == '__main__':
+    main()
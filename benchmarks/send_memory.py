@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Peak-RSS comparison of the SendGrid attachment paths.
+
+Sends a synthetic EPUB-sized attachment to a local HTTP sink that stands in
+for api.sendgrid.com, once with the old helper-library path (read file,
+base64 string, Mail JSON) and once with KindleSender's streaming body.
+Each path runs in a fresh subprocess so its peak RSS is measured in isolation.
+
+    pip install -r benchmarks/requirements.txt   # the SendGrid library, for legacy
+    python benchmarks/send_memory.py --size-mb 30
+"""
+
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.standin import start_sink
+
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def send_legacy(path, sink_url):
+    """The pre-streaming path: whole file, base64 string and JSON all in memory."""
+    import base64
+    from sendgrid import SendGridAPIClient
+    from sendgrid.helpers.mail import Mail, Email, To, Content, Attachment, FileContent, FileName, FileType, Disposition
+
+    sg = SendGridAPIClient('SG.benchmark', host=sink_url)
+    message = Mail(
+        from_email=Email('bench@example.com'),
+        to_emails=To('reader@kindle.com'),
+        subject='Convert',
+        html_content=Content('text/html', 'Benchmark')
+    )
+    with open(path, 'rb') as f:
+        data = f.read()
+    encoded_file = base64.b64encode(data).decode()
+    message.attachment = Attachment(
+        FileContent(encoded_file),
+        FileName(os.path.basename(path)),
+        FileType('application/epub+zip'),
+        Disposition('attachment')
+    )
+    return sg.send(message).status_code == 202
+
+
+def send_streaming(path, sink_url):
+    from app.sender import KindleSender
+
+    os.environ.update({
+        'SENDGRID_API_KEY': 'SG.benchmark',
+        'FROM_EMAIL': 'bench@example.com',
+        'SENDGRID_API_URL': f'{sink_url}/v3/mail/send',
+    })
+    return KindleSender().send_epub(path, to_email='reader@kindle.com')
+
+
+def run_child(mode, path):
+    sink = start_sink()
+    sink_url = f'http://127.0.0.1:{sink.server_port}'
+    baseline = peak_rss_mb()
+    ok = (send_legacy if mode == 'legacy' else send_streaming)(path, sink_url)
+    print(f'{mode} {baseline:.1f} {peak_rss_mb():.1f} {ok}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size-mb', type=int, default=30, help='attachment size in MB')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--path', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args.path)
+        return
+
+    with tempfile.NamedTemporaryFile(suffix='.epub', delete=False) as f:
+        # Random bytes: EPUBs are zip files, so effectively incompressible
+        f.write(os.urandom(args.size_mb * 1024 * 1024))
+        path = f.name
+
+    try:
+        print(f'Attachment: {args.size_mb} MB')
+        print(f'{"path":<10} {"baseline MB":>12} {"peak MB":>10} {"delta MB":>10}')
+        for mode in ('legacy', 'streaming'):
+            out = subprocess.run(
+                [sys.executable, __file__, '--child', mode, '--path', path],
+                capture_output=True, text=True, check=True
+            ).stdout.strip().splitlines()[-1]
+            name, baseline, peak, ok = out.split()
+            delta = float(peak) - float(baseline)
+            print(f'{name:<10} {float(baseline):>12.1f} {float(peak):>10.1f} {delta:>10.1f}' + ('' if ok == 'True' else '  (send failed)'))
+    finally:
+        os.unlink(path)
+
+
+if __name__ == '__main__':
+    main()
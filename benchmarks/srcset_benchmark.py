@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Responsive image selection: bytes and transcode time per image.
+
+Runs pick_image_source over <img>/<picture> markup as real sites publish it
+(Substack, WordPress, Medium, Ghost, a news site with art-directed
+<picture> sources, density-only srcsets, lazy-load placeholders), checks
+each pick against the expected rendition, and compares it with the old
+rule (src, else the first srcset candidate):
+
+    - the width each rule would download
+    - bytes and transcode_image time for a synthetic JPEG of that width
+      (photographic noise, 3:2), which is what the pipeline pays per image
+
+    python benchmarks/srcset_benchmark.py
+"""
+
+import argparse
+import os
+import sys
+import time
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SUBSTACK = 'https://substackcdn.com/image/fetch/w_{w},c_limit,f_auto,q_auto:good,fl_progressive:steep/https%3A%2F%2Fsubstack-post-media.s3.amazonaws.com%2Fpublic%2Fimages%2Fa1b2.jpeg'
+
+# (name, markup, expected pick (URL suffix), its width, width the old rule
+# downloaded; None where it found no usable URL and the image was lost)
+SAMPLES = [
+    ('substack', f'''<picture>
+        <source type="image/webp" srcset="{SUBSTACK.format(w=424)} 424w, {SUBSTACK.format(w=848)} 848w, {SUBSTACK.format(w=1272)} 1272w, {SUBSTACK.format(w=1456)} 1456w" sizes="100vw">
+        <img src="{SUBSTACK.format(w=1456)}" srcset="{SUBSTACK.format(w=424)} 424w, {SUBSTACK.format(w=848)} 848w, {SUBSTACK.format(w=1272)} 1272w, {SUBSTACK.format(w=1456)} 1456w" width="1456" height="971" sizes="100vw" loading="lazy">
+     </picture>''', 'w_848,', 848, 1456),
+    ('wordpress', '''<img width="1024" height="683" src="https://example.com/wp-content/uploads/2024/05/photo-1024x683.jpg"
+        class="wp-image-123" srcset="https://example.com/wp-content/uploads/2024/05/photo-1024x683.jpg 1024w,
+        https://example.com/wp-content/uploads/2024/05/photo-300x200.jpg 300w,
+        https://example.com/wp-content/uploads/2024/05/photo-768x512.jpg 768w,
+        https://example.com/wp-content/uploads/2024/05/photo-1536x1024.jpg 1536w,
+        https://example.com/wp-content/uploads/2024/05/photo-2048x1365.jpg 2048w,
+        https://example.com/wp-content/uploads/2024/05/photo.jpg 3000w" sizes="(max-width: 1024px) 100vw, 1024px">''',
+     'photo-1024x683.jpg', 1024, 1024),
+    ('wordpress-lazy', '''<img src="data:image/svg+xml,%3Csvg%20xmlns='http://www.w3.org/2000/svg'%3E%3C/svg%3E"
+        data-srcset="/wp-content/uploads/photo-2560x1707.jpg 2560w, /wp-content/uploads/photo-1280x853.jpg 1280w, /wp-content/uploads/photo-640x427.jpg 640w"
+        data-src="/wp-content/uploads/photo-2560x1707.jpg" class="lazyload">''', '/wp-content/uploads/photo-1280x853.jpg', 1280, 2560),
+    ('medium', '''<picture>
+        <source srcset="https://miro.medium.com/v2/resize:fit:640/format:webp/1*abc.jpeg 640w, https://miro.medium.com/v2/resize:fit:720/format:webp/1*abc.jpeg 720w, https://miro.medium.com/v2/resize:fit:750/format:webp/1*abc.jpeg 750w, https://miro.medium.com/v2/resize:fit:786/format:webp/1*abc.jpeg 786w, https://miro.medium.com/v2/resize:fit:828/format:webp/1*abc.jpeg 828w, https://miro.medium.com/v2/resize:fit:1100/format:webp/1*abc.jpeg 1100w, https://miro.medium.com/v2/resize:fit:1400/format:webp/1*abc.jpeg 1400w" sizes="(min-resolution: 4dppx) and (max-width: 700px) 50vw, 700px" type="image/webp">
+        <img alt="" class="bh mo ob c" width="700" height="467" loading="eager" role="presentation">
+     </picture>''', 'fit:828/', 828, None),
+    ('news-avif', '''<picture>
+        <source media="(min-width: 660px)" type="image/avif" srcset="https://i.example-news.com/img/media/1/master/2000.avif 2000w, https://i.example-news.com/img/media/1/master/1000.avif 1000w">
+        <source media="(min-width: 660px)" srcset="https://i.example-news.com/img/media/1/master/620.jpg 620w, https://i.example-news.com/img/media/1/master/1240.jpg 1240w, https://i.example-news.com/img/media/1/master/2480.jpg 2480w">
+        <img src="https://i.example-news.com/img/media/1/master/460.jpg" alt="A photo">
+     </picture>''', 'master/1240.jpg', 1240, 460),
+    ('ghost-density', '''<img src="/content/images/size/w600/2024/04/cover.jpg"
+        srcset="/content/images/size/w600/2024/04/cover.jpg 1x, /content/images/size/w1200/2024/04/cover.jpg 2x"
+        width="600" alt="">''', 'w1200/2024/04/cover.jpg', 1200, 600),
+    ('too-small', '''<img srcset="https://cdn.example.org/a-320.jpg 320w, https://cdn.example.org/a-480.jpg 480w, https://cdn.example.org/a-640.jpg 640w">''',
+     'a-640.jpg', 640, 320),
+]
+
+
+def legacy_pick(img, base_url):
+    """The old rule: src, data-src, else the first srcset candidate."""
+    from urllib.parse import urljoin
+    url = img.get('src') or img.get('data-src')
+    for attr in ('srcset', 'data-srcset'):
+        if not url and img.get(attr):
+            url = img.get(attr).split(',')[0].split()[0]
+    return urljoin(base_url, url.strip()) if url else None
+
+
+def synthetic_jpeg(width, cache={}):
+    if width not in cache:
+        from PIL import Image
+        img = Image.effect_noise((width, width * 2 // 3), 60).convert('RGB')
+        out = BytesIO()
+        img.save(out, format='JPEG', quality=85)
+        cache[width] = out.getvalue()
+    return cache[width]
+
+
+def transcode_cost(width, repeat):
+    from app.images import transcode_image
+    data = synthetic_jpeg(width)
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        transcode_image(data)
+        best = min(best, time.perf_counter() - start)
+    return len(data), best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5, help='transcode timings per image (best is kept)')
+    args = parser.parse_args()
+
+    from lxml import html as lxml_html
+    from app.images import pick_image_source
+    from app.config import MAX_IMAGE_WIDTH
+
+    base_url = 'https://example.com/2024/05/post/'
+    rows = []
+    for name, markup, expected, new_width, old_width in SAMPLES:
+        doc = lxml_html.fragment_fromstring(markup, create_parent='div')
+        img = next(doc.iter('img'))
+        picked = pick_image_source(img, base_url)
+        if expected not in (picked or ''):
+            sys.exit(f'{name}: picked {picked}, expected ...{expected}')
+        if old_width is None and legacy_pick(img, base_url):
+            sys.exit(f'{name}: old rule unexpectedly found {legacy_pick(img, base_url)}')
+        rows.append((name, old_width, new_width))
+
+    print(f'All {len(SAMPLES)} samples pick the smallest rendition >= {MAX_IMAGE_WIDTH}px (or the widest)')
+    print(f'{"sample":<16} {"old w":>6} {"new w":>6} {"old KB":>8} {"new KB":>8} {"old ms":>8} {"new ms":>8}')
+    saved = [0, 0, 0.0, 0.0]
+    for name, old_width, new_width in rows:
+        old_bytes, old_time = transcode_cost(old_width, args.repeat) if old_width else (0, 0.0)
+        new_bytes, new_time = transcode_cost(new_width, args.repeat)
+        if old_width and old_width > new_width:
+            saved = [saved[0] + old_bytes, saved[1] + new_bytes, saved[2] + old_time, saved[3] + new_time]
+        print(f'{name:<16} {old_width or "lost":>6} {new_width:>6} {old_bytes / 1024:>8.0f} {new_bytes / 1024:>8.0f} '
+              f'{old_time * 1e3:>8.1f} {new_time * 1e3:>8.1f}')
+
+    print(f'\nWhere the old rule over-fetched: {saved[0] / 1024:.0f} KB -> {saved[1] / 1024:.0f} KB downloaded, '
+          f'{saved[2] * 1e3:.1f} -> {saved[3] * 1e3:.1f} ms transcoding')
+    print('Where it under-fetched (or found nothing), the new pick is wide enough for the Kindle.')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+"""
+Local HTTP stand-ins for the outside world, used by the offline benchmarks.
+
+ArticleServer  serves corpus pages at /pages/<name>.html and images for
+               everything else: files saved under benchmarks/corpus/ if they
+               exist, otherwise a deterministic JPEG/PNG generated from the
+               path (…_1600x1000.jpg gets a 1600x1000 image). Responses carry
+               ETag / Last-Modified and honour conditional requests.
+               An optional per-request latency simulates a remote origin,
+               fail() makes a path answer with an error status a few times,
+               and peak_in_flight records the most concurrent requests seen.
+start_sink()   an HTTP endpoint that swallows POST bodies and answers 202,
+               standing in for api.sendgrid.com.
+"""
+
+import hashlib
+import io
+import random
+import re
+import threading
+import time
+from email.utils import formatdate
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit
+from PIL import Image
+from benchmarks.corpus import CORPUS_DIR
+
+SIZE_RE = re.compile(r'_(\d+)x(\d+)\.')
+LAST_MODIFIED = formatdate(0, usegmt=True)
+
+
+def synthesize_image(path):
+    """A deterministic, photo-like (noisy, so realistically sized) image for a path."""
+    match = SIZE_RE.search(path)
+    if match:
+        size = (int(match.group(1)), int(match.group(2)))
+    elif any(k in path for k in ('icon', 'logo', 'pixel', 'avatar', 'thumb')):
+        size = (48, 48) if 'pixel' not in path else (1, 1)
+    else:
+        size = (900, 600)
+
+    rng = random.Random(path)
+    base = Image.new('RGB', size, tuple(rng.randrange(256) for _ in range(3)))
+    noise = Image.effect_noise(size, 40).convert('RGB')
+    img = Image.blend(base, noise, 0.35)
+
+    out = io.BytesIO()
+    if path.endswith('.png'):
+        img.save(out, format='PNG')
+        return out.getvalue(), 'image/png'
+    img.save(out, format='JPEG', quality=90)
+    return out.getvalue(), 'image/jpeg'
+
+
+class _ArticleHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        server.count_request(+1)
+        try:
+            self._respond(server)
+        finally:
+            server.count_request(-1)
+
+    def _respond(self, server):
+        if server.latency:
+            time.sleep(server.latency)
+
+        status = server.take_failure(self.path)
+        if status:
+            self.send_response(status)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        body, content_type = server.resource(self.path)
+        if body is None:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        etag = '"%s"' % hashlib.md5(body).hexdigest()
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', LAST_MODIFIED)
+        self.send_header('Cache-Control', 'max-age=300')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ArticleServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, latency=0.0):
+        super().__init__(('127.0.0.1', 0), _ArticleHandler)
+        self.latency = latency
+        self.pages = {}
+        self.requests = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self._failures = {}
+        self._images = {}
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        return f'http://127.0.0.1:{self.server_port}'
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def add_page(self, name, html):
+        """Serve html at /pages/<name>.html and return its URL."""
+        self.pages[name] = html.encode('utf-8')
+        return f'{self.base_url}/pages/{name}.html'
+
+    def count_request(self, delta):
+        """A request started (+1) or finished (-1)."""
+        with self._lock:
+            if delta > 0:
+                self.requests += 1
+            self.in_flight += delta
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def fail(self, path, times=1, status=503):
+        """Answer the next `times` requests for path with status."""
+        with self._lock:
+            self._failures[path] = (times, status)
+
+    def take_failure(self, raw_path):
+        with self._lock:
+            times, status = self._failures.get(raw_path, (0, None))
+            if not times:
+                return None
+            self._failures[raw_path] = (times - 1, status)
+            return status
+
+    def resource(self, raw_path):
+        path = urlsplit(raw_path).path
+        if path.startswith('/pages/'):
+            name = path[len('/pages/'):].rsplit('.', 1)[0]
+            body = self.pages.get(name)
+            return body, 'text/html; charset=utf-8'
+
+        saved = CORPUS_DIR / path.lstrip('/')
+        if saved.is_file() and CORPUS_DIR in saved.resolve().parents:
+            suffix = saved.suffix.lower().lstrip('.')
+            return saved.read_bytes(), f"image/{'jpeg' if suffix == 'jpg' else suffix}"
+
+        with self._lock:
+            cached = self._images.get(raw_path)
+        if cached is None:
+            cached = synthesize_image(raw_path)
+            with self._lock:
+                self._images[raw_path] = cached
+        return cached
+
+
+class _SinkHandler(BaseHTTPRequestHandler):
+    """Accepts a POST, discards the body, answers 202 like SendGrid."""
+
+    def do_POST(self):
+        remaining = int(self.headers.get('Content-Length', 0))
+        while remaining:
+            remaining -= len(self.rfile.read(min(remaining, 1 << 16)))
+        self.send_response(202)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def start_sink():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _SinkHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Inbound-email webhook throughput with the user cache on and off.
+
+Posts SendGrid-style inbound emails to /webhooks/inbound-email through
+Flask's test client, against a throwaway SQLite database, and reports
+requests per second and database statements per request:
+
+    - registered senders with one URL each (a job is queued per email)
+    - unregistered senders (looked up, then ignored)
+
+SQLite on local disk answers in microseconds, while the production database
+is Postgres across the network, so every statement is delayed by
+--latency-ms to stand in for that round trip (0 measures raw SQLite).
+
+    python benchmarks/webhook_throughput.py --emails 300 --latency-ms 1
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def email_form(sender, n):
+    return {
+        'envelope': json.dumps({'from': sender, 'to': ['save@kindle.example']}),
+        'subject': f'Issue {n}',
+        'text': f'Read this: https://news.example.com/p/issue-{n}',
+        'headers': f'Message-ID: <bench-{n}-{time.time_ns()}@mail.example>',
+    }
+
+
+def run(client, senders, emails, stmts):
+    """Post emails round-robin from senders. Returns (seconds, statements per request)."""
+    stmts.clear()
+    start = time.perf_counter()
+    for n in range(emails):
+        response = client.post('/webhooks/inbound-email', data=email_form(senders[n % len(senders)], n))
+        if response.status_code >= 500:
+            sys.exit(f'webhook failed: {response.get_json()}')
+    return time.perf_counter() - start, len(stmts) / emails
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--emails', type=int, default=300, help='emails per scenario')
+    parser.add_argument('--users', type=int, default=20, help='registered senders')
+    parser.add_argument('--latency-ms', type=float, default=1.0, help='simulated database round trip')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='webhook-bench-')
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+
+    from sqlalchemy import event
+    from web_app import app
+    from app.models import db, User
+    from app.database import init_db
+    from app.user_cache import user_cache
+
+    stmts = []
+    latency = args.latency_ms / 1000
+
+    def before_execute(conn, cursor, statement, *rest):
+        stmts.append(statement)
+        if latency:
+            time.sleep(latency)
+
+    with app.app_context():
+        init_db()
+        event.listen(db.engine, 'before_cursor_execute', before_execute)
+        registered = []
+        for i in range(args.users):
+            user = User.create_or_update(f'reader{i}@example.com', f'Reader {i}')
+            user.kindle_email = f'reader{i}@kindle.com'
+            registered.append(user.email)
+        db.session.commit()
+    strangers = [f'stranger{i}@example.org' for i in range(args.users)]
+
+    client = app.test_client()
+    results = {}
+    with contextlib.redirect_stdout(io.StringIO()):   # the webhook logs every email
+        for label, senders in (('registered', registered), ('unregistered', strangers)):
+            for cached in (False, True):
+                user_cache.max_entries = 1024 if cached else 0
+                user_cache.clear()
+                run(client, senders, len(senders), stmts)   # warm up (and fill the cache)
+                results[label, cached] = run(client, senders, args.emails, stmts)
+
+    print(f'{args.emails} emails per run from {args.users} senders, {args.latency_ms:g} ms per statement')
+    print(f"{'senders':<14} {'cache':>6} {'req/s':>8} {'stmts/req':>10} {'speedup':>8}")
+    for label in ('registered', 'unregistered'):
+        base = results[label, False][0]
+        for cached in (False, True):
+            seconds, per_request = results[label, cached]
+            print(f"{label:<14} {'on' if cached else 'off':>6} {args.emails / seconds:>8.0f} {per_request:>10.1f} "
+                  f"{base / seconds:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -19,7 +19,7 @@ def test_webhook():
         print(f"Status Code: {response.status_code}")
         print(f"Response: {response.text}")
         
-        if response.status_code == 200:
+        if response.status_code in (200, 202):
             print("✅ Webhook test passed!")
         else:
             print("❌ Webhook test failed.")
@@ -0,0 +1,94 @@
+"""
+Shared fixtures. The environment is set before any app module is imported:
+app/config.py reads it at import time, and the caches and delivery backend
+must never touch the developer's own directories or send real email.
+"""
+
+import os
+import sys
+import tempfile
+
+_scratch = tempfile.mkdtemp(prefix='kindle-tests-')
+os.environ.update({
+    'DATABASE_URL': f'sqlite:///{os.path.join(_scratch, "app.db")}',
+    'IMAGE_CACHE_DIR': os.path.join(_scratch, 'cache', 'images'),
+    'HTTP_CACHE_DIR': os.path.join(_scratch, 'cache', 'http'),
+    'ARTICLE_CACHE_DIR': os.path.join(_scratch, 'cache', 'articles'),
+    'DELIVERY_BACKEND': 'file',
+    'DELIVERY_FILE_DIR': os.path.join(_scratch, 'outbox'),
+    'IMAGE_TRANSCODE_PROCESSES': '0',
+})
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from flask import Flask
+
+
+@pytest.fixture
+def app(tmp_path):
+    """A bare Flask app on a fresh SQLite database, inside an app context."""
+    from app.database import configure_database, init_db
+    from app.user_cache import user_cache
+
+    flask_app = Flask(__name__)
+    configure_database(flask_app, url=f'sqlite:///{tmp_path / "test.db"}')
+    user_cache.clear()   # ids repeat from one test database to the next
+    with flask_app.app_context():
+        init_db()
+        yield flask_app
+    user_cache.clear()
+
+
+
+class _Page:
+    content = b'<html><body><p>Hello</p></body></html>'
+
+
+class FakeExtractor:
+    """Serves one canned article and counts the pages fetched."""
+
+    def __init__(self):
+        self.fetches = 0
+
+    def fetch_page(self, url):
+        self.fetches += 1
+        return _Page()
+
+    def process_page(self, page, url, profile=None):
+        return {'title': 'Hello', 'content': '<p>Hello</p>', 'images': [], 'url': url}
+
+
+class FakeSender:
+    """Answers sends from a list of results (the last one repeats)."""
+
+    def __init__(self, *results):
+        self.results = list(results)
+        self.sent = []
+
+    def send_epub(self, epub, to_email=None):
+        self.sent.append(epub.read())
+        return self.results.pop(0) if len(self.results) > 1 else self.results[0]
+
+
+@pytest.fixture
+def store(tmp_path):
+    """An EPUB download store in a temporary directory."""
+    from app.epub_store import EpubStore
+    return EpubStore(tmp_path / 'epubs', max_bytes=10 * 1024 * 1024)
+
+
+@pytest.fixture
+def make_worker(store):
+    """
+    Build a JobWorker for a Flask app whose pipeline converts a canned page
+    and answers sends with the given results. Returns (worker, extractor, sender).
+    """
+    from app.epub import EpubBuilder
+    from app.jobs import ConversionPipeline, JobWorker
+
+    def build(flask_app, *send_results):
+        extractor, sender = FakeExtractor(), FakeSender(*send_results)
+        pipeline = ConversionPipeline(extractor=extractor, builder=EpubBuilder(store=store), sender=sender,
+                                      article_cache=False, store=store)
+        return JobWorker(flask_app, pipeline=pipeline), extractor, sender
+    return build
@@ -0,0 +1,100 @@
+from datetime import datetime
+import pytest
+from app.digest import DigestScheduler, FakeClock
+from app.jobs import enqueue_conversion
+from app.models import db, User, ConversionJob
+
+
+@pytest.fixture
+def clock():
+    return FakeClock(datetime.utcnow())
+
+
+@pytest.fixture
+def scheduler(app, clock):
+    return DigestScheduler(app, clock=clock)
+
+
+def make_user(email='reader@example.com', interval=24, max_articles=5, enabled=True):
+    user = User(email=email, name='Reader', kindle_email='reader@kindle.com', digest_enabled=enabled,
+                digest_interval_hours=interval, digest_max_articles=max_articles)
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+def hold(user, *urls):
+    return [enqueue_conversion(url, user.kindle_email, user=user, hold=True)[0] for url in urls]
+
+
+def statuses(jobs):
+    db.session.expire_all()   # the scheduler commits in its own app context and session
+    return [db.session.get(ConversionJob, job.id).status for job in jobs]
+
+
+def test_holds_articles_until_the_interval_has_passed(scheduler, clock):
+    user = make_user(interval=24)
+    held = hold(user, 'https://example.com/a', 'https://example.com/b')
+
+    assert scheduler.tick() == []
+    clock.advance(hours=23)
+    assert scheduler.tick() == []
+    assert statuses(held) == [ConversionJob.STATUS_HELD] * 2
+
+    clock.advance(hours=2)
+    [batch] = scheduler.tick()
+    assert batch.urls == ['https://example.com/a', 'https://example.com/b']
+    assert batch.status == ConversionJob.STATUS_QUEUED
+    assert batch.title == f"Kindle Digest – {clock.now:%b %d, %Y}"
+    assert statuses(held) == [ConversionJob.STATUS_BATCHED] * 2
+
+
+def test_releases_early_once_max_articles_are_waiting(scheduler):
+    user = make_user(max_articles=3)
+    held = hold(user, *(f'https://example.com/{n}' for n in range(4)))
+
+    [batch] = scheduler.tick()
+    assert len(batch.urls) == 3
+    # The fourth waits for the next digest
+    assert statuses(held) == [ConversionJob.STATUS_BATCHED] * 3 + [ConversionJob.STATUS_HELD]
+
+
+def test_a_single_due_article_is_queued_as_itself(scheduler, clock):
+    user = make_user(interval=1)
+    [job] = hold(user, 'https://example.com/only')
+
+    clock.advance(hours=2)
+    assert [j.id for j in scheduler.tick()] == [job.id]
+    assert statuses([job]) == [ConversionJob.STATUS_QUEUED]
+
+
+def test_turning_digests_off_releases_what_is_held(scheduler):
+    user = make_user(interval=24)
+    held = hold(user, 'https://example.com/a', 'https://example.com/b')
+    user.digest_enabled = False
+    db.session.commit()
+
+    [batch] = scheduler.tick()
+    assert len(batch.urls) == 2
+    assert statuses(held) == [ConversionJob.STATUS_BATCHED] * 2
+
+
+def test_users_are_scheduled_independently(scheduler, clock):
+    early = make_user('early@example.com', interval=1)
+    late = make_user('late@example.com', interval=48)
+    hold(early, 'https://example.com/e1', 'https://example.com/e2')
+    late_jobs = hold(late, 'https://example.com/l1', 'https://example.com/l2')
+
+    clock.advance(hours=2)
+    [batch] = scheduler.tick()
+    assert batch.user_id == early.id
+    assert statuses(late_jobs) == [ConversionJob.STATUS_HELD] * 2
+
+
+def test_a_released_digest_is_not_released_again(scheduler, clock):
+    user = make_user(interval=1)
+    hold(user, 'https://example.com/a', 'https://example.com/b')
+
+    clock.advance(hours=2)
+    assert len(scheduler.tick()) == 1
+    assert scheduler.tick() == []
@@ -0,0 +1,186 @@
+"""FetchEngine against the local stand-in origin (benchmarks/standin.py)."""
+
+import asyncio
+
+import pytest
+
+from app.fetch import FetchBudgetExceeded, FetchEngine, FetchError, FetchSlotTimeout
+from app.http_cache import HttpCache
+from app.images import ImageProcessor
+from benchmarks.standin import ArticleServer
+
+PAGE = '<html><head><title>Stand-in</title></head><body><p>Hello</p></body></html>'
+
+
+@pytest.fixture
+def origin():
+    """Start stand-in servers with a given latency; all are shut down afterwards."""
+    servers = []
+
+    def start(latency=0.0):
+        server = ArticleServer(latency).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def engine():
+    """Build FetchEngines (http/1.1, no cache unless given); all are closed afterwards."""
+    engines = []
+
+    def build(**kwargs):
+        kwargs.setdefault('http2', False)
+        fetcher = FetchEngine(**kwargs)
+        engines.append(fetcher)
+        return fetcher
+
+    yield build
+    for fetcher in engines:
+        fetcher.close()
+
+
+def fetch_all(fetcher, urls):
+    async def gather():
+        return await asyncio.gather(*(fetcher.fetch(url) for url in urls), return_exceptions=True)
+    return fetcher.run(gather())
+
+
+def test_per_host_limit_caps_concurrent_requests(origin, engine):
+    server = origin(latency=0.2)
+    fetcher = engine(per_host=2)
+
+    results = fetch_all(fetcher, [f'{server.base_url}/img/{i}_100x100.jpg' for i in range(6)])
+
+    assert [r.status_code for r in results] == [200] * 6
+    assert server.requests == 6
+    assert server.peak_in_flight == 2
+
+
+def test_hosts_are_limited_separately(origin, engine):
+    first, second = origin(latency=0.2), origin(latency=0.2)
+    fetcher = engine(per_host=1)
+
+    urls = [f'{server.base_url}/img/{i}_100x100.jpg' for server in (first, second) for i in range(2)]
+    results = fetch_all(fetcher, urls)
+
+    assert [r.status_code for r in results] == [200] * 4
+    assert first.peak_in_flight == second.peak_in_flight == 1
+
+
+def test_slow_response_exceeds_time_budget(origin, engine):
+    server = origin(latency=1.0)
+    fetcher = engine(timeout=0.3)
+
+    with pytest.raises(FetchBudgetExceeded):
+        fetcher.get(f'{server.base_url}/img/slow_100x100.jpg')
+
+
+def test_waiting_for_a_slot_does_not_use_the_time_budget(origin, engine):
+    # Three queued fetches take 0.9s in total; each one alone fits its 0.6s budget
+    server = origin(latency=0.3)
+    fetcher = engine(per_host=1, timeout=0.6)
+
+    results = fetch_all(fetcher, [f'{server.base_url}/img/{i}_100x100.jpg' for i in range(3)])
+
+    assert [r.status_code for r in results] == [200] * 3
+
+
+def test_slot_wait_is_bounded(origin, engine):
+    server = origin(latency=0.5)
+    fetcher = engine(per_host=1, slot_timeout=0.2)
+
+    results = fetch_all(fetcher, [f'{server.base_url}/img/{i}_100x100.jpg' for i in range(2)])
+
+    assert sum(isinstance(r, FetchSlotTimeout) for r in results) == 1
+    assert server.requests == 1
+
+
+def test_oversized_body_exceeds_byte_budget(origin, engine):
+    server = origin()
+    fetcher = engine(max_bytes=1024)
+
+    with pytest.raises(FetchBudgetExceeded):
+        fetcher.get(f'{server.base_url}/img/large_800x800.jpg')
+
+
+def test_fresh_response_comes_from_cache(origin, engine, tmp_path):
+    server = origin()
+    fetcher = engine(cache=HttpCache(tmp_path / 'http'))
+    url = server.add_page('cached', PAGE)
+
+    first = fetcher.get(url, cache=True)
+    second = fetcher.get(url, cache=True)
+
+    assert first.cache_status is None
+    assert second.cache_status == 'hit'
+    assert second.text == first.text
+    assert server.requests == 1
+
+
+def test_stale_response_is_revalidated(origin, engine, tmp_path):
+    server = origin()
+    cache = HttpCache(tmp_path / 'http')
+    fetcher = engine(cache=cache)
+    url = server.add_page('stale', PAGE)
+
+    fetcher.get(url, cache=True)
+    cache._conn.execute('UPDATE responses SET expires_at = 0')
+    cache._conn.commit()
+    result = fetcher.get(url, cache=True)
+
+    assert result.cache_status == 'revalidated'
+    assert result.status_code == 200
+    assert 'Hello' in result.text
+    assert server.requests == 2
+    assert cache.stats()['revalidations'] == 1
+
+
+def test_uncached_fetch_ignores_cache(origin, engine, tmp_path):
+    server = origin()
+    fetcher = engine(cache=HttpCache(tmp_path / 'http'))
+    url = server.add_page('uncached', PAGE)
+
+    fetcher.get(url, cache=True)
+    result = fetcher.get(url)
+
+    assert result.cache_status is None
+    assert server.requests == 2
+
+
+def test_image_fetch_retries_error_statuses(origin, engine):
+    server = origin()
+    fetcher = engine()
+    url = f'{server.base_url}/img/flaky_200x200.jpg'
+    server.fail('/img/flaky_200x200.jpg', times=2)
+
+    response = fetcher.run(ImageProcessor(fetcher=fetcher)._fetch_image(url))
+
+    assert response.status_code == 200
+    assert server.requests == 3
+
+
+def test_image_fetch_gives_up_after_three_attempts(origin, engine):
+    server = origin()
+    fetcher = engine()
+    url = f'{server.base_url}/img/down_200x200.jpg'
+    server.fail('/img/down_200x200.jpg', times=5)
+
+    with pytest.raises(FetchError):
+        fetcher.run(ImageProcessor(fetcher=fetcher)._fetch_image(url))
+    assert server.requests == 3
+
+
+def test_image_fetch_does_not_retry_rejected_images(origin, engine):
+    server = origin()
+    fetcher = engine()
+
+    # A 1x1 tracking pixel fails check_image_header: rejected, not retried
+    response = fetcher.run(ImageProcessor(fetcher=fetcher)._fetch_image(f'{server.base_url}/img/pixel.png'))
+
+    assert response is None
+    assert server.requests == 1
@@ -0,0 +1,57 @@
+from io import BytesIO
+import pytest
+from PIL import Image
+from app.image_cache import ImageCache
+from app.image_index import dedupe_images, fingerprint
+
+
+def jpeg(img, quality=85):
+    out = BytesIO()
+    img.save(out, format='JPEG', quality=quality)
+    return out.getvalue()
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ImageCache(tmp_path / 'images', max_bytes=10 * 1024 * 1024)
+
+
+@pytest.fixture
+def picture():
+    """One picture at two sizes: a perceptual duplicate, not a byte-identical one."""
+    img = Image.effect_noise((80, 60), 60).convert('RGB').resize((400, 300), Image.Resampling.BICUBIC)
+    return jpeg(img), jpeg(img.resize((200, 150), Image.Resampling.LANCZOS))
+
+
+def put(cache, url, data):
+    cache.put(url, data, fingerprint=fingerprint(data))
+
+
+def test_identical_bytes_share_a_blob(cache, picture):
+    large, _ = picture
+    put(cache, 'https://a.example/one.jpg', large)
+    put(cache, 'https://b.example/two.jpg', large)
+
+    assert cache.stats()['blobs'] == 1
+    assert cache.lookup('https://b.example/two.jpg')['data'] == large
+
+
+def test_near_duplicates_are_not_shared_across_entries(cache, picture):
+    large, small = picture
+    put(cache, 'https://a.example/large.jpg', large)
+    put(cache, 'https://b.example/small.jpg', small)
+
+    assert cache.stats()['blobs'] == 2
+    assert cache.lookup('https://b.example/small.jpg')['data'] == small
+    assert cache.lookup('https://b.example/small.jpg')['fingerprint'] == fingerprint(small)
+
+
+def test_near_duplicates_are_merged_within_an_article(picture):
+    large, small = picture
+    images = [{'original_url': url, 'data': data, 'fingerprint': fingerprint(data)}
+              for url, data in (('https://a.example/small.jpg', small), ('https://a.example/large.jpg', large))]
+
+    [kept] = dedupe_images(images)
+
+    assert kept['original_url'] == 'https://a.example/large.jpg'
+    assert kept['aliases'] == ['https://a.example/small.jpg']
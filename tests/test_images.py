@@ -0,0 +1,55 @@
+"""ImageProcessor.download_images against the local stand-in origin."""
+
+import pytest
+
+from app.fetch import FetchEngine
+from app.image_cache import ImageCache
+from app.images import ImageProcessor
+from app.metrics import start_trace
+from benchmarks.standin import ArticleServer
+
+
+@pytest.fixture
+def server():
+    server = ArticleServer().start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def processor(tmp_path):
+    fetcher = FetchEngine(http2=False)
+    yield ImageProcessor(fetcher=fetcher, cache=ImageCache(tmp_path / 'images'))
+    fetcher.close()
+
+
+def download(processor, urls):
+    """Download urls inside a trace. Returns (images, the trace's counts)."""
+    with start_trace() as trace:
+        images = processor.download_images(urls)
+    return images, trace.counts
+
+
+def test_repeated_url_counts_as_duplicate_not_skipped(server, processor):
+    url = f'{server.base_url}/img/photo_300x200.jpg'
+
+    images, counts = download(processor, [url, url])
+
+    assert len(images) == 1
+    assert counts.get('images_skipped') == 0
+    assert counts.get('images_deduped') == 1
+    assert server.requests == 1
+
+
+def test_rejected_and_failed_urls_count_as_skipped_once(server, processor):
+    kept = f'{server.base_url}/img/kept_300x200.jpg'
+    pixel = f'{server.base_url}/img/pixel.png'
+    broken = f'{server.base_url}/img/broken_300x200.jpg'
+    server.fail('/img/broken_300x200.jpg', times=10)
+
+    images, counts = download(processor, [kept, pixel, broken, broken])
+
+    assert [image['original_url'] for image in images] == [kept]
+    assert counts.get('images_skipped') == 2
+    assert counts.get('images_deduped') == 1
@@ -0,0 +1,149 @@
+from datetime import datetime, timedelta
+import os
+import pytest
+from app.jobs import JobProgress, claim_next_job, enqueue_conversion, requeue_stale_jobs
+from app.models import db, ConversionJob, Conversion
+
+
+@pytest.fixture
+def progress(app):
+    return JobProgress(app)
+
+
+def running_job(url='https://example.com/a'):
+    enqueue_conversion(url, 'reader@kindle.com')
+    return claim_next_job()
+
+
+def age(job, **columns):
+    """Backdate a job's timestamp columns by the given number of seconds."""
+    now = datetime.utcnow()
+    (ConversionJob.query
+     .filter_by(id=job.id)
+     .update({name: now - timedelta(seconds=seconds) for name, seconds in columns.items()}))
+    db.session.commit()
+
+
+def reload(job):
+    db.session.expire_all()
+    return db.session.get(ConversionJob, job.id)
+
+
+def test_claim_starts_the_heartbeat(app):
+    job = running_job()
+
+    assert job.status == ConversionJob.STATUS_RUNNING
+    assert job.heartbeat_at == job.started_at
+
+
+def test_job_without_heartbeat_is_requeued(app):
+    job = running_job()
+    age(job, started_at=900, heartbeat_at=900)
+
+    assert requeue_stale_jobs(max_age=600) == 1
+    assert reload(job).status == ConversionJob.STATUS_QUEUED
+
+
+def test_long_running_job_with_heartbeat_is_not_requeued(progress):
+    job = running_job()
+    progress.begin(job.id)
+    age(job, started_at=3600, heartbeat_at=900)
+
+    progress.flush()
+
+    assert requeue_stale_jobs(max_age=600) == 0
+    assert reload(job).status == ConversionJob.STATUS_RUNNING
+
+
+def test_flush_beats_without_new_progress(progress):
+    job = running_job()
+    progress.begin(job.id)
+    progress.flush()
+    age(job, heartbeat_at=900)
+
+    progress.flush()
+
+    assert datetime.utcnow() - reload(job).heartbeat_at < timedelta(seconds=60)
+
+
+def test_finished_job_stops_beating(progress):
+    job = running_job()
+    progress.begin(job.id)
+    progress.finish(job.id)
+    age(job, started_at=900, heartbeat_at=900)
+
+    progress.flush()
+
+    assert requeue_stale_jobs(max_age=600) == 1
+
+
+def test_jobs_claimed_before_heartbeats_fall_back_to_started_at(app):
+    job = running_job()
+    ConversionJob.query.filter_by(id=job.id).update({'heartbeat_at': None})
+    db.session.commit()
+    age(job, started_at=900)
+
+    assert requeue_stale_jobs(max_age=600) == 1
+
+
+def test_stale_job_out_of_attempts_fails(app):
+    job = running_job()
+    ConversionJob.query.filter_by(id=job.id).update({'attempts': 3})
+    db.session.commit()
+    age(job, started_at=900, heartbeat_at=900)
+
+    requeue_stale_jobs(max_age=600)
+
+    job = reload(job)
+    assert job.status == ConversionJob.STATUS_FAILED
+    assert job.error == 'Worker timed out'
+
+
+def test_failed_email_is_retried_without_converting_again(app, store, make_worker):
+    worker, extractor, sender = make_worker(app, False, True)
+    job, _ = enqueue_conversion('https://example.com/a', 'reader@kindle.com')
+
+    assert worker.run_pending() == 2
+
+    job = reload(job)
+    assert job.status == ConversionJob.STATUS_DONE
+    assert job.attempts == 2
+    assert extractor.fetches == 1
+    assert len(sender.sent) == 2 and sender.sent[0] == sender.sent[1]
+    assert len(os.listdir(store.directory)) == 1
+    [conversion] = Conversion.query.all()
+    assert conversion.status == Conversion.STATUS_SENT
+    assert conversion.error is None
+    assert conversion.epub_filenames == job.epub_filenames
+
+
+def test_failed_email_is_converted_again_once_evicted(app, store, make_worker):
+    worker, extractor, sender = make_worker(app, False, True)
+    job, _ = enqueue_conversion('https://example.com/a', 'reader@kindle.com')
+
+    assert worker._run_one()
+    for name in os.listdir(store.directory):
+        os.unlink(store.directory / name)
+    assert worker._run_one()
+
+    job = reload(job)
+    assert job.status == ConversionJob.STATUS_DONE
+    assert extractor.fetches == 2
+    [conversion] = Conversion.query.all()
+    assert conversion.status == Conversion.STATUS_SENT
+    assert conversion.epub_filenames == job.epub_filenames
+    assert store.path_for(job.epub_filenames[0]) is not None
+
+
+def test_email_failing_every_attempt_fails_the_job_once(app, store, make_worker):
+    worker, extractor, sender = make_worker(app, False)
+    job, _ = enqueue_conversion('https://example.com/a', 'reader@kindle.com')
+
+    assert worker.run_pending() == 3
+
+    job = reload(job)
+    assert job.status == ConversionJob.STATUS_FAILED
+    assert job.error == 'Failed to send email'
+    assert extractor.fetches == 1
+    [conversion] = Conversion.query.all()
+    assert conversion.status == Conversion.STATUS_SEND_FAILED
@@ -0,0 +1,102 @@
+"""Responsive and lazy-loaded image markup: parse_srcset and pick_image_source."""
+
+import pytest
+from lxml import html as lxml_html
+
+from app.images import image_source_urls, parse_srcset, pick_image_source
+from benchmarks.srcset_benchmark import SAMPLES, SUBSTACK, legacy_pick
+
+BASE_URL = 'https://example.com/2024/05/post/'
+
+
+def first_img(markup):
+    doc = lxml_html.fragment_fromstring(markup, create_parent='div')
+    return next(doc.iter('img'))
+
+
+@pytest.mark.parametrize('name, markup, expected, width, old_width', SAMPLES, ids=[s[0] for s in SAMPLES])
+def test_samples_pick_expected_rendition(name, markup, expected, width, old_width):
+    picked = pick_image_source(first_img(markup), BASE_URL)
+
+    assert picked.startswith('http')
+    assert expected in picked
+
+
+def test_medium_sample_was_lost_by_the_old_rule():
+    markup = next(s[1] for s in SAMPLES if s[0] == 'medium')
+
+    assert legacy_pick(first_img(markup), BASE_URL) is None
+
+
+def test_parse_srcset_keeps_commas_inside_urls():
+    value = f'{SUBSTACK.format(w=424)} 424w, {SUBSTACK.format(w=848)} 848w'
+
+    assert parse_srcset(value) == [(SUBSTACK.format(w=424), 424, None), (SUBSTACK.format(w=848), 848, None)]
+
+
+def test_parse_srcset_descriptors():
+    assert parse_srcset('a.jpg, b.jpg 2x,c.jpg 1.5x , d.jpg 640w') == [
+        ('a.jpg', None, None),
+        ('b.jpg', None, 2.0),
+        ('c.jpg', None, 1.5),
+        ('d.jpg', 640, None),
+    ]
+
+
+def test_parse_srcset_ignores_junk():
+    assert parse_srcset('') == []
+    assert parse_srcset(' , ,') == []
+    assert parse_srcset('a.jpg bogusw') == [('a.jpg', None, None)]
+
+
+def test_widest_rendition_when_none_is_wide_enough():
+    img = first_img('<img srcset="/a-320.jpg 320w, /a-480.jpg 480w">')
+
+    assert pick_image_source(img, BASE_URL) == 'https://example.com/a-480.jpg'
+    assert pick_image_source(img, BASE_URL, min_width=400) == 'https://example.com/a-480.jpg'
+    assert pick_image_source(img, BASE_URL, min_width=300) == 'https://example.com/a-320.jpg'
+
+
+def test_density_srcset_without_width_picks_1x():
+    img = first_img('<img srcset="/c-2x.jpg 2x, /c-1x.jpg 1x, /c-half.jpg 0.5x">')
+
+    assert pick_image_source(img, BASE_URL) == 'https://example.com/c-1x.jpg'
+
+
+def test_lazy_data_src_is_used_behind_a_placeholder():
+    img = first_img('<img src="data:image/gif;base64,R0lGODlhAQABAAAAACw=" data-src="/lazy.jpg">')
+
+    assert pick_image_source(img, BASE_URL) == 'https://example.com/lazy.jpg'
+
+
+def test_placeholder_only_image_has_no_source():
+    img = first_img('<img src="data:image/gif;base64,R0lGODlhAQABAAAAACw=">')
+
+    assert pick_image_source(img, BASE_URL) is None
+
+
+def test_relative_urls_resolve_against_the_page():
+    img = first_img('<img src="images/figure.png">')
+
+    assert pick_image_source(img, BASE_URL) == 'https://example.com/2024/05/post/images/figure.png'
+
+
+def test_undecodable_picture_sources_are_skipped():
+    img = first_img('''<picture>
+        <source type="image/avif" srcset="/p.avif 1000w">
+        <img src="/p-460.jpg" srcset="/p-460.jpg 460w">
+    </picture>''')
+
+    assert pick_image_source(img, BASE_URL) == 'https://example.com/p-460.jpg'
+    assert 'https://example.com/p.avif' not in image_source_urls(img, BASE_URL)
+
+
+def test_source_urls_cover_every_lazy_attribute():
+    img = first_img('''<img src="data:image/svg+xml,%3Csvg%3E%3C/svg%3E" data-src="/full.jpg"
+        data-srcset="/full-640.jpg 640w, /full-1280.jpg 1280w">''')
+
+    assert image_source_urls(img, BASE_URL) == [
+        'https://example.com/full-640.jpg',
+        'https://example.com/full-1280.jpg',
+        'https://example.com/full.jpg',
+    ]
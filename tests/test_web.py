@@ -0,0 +1,50 @@
+import pytest
+from app.database import init_db
+from app.jobs import enqueue_conversion
+from app.models import db, ConversionJob
+from web_app import app as web_app, _job_status
+
+
+@pytest.fixture
+def web():
+    """web_app's own app (the scratch database from conftest), inside a request context for url_for."""
+    with web_app.test_request_context():
+        init_db()
+        yield web_app
+
+
+def status_of(job):
+    db.session.expire_all()
+    return _job_status(db.session.get(ConversionJob, job.id))
+
+
+def test_job_requeued_after_failed_email_shows_the_retry(web, make_worker):
+    worker, _, _ = make_worker(web, False, True)
+    job, _ = enqueue_conversion('https://example.com/a', 'reader@kindle.com')
+
+    assert worker._run_one()
+
+    status = status_of(job)
+    assert status['status'] == ConversionJob.STATUS_QUEUED
+    assert status['message'] == 'Retrying after an error: Failed to send email'
+    assert status['percent'] == 0
+    assert len(status['downloads']) == 1
+
+    assert worker._run_one()
+
+    status = status_of(job)
+    assert status['status'] == ConversionJob.STATUS_DONE
+    assert status['message'] == '✨ Sent to your Kindle!'
+    assert status['percent'] == 100
+
+
+def test_email_failing_every_attempt_offers_the_download(web, make_worker):
+    worker, _, _ = make_worker(web, False)
+    job, _ = enqueue_conversion('https://example.com/b', 'reader@kindle.com')
+
+    worker.run_pending()
+
+    status = status_of(job)
+    assert status['status'] == ConversionJob.STATUS_FAILED
+    assert status['message'] == 'Failed: Failed to send email'
+    assert len(status['downloads']) == 1
@@ -7,7 +7,13 @@ Each user can set their own Kindle email address.
 """
 
 import os
-from flask import Flask, render_template, request, flash, redirect, url_for, send_file
+import json
+import time
+import logging
+import threading
+from datetime import datetime, timedelta
+from flask import (Flask, render_template, request, flash, redirect, url_for, send_file, Response, jsonify, abort,
+                   stream_with_context)
 from flask_login import LoginManager, login_required, current_user
 from dotenv import load_dotenv
 
@@ -15,13 +21,21 @@ from dotenv import load_dotenv
 load_dotenv()
 
 # Import our modules
-from app.models import db, User
+from app.models import db, User, ConversionJob, Conversion
+from app.database import configure_database, init_db
 from app.auth import auth_bp, init_oauth
-from app.content import ContentExtractor
-from app.epub import EpubBuilder
-from app.sender import KindleSender
-from app.config import OUTPUT_DIR
+from app.epub_store import get_epub_store, download_name
 from app.webhooks import webhooks_bp
+from app.metrics import registry
+from app.jobs import enqueue_conversion, enqueue_batch
+from app.devices import profile_for_user, device_choices, device_profile
+from app.config import (
+    BATCH_MAX_URLS, DIGEST_DEFAULT_INTERVAL_HOURS, DIGEST_DEFAULT_MAX_ARTICLES, SSE_POLL_INTERVAL, SSE_STREAM_SECONDS,
+    SSE_MAX_STREAMS, HISTORY_PAGE_SIZE, EPUB_STORE_TTL
+)
+
+# Structured conversion logs (kindle.conversion) go to stderr alongside gunicorn's
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO'))
 
 # Create Flask app
 app = Flask(__name__)
@@ -33,21 +47,12 @@ app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1, x_prefix=1)
 # Configuration
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', os.urandom(24).hex())
 
-# Database configuration
-# Use DATABASE_URL from Railway, fallback to SQLite for local dev
-database_url = os.environ.get('DATABASE_URL', 'sqlite:///kindle_users.db')
-# Railway uses postgres:// but SQLAlchemy needs postgresql://
-if database_url.startswith('postgres://'):
-    database_url = database_url.replace('postgres://', 'postgresql://', 1)
-app.config['SQLALCHEMY_DATABASE_URI'] = database_url
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
 # Google OAuth configuration
 app.config['GOOGLE_CLIENT_ID'] = os.environ.get('GOOGLE_CLIENT_ID')
 app.config['GOOGLE_CLIENT_SECRET'] = os.environ.get('GOOGLE_CLIENT_SECRET')
 
-# Initialize extensions
-db.init_app(app)
+# Initialize extensions (database: DATABASE_URL from Railway, or SQLite for local dev; see app/database.py)
+configure_database(app)
 init_oauth(app)
 
 # Initialize Flask-Login
@@ -61,21 +66,18 @@ login_manager.login_message_category = 'info'
 @login_manager.user_loader
 def load_user(user_id):
     """Load user by ID for Flask-Login."""
-    return User.query.get(int(user_id))
+    return User.get_by_id(int(user_id))
 
 
 # Register blueprints
 app.register_blueprint(auth_bp)
 app.register_blueprint(webhooks_bp)
 
-# Initialize services
-extractor = ContentExtractor()
-builder = EpubBuilder()
-sender = KindleSender()
 
-# Create database tables
-with app.app_context():
-    db.create_all()
+@app.cli.command('init-db')
+def init_db_command():
+    """Create missing tables and columns (the Procfile's release step; web boot no longer does it)."""
+    init_db()
 
 
 # --- Public Routes ---
@@ -88,70 +90,173 @@ def login_page():
     return render_template('login.html')
 
 
+@app.route('/metrics')
+def metrics():
+    """Prometheus metrics for this process (pipeline stage timings and counters)."""
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+
 # --- Protected Routes ---
 
+def _user_job(job_id):
+    """The current user's job, or 404 (other users' jobs included)."""
+    job = db.session.get(ConversionJob, job_id)
+    if job is None or job.user_id != current_user.id:
+        abort(404)
+    return job
+
+
+def _job_status(job):
+    """Job status for the page and the event stream: to_dict() plus a message, a percentage and download links."""
+    status = job.to_dict()
+    state = status['progress'] or {}
+    step = state.get('step')
+    if job.status == ConversionJob.STATUS_FAILED:
+        message, percent = f"Failed: {job.error}", 100
+    elif job.status == ConversionJob.STATUS_QUEUED:
+        # Before the last run's step: a job requeued after an error still has it
+        message, percent = (f"Retrying after an error: {job.error}" if job.error else "Waiting for a worker…"), 0
+    elif step == 'sent':
+        message, percent = "✨ Sent to your Kindle!", 100
+    elif step == 'send_failed':
+        message, percent = "Converted, but the email failed. You can download it below.", 100
+    elif step == 'built':
+        message, percent = f"Built the EPUB ({state.get('bytes', 0) / (1024 * 1024):.1f} MB), sending…", 90
+    elif step == 'images' and state.get('total'):
+        message = f"Optimizing images: {state['done']} of {state['total']}"
+        percent = 20 + 65 * state['done'] // state['total']
+    elif step == 'extracted':
+        message = f"Extracted {state['articles_done']} of {state['articles_total']} articles"
+        percent = 10 + 75 * state['articles_done'] // state['articles_total']
+    elif step in ('fetched', 'images'):
+        message, percent = "Fetched the page, extracting…", 20
+    else:
+        message, percent = "Starting…", 5
+    conversion_id = state.get('conversion_id')
+    status.update(
+        title=status['title'] or state.get('title'),
+        message=message,
+        percent=percent,
+        downloads=[url_for('download', conversion_id=conversion_id, key=key)
+                   for key in job.epub_filenames] if conversion_id else [],
+    )
+    return status
+
+
 @app.route('/', methods=['GET', 'POST'])
 @login_required
 def index():
-    """Main page - convert URL to EPUB and send to Kindle."""
-    epub_filename = None
-    title = None
-    image_count = 0
-    email_sent = False
+    """
+    Main page - queue a URL to be converted and sent to Kindle.
 
+    A POST only queues the job (the worker does the conversion) and redirects
+    to /?job=<id>, where the page follows its progress over /api/jobs/<id>/events.
+    """
     # Check if user has set up their Kindle email
     if not current_user.kindle_email:
         flash('Please set up your Kindle email first!', 'warning')
         return redirect(url_for('settings'))
 
     if request.method == 'POST':
-        url = request.form.get('url')
+        url = (request.form.get('url') or '').strip()
         if not url:
             flash('Please enter a URL', 'error')
             return redirect(url_for('index'))
 
-        try:
-            # 1. Extract
-            data = extractor.process_url(url)
-            title = data['title']
-            image_count = len(data['images'])
-
-            # 2. Build EPUB
-            epub_path = builder.create_epub(
-                data['title'],
-                data['content'],
-                data['images'],
-                data['url']
-            )
-
-            # 3. Send to THIS USER's Kindle email
-            email_sent = sender.send_epub(epub_path, to_email=current_user.kindle_email)
-            
-            if email_sent:
-                flash(f"Successfully converted '{title}' and sent to your Kindle!", 'success')
-            else:
-                flash(f"Converted '{title}' but email failed. You can download it below.", 'warning')
-
-            epub_filename = os.path.basename(epub_path)
-            
-            return render_template('index.html', 
-                                 epub_filename=epub_filename,
-                                 title=title,
-                                 image_count=image_count,
-                                 email_sent=email_sent,
-                                 user=current_user)
-
-        except Exception as e:
-            flash(f"Error processing URL: {str(e)}", 'error')
-            return redirect(url_for('index'))
+        job, _ = enqueue_conversion(url, current_user.kindle_email, user=current_user)
+        return redirect(url_for('index', job=job.id))
+
+    job_id = request.args.get('job', type=int)
+    job = _user_job(job_id) if job_id else None
+    return render_template('index.html', user=current_user, job=job, job_status=job and _job_status(job))
+
+
+@app.route('/api/jobs/<int:job_id>')
+@login_required
+def job_status(job_id):
+    """Status of one of the user's jobs: progress, outcome and download links once done."""
+    return jsonify(_job_status(_user_job(job_id)))
+
+
+# Open event streams in this process; each one holds a gunicorn thread
+_sse_slots = threading.BoundedSemaphore(SSE_MAX_STREAMS)
+
 
-    return render_template('index.html', user=current_user)
+@app.route('/api/jobs/<int:job_id>/events')
+@login_required
+def job_events(job_id):
+    """
+    Stream a job's progress as Server-Sent Events: a 'progress' event each
+    time the status changes and a final 'done' event once it has finished.
+
+    The worker writes progress to the job row, so this polls it. Each stream
+    ends after SSE_STREAM_SECONDS, inside gunicorn's worker timeout, and the
+    browser's EventSource reconnects. When SSE_MAX_STREAMS are already open
+    this answers 204, which stops EventSource for good; the page then polls
+    /api/jobs/<id> instead.
+    """
+    _user_job(job_id)
+    if not _sse_slots.acquire(blocking=False):
+        return Response(status=204)
+
+    def events():
+        yield 'retry: 1000\n\n'
+        deadline = time.monotonic() + SSE_STREAM_SECONDS
+        last = None
+        while True:
+            job = db.session.get(ConversionJob, job_id)
+            status = _job_status(job)
+            finished = job.is_finished
+            # End the read transaction so SQLite writers aren't held up while we sleep
+            db.session.rollback()
+            data = json.dumps(status)
+            if finished:
+                yield f'event: done\ndata: {data}\n\n'
+                return
+            if data != last:
+                yield f'event: progress\ndata: {data}\n\n'
+                last = data
+            if time.monotonic() >= deadline:
+                return
+            time.sleep(SSE_POLL_INTERVAL)
+
+    response = Response(stream_with_context(events()), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # Released when the server closes the response, even if the stream never started
+    response.call_on_close(_sse_slots.release)
+    return response
+
+
+@app.route('/api/batch', methods=['POST'])
+@login_required
+def batch():
+    """
+    Queue several URLs to be compiled into one EPUB and sent to the user's Kindle.
+
+    Accepts JSON {"urls": [...], "title": "..."} or a form with a newline-separated
+    'urls' field. Returns 202 with the queued job.
+    """
+    if not current_user.kindle_email:
+        return jsonify({'error': 'Kindle email not configured'}), 400
+
+    payload = request.get_json(silent=True) or {}
+    urls = payload.get('urls') or request.form.get('urls', '').split()
+    title = (payload.get('title') or request.form.get('title') or '').strip() or 'Reading List'
+
+    urls = [u.strip() for u in urls if isinstance(u, str) and u.strip()]
+    if not urls:
+        return jsonify({'error': 'No URLs given'}), 400
+    if len(urls) > BATCH_MAX_URLS:
+        return jsonify({'error': f'At most {BATCH_MAX_URLS} URLs per batch'}), 400
+
+    job, _ = enqueue_batch(urls, current_user.kindle_email, title, user=current_user)
+    return jsonify({'status': 'queued', 'job': job.to_dict()}), 202
 
 
 @app.route('/settings', methods=['GET', 'POST'])
 @login_required
 def settings():
-    """User settings page - set Kindle email."""
+    """User settings page - set Kindle email, device and digest delivery."""
     if request.method == 'POST':
         kindle_email = request.form.get('kindle_email', '').strip()
         
@@ -162,32 +267,71 @@ def settings():
         if not kindle_email.endswith('@kindle.com'):
             flash('Kindle email should end with @kindle.com', 'warning')
         
-        # Update user's Kindle email
+        # Update user's Kindle email, device and digest preferences
         current_user.kindle_email = kindle_email
+        current_user.device_profile = device_profile(request.form.get('device_profile'))['name']
+        current_user.digest_enabled = request.form.get('digest_enabled') == 'on'
+        try:
+            current_user.digest_interval_hours = max(1, int(request.form.get('digest_interval_hours') or DIGEST_DEFAULT_INTERVAL_HOURS))
+            current_user.digest_max_articles = max(2, min(int(request.form.get('digest_max_articles') or DIGEST_DEFAULT_MAX_ARTICLES), BATCH_MAX_URLS))
+        except ValueError:
+            flash('Digest interval and size must be numbers.', 'error')
+            return redirect(url_for('settings'))
         db.session.commit()
         
-        flash('Kindle email saved successfully!', 'success')
+        flash('Settings saved successfully!', 'success')
         return redirect(url_for('index'))
     
     # Get the FROM_EMAIL for instructions
     from_email = os.environ.get('FROM_EMAIL', 'noreply@kindle.timour.xyz')
     
-    return render_template('settings.html', user=current_user, from_email=from_email)
+    return render_template('settings.html', user=current_user, from_email=from_email,
+                           devices=device_choices(), device=profile_for_user(current_user)['name'],
+                           digest_interval_hours=current_user.digest_interval_hours or DIGEST_DEFAULT_INTERVAL_HOURS,
+                           digest_max_articles=current_user.digest_max_articles or DIGEST_DEFAULT_MAX_ARTICLES,
+                           batch_max_urls=BATCH_MAX_URLS)
+
+
+@app.route('/history')
+@login_required
+def history():
+    """The user's past conversions, newest first, HISTORY_PAGE_SIZE per page."""
+    page = max(1, request.args.get('page', 1, type=int))
+    conversions, has_next = Conversion.history(current_user.id, page, HISTORY_PAGE_SIZE)
+    # EPUBs past the store's TTL are gone; ones evicted early for space are reported on click
+    downloadable_since = datetime.utcnow() - timedelta(seconds=EPUB_STORE_TTL)
+    return render_template('history.html', user=current_user, conversions=conversions, page=page,
+                           has_next=has_next, downloadable_since=downloadable_since)
 
 
-@app.route('/download/<filename>')
+@app.route('/download/<int:conversion_id>/<key>')
 @login_required
-def download(filename):
-    """Serve the EPUB file for download."""
-    filepath = os.path.join(OUTPUT_DIR, filename)
-    if os.path.exists(filepath):
-        return send_file(filepath, as_attachment=True, download_name=filename)
+def download(conversion_id, key):
+    """Serve an EPUB from one of the user's conversions, by its store key."""
+    conversion = db.session.get(Conversion, conversion_id)
+    if conversion is None or conversion.user_id != current_user.id or key not in conversion.epub_filenames:
+        abort(404)
+    filepath = get_epub_store().path_for(key)
+    if filepath:
+        return send_file(filepath, as_attachment=True, download_name=download_name(key))
     else:
-        flash('File not found', 'error')
-        return redirect(url_for('index'))
+        flash('File not found (downloads expire after a while)', 'error')
+        return redirect(url_for('history'))
 
 
 if __name__ == '__main__':
     port = int(os.environ.get("PORT", 8000))
     print(f"🚀 Starting Multi-User Kindle App on port {port}")
+
+    # The dev server sets up its own database; deploys run `flask --app web_app init-db`
+    with app.app_context():
+        init_db()
+    
+    # For local dev, optionally run the job worker in this process instead of worker.py
+    # (only in the reloader's child process, so jobs aren't claimed twice)
+    if os.environ.get('INPROCESS_WORKER') == '1' and os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        from app.jobs import JobWorker
+        from app.digest import DigestScheduler
+        JobWorker(app, scheduler=DigestScheduler(app)).start()
+    
     app.run(debug=True, host='0.0.0.0', port=port)
@@ -0,0 +1,24 @@
+#!/usr/bin/env python3
+"""
+Background worker for queued conversions.
+
+Runs alongside the web process (see Procfile) and works through the
+ConversionJob table: extract → build EPUB → send to Kindle. It also runs
+the digest scheduler that bundles held articles for digest-mode users.
+Locally it uses the same SQLite database as web_app.py.
+"""
+
+
+if __name__ == '__main__':
+    # Imported here so image transcode processes (spawned, which re-import
+    # this module) don't build a whole Flask app each.
+    import os
+    from web_app import app
+    from app.jobs import JobWorker
+    from app.digest import DigestScheduler
+    from app.metrics import serve_metrics
+
+    print("🚀 Starting conversion worker")
+    if os.environ.get('WORKER_METRICS_PORT'):
+        serve_metrics(int(os.environ['WORKER_METRICS_PORT']))
+    JobWorker(app, scheduler=DigestScheduler(app)).run_forever()